@@ -15,7 +15,7 @@
     # Check https://github.com/odoo/odoo/blob/15.0/odoo/addons/base/data/ir_module_category_data.xml
     # for the full list
     'category': 'Accounting',
-    'version': '17.0.1.0',
+    'version': '17.0.1.7',
 
     # any module necessary for this one to work correctly
     'depends': ['base', 'product', 'bus', 'account', 'sale', 'mail', 'stock', 'web', 'mrp', 'purchase',
@@ -42,6 +42,13 @@
         'views/smart_invoice_config.xml',
         'views/zra_smart_invoice.xml',
         'views/menu_view.xml',
+        'views/zra_outbox_views.xml',
+        'views/zra_vsdc_metric_views.xml',
+        'views/zra_vsdc_fingerprint_views.xml',
+        'views/zra_post_timing_views.xml',
+        'data/ir_sequence_data.xml',
+        'data/ir_config_parameter_data.xml',
+        'data/ir_cron_data.xml',
         'report/custom_invoice_report.xml',
         'report/custom_invoice_report_action.xml',
     ],
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
 
 # from . import controllers
-from . import account_payment
\ No newline at end of file
+from . import account_payment
+from . import metrics
@@ -0,0 +1,21 @@
+from odoo import http
+from odoo.http import request
+import hmac
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class ZraMetricsController(http.Controller):
+
+    @http.route('/zra/metrics', type='http', auth='none', methods=['GET'], csrf=False)
+    def metrics(self, token=None, **kwargs):
+        """VSDC metrics for Prometheus; disabled until zra_smart_invoice.metrics_token is set."""
+        expected = request.env['ir.config_parameter'].sudo().get_param('zra_smart_invoice.metrics_token')
+        if not token:
+            authorization = request.httprequest.headers.get('Authorization', '')
+            token = authorization[7:] if authorization.startswith('Bearer ') else None
+        if not expected or not token or not hmac.compare_digest(token, expected):
+            return request.not_found()
+        body = request.env['zra.vsdc.metric'].sudo()._prometheus()
+        return request.make_response(body, headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
@@ -0,0 +1,27 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Seed the zra.item.code sequence from the legacy item.code.sequence counter."""
+    if not version:
+        return
+    cr.execute("SELECT COALESCE(MAX(next_number), 1) FROM item_code_sequence")
+    next_number = cr.fetchone()[0]
+    # Codes end with the 7-digit number, never restart below one already in use
+    cr.execute("""
+        SELECT COALESCE(MAX(RIGHT("item_Cd", 7)::bigint), 0) + 1
+        FROM product_template
+        WHERE "item_Cd" ~ '[0-9]{7}$'
+    """)
+    next_number = max(next_number, cr.fetchone()[0])
+
+    cr.execute("SELECT id FROM ir_sequence WHERE code = 'zra.item.code' LIMIT 1")
+    row = cr.fetchone()
+    if not row:
+        _logger.warning("zra.item.code sequence not found, item numbers restart at 1")
+        return
+    cr.execute("SELECT setval(%s, %s, false)", (f'ir_sequence_{row[0]:03d}', next_number))
+    cr.execute("UPDATE ir_sequence SET number_next = %s WHERE id = %s", (next_number, row[0]))
+    _logger.info(f"zra.item.code sequence seeded at {next_number}")
@@ -0,0 +1,5 @@
+def migrate(cr, version):
+    """Store blank item codes as NULL before the unique constraint on item_Cd is created."""
+    if not version:
+        return
+    cr.execute("UPDATE product_template SET \"item_Cd\" = NULL WHERE \"item_Cd\" = ''")
@@ -0,0 +1,11 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Drop the base64 QR images stored on account_move, they are now rendered into attachments."""
+    if not version:
+        return
+    cr.execute("ALTER TABLE account_move DROP COLUMN IF EXISTS qr_code_image")
+    _logger.info("Dropped account_move.qr_code_image, QR codes are re-rendered by the QR cron")
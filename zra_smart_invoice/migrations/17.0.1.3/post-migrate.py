@@ -0,0 +1,21 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Link existing moves to the sale order named in their invoice origin."""
+    if not version:
+        return
+    cr.execute("""
+        UPDATE account_move move
+        SET zra_sale_order_id = sale_order.id
+        FROM (
+            SELECT DISTINCT ON (name) name, id
+            FROM sale_order
+            ORDER BY name, id
+        ) AS sale_order
+        WHERE move.invoice_origin = sale_order.name
+          AND move.zra_sale_order_id IS NULL
+    """)
+    _logger.info(f"Linked {cr.rowcount} moves to their sale order")
@@ -0,0 +1,35 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Copy the declaration keys onto the existing import lines.
+
+    Only one line per (task_cd, dcl_no, item_seq) gets them, so that duplicates
+    left by the old per-item fetch do not break the unique constraint.
+    """
+    if not version:
+        return
+    cr.execute("""
+        UPDATE import_item item
+        SET task_cd = line.task_cd,
+            dcl_no = line.dcl_no
+        FROM (
+            SELECT DISTINCT ON (data.task_cd, data.dcl_no, item.item_seq)
+                   item.id, data.task_cd, data.dcl_no
+            FROM import_item item
+            JOIN import_data data ON data.id = item.import_id
+            WHERE data.task_cd IS NOT NULL AND data.dcl_no IS NOT NULL
+            ORDER BY data.task_cd, data.dcl_no, item.item_seq, item.id
+        ) AS line
+        WHERE item.id = line.id
+          AND NOT EXISTS (
+              SELECT 1 FROM import_item other
+              WHERE other.task_cd = line.task_cd
+                AND other.dcl_no = line.dcl_no
+                AND other.item_seq = item.item_seq
+                AND other.id != item.id
+          )
+    """)
+    _logger.info(f"Set the declaration keys of {cr.rowcount} import lines")
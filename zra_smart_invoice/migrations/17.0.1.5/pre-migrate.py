@@ -0,0 +1,28 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Clear duplicate item codes so the unique constraint on item_Cd can be created.
+
+    The oldest product keeps the code; the others get a new one on their next ZRA sync.
+    """
+    if not version:
+        return
+    cr.execute("UPDATE product_template SET \"item_Cd\" = NULL WHERE \"item_Cd\" = ''")
+    cr.execute("""
+        UPDATE product_template template
+        SET "item_Cd" = NULL
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY "item_Cd" ORDER BY id) AS position
+            FROM product_template
+            WHERE "item_Cd" IS NOT NULL
+        ) AS ranked
+        WHERE template.id = ranked.id
+          AND ranked.position > 1
+        RETURNING template.id
+    """)
+    cleared = [row[0] for row in cr.fetchall()]
+    if cleared:
+        _logger.warning(f"Cleared duplicate item codes on product templates {cleared}")
@@ -0,0 +1,34 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+PARAMS = {
+    'classification_last_req_dt': 'zra_smart_invoice.classification_last_req_dt',
+    'code_last_req_dt': 'zra_smart_invoice.code_last_req_dt',
+}
+
+
+def migrate(cr, version):
+    """Move the reference data lastReqDt from res.company to global parameters.
+
+    The tables are shared, so the most recent sync of any company is the watermark.
+    """
+    if not version:
+        return
+    for column, key in PARAMS.items():
+        cr.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'res_company' AND column_name = %s
+        """, (column,))
+        if not cr.fetchone():
+            continue
+        cr.execute(f"SELECT MAX({column}) FROM res_company")
+        value = cr.fetchone()[0]
+        if not value:
+            continue
+        cr.execute("""
+            INSERT INTO ir_config_parameter (key, value, create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, 1, now() at time zone 'UTC', 1, now() at time zone 'UTC')
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """, (key, value))
+        _logger.info(f"{key} set to {value}")
@@ -0,0 +1,21 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Give the existing purchase data the company of the user who fetched them."""
+    if not version:
+        return
+    cr.execute("""
+        UPDATE purchase_data data
+        SET company_id = users.company_id
+        FROM res_users users
+        WHERE data.company_id IS NULL AND users.id = data.create_uid
+    """)
+    _logger.info(f"Set the company of {cr.rowcount} purchase data records")
+    cr.execute("""
+        UPDATE purchase_data
+        SET company_id = (SELECT MIN(id) FROM res_company)
+        WHERE company_id IS NULL
+    """)
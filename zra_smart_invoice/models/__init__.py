@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 from . import purchase_no_si
+from . import vsdc_metrics
+from . import vsdc_client
+from . import vsdc_fingerprint
 from . import endpoints
 from . import purchase_si
 from . import config
@@ -16,3 +19,8 @@ from . import scrap
 from . import sales_order
 from . import company
 from . import zra_smart_invoice
+from . import outbox
+from . import vsdc_staging
+from . import stock_quant
+from . import currency_rate
+from . import post_timing
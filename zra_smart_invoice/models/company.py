@@ -7,3 +7,18 @@ class ResCompany(models.Model):
     tpin = fields.Char(string="TPIN")
     bhf_id = fields.Char(string="Branch ID")
     org_sdc_id = fields.Char(string="Original SDC ID")
+
+    # Base URL of tools/vsdc_simulator.py, for load and regression testing
+    zra_simulator_url = fields.Char(string="VSDC Simulator URL", default="http://127.0.0.1:8099/sandbox")
+
+    def action_use_vsdc_simulator(self):
+        """Point every VSDC endpoint of the company at the local simulator, keeping the endpoint paths."""
+        for company in self:
+            base_url = (company.zra_simulator_url or '').rstrip('/')
+            vals = {}
+            for name, field in company._fields.items():
+                if name.endswith('_endpoint') and field.type == 'char' and company[name]:
+                    path = '/'.join(company[name].split('?')[0].rstrip('/').split('/')[-2:])
+                    vals[name] = f'{base_url}/{path}'
+            company.write(vals)
+        return True
@@ -106,11 +106,19 @@ class ResConfigSettings(models.TransientModel):
 
 
     def fetch_data(self):
-        self.env['zra.item.data'].fetch_and_store_classification_data()
-        common_data = self.env['code.data'].fetch_common_code_data()
-        self.env['quantity.unit.data'].store_quantity_data(common_data)
-        self.env['packaging.unit.data'].store_packaging_data(common_data)
-        self.env['country.data'].store_country_data(common_data)
+        classification_synced = self.env['zra.item.data'].fetch_and_store_classification_data()
+        codes_synced = self.env['code.data'].sync_common_code_data()
+        if not (classification_synced and codes_synced):
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': 'Warning',
+                    'message': 'Some ZRA data could not be fetched. Check the server log and try again.',
+                    'type': 'warning',
+                    'sticky': False,
+                }
+            }
         _logger.info("Data fetched and stored successfully.")
 
         print(f"Endpoint 1 hit {self.endpoint_hit_counts['endpoint_1']} time(s)")
@@ -1,10 +1,48 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError, UserError
+from datetime import timedelta
 import logging
 import requests
+from .vsdc_client import VsdcUnavailable
 
 _logger = logging.getLogger(__name__)
 
+# Fields sent in the saveItem/updateItem payload: only changes to these need a ZRA sync
+ZRA_ITEM_FIELDS = {
+    'name', 'item_Cd', 'classification', 'item_cls_cd', 'si_detailed_type', 'cdNm', 'cd',
+    'packaging_data_cdNm', 'packaging_unit_cd', 'quantity_unit_cdNm', 'quantity_unit_cd',
+    'taxes_id', 'list_price', 'use_yn',
+}
+ITEM_SYNC_WINDOW_PARAM = 'zra_smart_invoice.item_sync_window'
+DEFAULT_ITEM_SYNC_WINDOW = 30
+
+
+class ZraProductLookup(object):
+    """Item name / item code to template, variant and on-hand quantity, resolved up front."""
+
+    def __init__(self, templates, variants, quantities):
+        self._by_name = {}
+        self._by_code_name = {}
+        for template in templates:
+            self._by_name.setdefault(template.name, template)
+            self._by_code_name.setdefault((template.item_Cd, template.name), template)
+        self._variants = variants
+        self._quantities = quantities
+        self._empty = templates.browse()
+
+    def template(self, name, item_cd=None):
+        if item_cd is None:
+            return self._by_name.get(name, self._empty)
+        return self._by_code_name.get((item_cd, name), self._empty)
+
+    def product(self, name, item_cd=None):
+        template = self.template(name, item_cd)
+        return self._variants.get(template.id) if template else None
+
+    def quantity(self, name, item_cd=None):
+        product = self.product(name, item_cd)
+        return self._quantities.get(product.id, 0) if product else 0
+
 
 class ProductTemplate(models.Model):
     _inherit = 'product.template'
@@ -21,7 +59,7 @@ class ProductTemplate(models.Model):
     packaging_unit_cd = fields.Char(string='Packaging Code', readonly=True, store=True)
     cdNm = fields.Many2one('country.data', string='Country')
     cd = fields.Char(string='Origin Country Code', readonly=True, store=True)
-    item_Cd = fields.Char(string='Item Code', readonly=False, store=True)
+    item_Cd = fields.Char(string='Item Code', readonly=False, store=True, index=True)
     si_detailed_type = fields.Selection(
         selection=[
             ('2', 'Finished Product'),
@@ -39,10 +77,66 @@ class ProductTemplate(models.Model):
     )
 
     is_updating = fields.Boolean(default=False, store=False)
+    zra_sync_state = fields.Selection([
+        ('synced', 'Synced'),
+        ('pending', 'Pending'),
+        ('failed', 'Failed'),
+    ], string='ZRA Sync Status', default='synced', index=True, copy=False)
+    zra_sync_action = fields.Selection([
+        ('register', 'Register'),
+        ('update', 'Update'),
+    ], string='ZRA Sync Action', default='update', copy=False,
+        help='Registration (saveItem) is deferred for products created in bulk, see _zra_defer_registration.')
+    zra_sync_requested_at = fields.Datetime(string='ZRA Sync Requested At', copy=False)
+    # Who asked for the sync and for which taxpayer: the cron sends it on their behalf
+    zra_sync_user_id = fields.Many2one('res.users', string='ZRA Sync Requested By', copy=False)
+    zra_sync_company_id = fields.Many2one('res.company', string='ZRA Sync Company', copy=False)
+    zra_sync_error = fields.Text(string='ZRA Sync Error', copy=False)
+
+    # Empty codes are stored as NULL; the column name is mixed case and must be quoted
+    _sql_constraints = [
+        ('item_cd_unique', 'unique("item_Cd")', 'Item code already exists. Please choose a different code.'),
+    ]
+
+    def init(self):
+        # Item names are matched exactly on import/purchase confirmation
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS product_template_name_en_us_index
+            ON product_template ((name->>'en_US'))
+        """)
+
+    @api.model
+    def _zra_lookup_products(self, names=(), item_codes=(), location=None):
+        """Resolve item names (and item codes) in three queries: templates, variants, quants.
+
+        Quantities are summed per variant at ``location`` (default WH/Stock).
+        """
+        names = list({name for name in names if name})
+        item_codes = list({code for code in item_codes if code})
+        domain = []
+        if names and item_codes:
+            domain = ['|', ('name', 'in', names), ('item_Cd', 'in', item_codes)]
+        elif names:
+            domain = [('name', 'in', names)]
+        elif item_codes:
+            domain = [('item_Cd', 'in', item_codes)]
+        if not domain:
+            return ZraProductLookup(self.browse(), {}, {})
+
+        templates = self.with_context(lang='en_US').search(domain)
+        variants = {}
+        for variant in self.env['product.product'].search([('product_tmpl_id', 'in', templates.ids)]):
+            variants.setdefault(variant.product_tmpl_id.id, variant)
+
+        if location is None:
+            location = self.env.ref('stock.stock_location_stock')
+        variant_ids = [variant.id for variant in variants.values()]
+        quantities = self.env['stock.quant']._zra_on_hand(self.env['product.product'].browse(variant_ids), location)
+        return ZraProductLookup(templates, variants, quantities)
 
     def copy(self, default=None):
-        # Set item code to blank during duplication
-        default = dict(default or {}, item_Cd="")
+        # Leave the item code empty on the duplicate, a new one is allocated when it is registered
+        default = dict(default or {}, item_Cd=False)
         return super(ProductTemplate, self).copy(default)
 
     @api.onchange('si_detailed_type')
@@ -84,40 +178,22 @@ class ProductTemplate(models.Model):
             detailed_type_field['selection'] = selection
         return res
 
+    @api.model
+    def _zra_next_item_number(self):
+        """Next 7-digit item number, drawn from a PostgreSQL sequence.
+
+        ``nextval`` never blocks and never hands out the same value twice, so
+        concurrent allocations need neither a row lock nor a retry loop.
+        Numbers lost to rolled back transactions are simply skipped.
+        """
+        return self.env['ir.sequence'].sudo().next_by_code('zra.item.code')
+
     def generate_item_code(self, cd, product_type, packaging_unit, quantity_unit):
         cd = cd if cd else "ISW"
         product_type = product_type if product_type else ""
         packaging_unit = packaging_unit if packaging_unit else ""
         quantity_unit = quantity_unit if quantity_unit else ""
-
-        # Generate the initial item code
-        sequence = self.env['item.code.sequence'].search([], limit=1)
-        if not sequence:
-            sequence = self.env['item.code.sequence'].create({})
-
-        next_number = sequence.next_number
-        next_number_str = str(next_number).zfill(7)  # 7-digit zero-padded number
-        item_code = f"{cd}{product_type}{packaging_unit}{quantity_unit}{next_number_str}"
-
-        # Check if item code already exists
-        existing_code = self.env['product.template'].search([('item_Cd', '=', item_code)], limit=1)
-        if existing_code:
-            if self._context.get('is_create', False):  # Check if it's a create operation
-                # Increment the number to make the code unique
-                while self.env['product.template'].search([('item_Cd', '=', item_code)], limit=1):
-                    next_number += 1
-                    next_number_str = str(next_number).zfill(7)
-                    item_code = f"{cd}{product_type}{packaging_unit}{quantity_unit}{next_number_str}"
-
-                # Update the sequence to the new next number
-                sequence.next_number = next_number + 1
-            else:  # If it's a write operation, raise a validation error
-                raise ValidationError(_('Item code "%s" already exists. Please choose a different code.') % item_code)
-
-        # Save the sequence for future use
-        sequence.next_number += 1
-
-        return item_code
+        return f"{cd}{product_type}{packaging_unit}{quantity_unit}{self._zra_next_item_number()}"
 
     @api.onchange('classification')
     def _onchange_classification(self):
@@ -156,9 +232,37 @@ class ProductTemplate(models.Model):
             self.cd = False
 
     @api.model
-    def create(self, vals):
+    def _zra_defer_registration(self):
+        """Products created by CSV imports and VSDC import/purchase flows are registered
+        by the item sync cron instead of one saveItem call each inside the transaction."""
+        return bool(self.env.context.get('zra_defer_registration') or self.env.context.get('import_file'))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        defer = self._zra_defer_registration()
+        for vals in vals_list:
+            self._prepare_create_vals(vals)
+            if defer:
+                vals.update(self._zra_sync_request_vals(), zra_sync_action='register')
+
+        records = super(ProductTemplate, self.with_context(is_create=True)).create(vals_list)
+        if defer:
+            _logger.info(f"{len(records)} product(s) created, ZRA registration deferred")
+            self._trigger_item_sync(delay=False)
+            return records.with_env(self.env)
+        for record, vals in zip(records, vals_list):
+            # record.validate_single_tax()
+            # record.validate_taxes()
+            record._handle_post_item_data(vals, is_create=True)
+            _logger.info("Product created with ID: %s", record.id)
+        return records.with_env(self.env)
+
+    @api.model
+    def _prepare_create_vals(self, vals):
         _logger.info("Creating product with values: %s", vals)
         vals['is_updating'] = False
+        if 'item_Cd' in vals and not vals['item_Cd']:
+            vals['item_Cd'] = False
 
         # Ensure that classification, quantity, and packaging codes are properly set before validation
         if 'classification' in vals:
@@ -179,68 +283,198 @@ class ProductTemplate(models.Model):
         if 'cdNm' in vals:
             country = self.env['country.data'].browse(vals['cdNm'])
             vals['cd'] = country.country_cd
-
-        record = super(ProductTemplate, self.with_context(is_create=True)).create(vals)
-        # record.validate_single_tax()
-        # record.validate_taxes()
-        record._handle_post_item_data(vals, is_create=True)
-        _logger.info("Product created with ID: %s", record.id)
-        return record
+        return vals
 
     @api.model
     def write(self, vals):
-        if self.env.context.get('is_create', False):
+        if self.env.context.get('is_create', False) or self.env.context.get('zra_item_sync', False):
             return super(ProductTemplate, self).write(vals)
 
-        # If 'item_Cd' is in vals, validate for each record individually
-        if 'item_Cd' in vals:
-            for record in self:
-                existing = self.env['product.template'].search([
-                    ('item_Cd', '=', vals['item_Cd']),
-                    ('id', '!=', record.id)
-                ], limit=1)
-                if existing:
-                    raise ValidationError(
-                        _('Item code "%s" already exists. Please choose a different code.') % vals['item_Cd']
-                    )
+        # If 'item_Cd' is in vals, make sure no other product uses it
+        if vals.get('item_Cd'):
+            existing = self.env['product.template'].search([
+                ('item_Cd', '=', vals['item_Cd']),
+                ('id', 'not in', self.ids)
+            ], limit=1)
+            if existing:
+                raise ValidationError(
+                    _('Item code "%s" already exists. Please choose a different code.') % vals['item_Cd']
+                )
 
         _logger.info("Updating products with values: %s", vals)
 
-        # Iterate over each record to prepare vals
-        for record in self:
-            record_vals = vals.copy()
-
-            if 'cdNm' in vals:
-                country = self.env['country.data'].browse(vals['cdNm'])
-                record_vals['cd'] = country.country_cd
+        # The derived codes only depend on vals, resolve them once for all records
+        vals = vals.copy()
+        if 'cdNm' in vals:
+            country = self.env['country.data'].browse(vals['cdNm'])
+            vals['cd'] = country.country_cd
 
-            if 'classification' in vals:
-                classification = self.env['zra.item.data'].browse(vals['classification'])
-                record_vals.update({
-                    'item_cls_cd': classification.itemClsCd,
-                    'item_cls_lvl': classification.itemClsLvl,
-                    'tax_ty_cd': classification.taxTyCd,
-                    'mjr_tg_yn': classification.mjrTgYn,
-                    'use_yn': classification.useYn
-                })
+        if 'classification' in vals:
+            classification = self.env['zra.item.data'].browse(vals['classification'])
+            vals.update({
+                'item_cls_cd': classification.itemClsCd,
+                'item_cls_lvl': classification.itemClsLvl,
+                'tax_ty_cd': classification.taxTyCd,
+                'mjr_tg_yn': classification.mjrTgYn,
+                'use_yn': classification.useYn
+            })
 
-            if 'quantity_unit_cdNm' in vals:
-                quantity_unit = self.env['quantity.unit.data'].browse(vals['quantity_unit_cdNm'])
-                record_vals['quantity_unit_cd'] = quantity_unit.quantity_unit_cd
+        if 'quantity_unit_cdNm' in vals:
+            quantity_unit = self.env['quantity.unit.data'].browse(vals['quantity_unit_cdNm'])
+            vals['quantity_unit_cd'] = quantity_unit.quantity_unit_cd
 
-            if 'packaging_data_cdNm' in vals:
-                packaging_unit = self.env['packaging.unit.data'].browse(vals['packaging_data_cdNm'])
-                record_vals['packaging_unit_cd'] = packaging_unit.packaging_unit_cd
+        if 'packaging_data_cdNm' in vals:
+            packaging_unit = self.env['packaging.unit.data'].browse(vals['packaging_data_cdNm'])
+            vals['packaging_unit_cd'] = packaging_unit.packaging_unit_cd
 
-            # Update the record with the prepared vals
-            super(ProductTemplate, record).write(record_vals)
+        # Stock, image or description edits do not concern ZRA. For the others, the
+        # updateItem call is coalesced per product and sent by the item sync cron.
+        needs_sync = bool(ZRA_ITEM_FIELDS.intersection(vals))
+        if needs_sync:
+            vals.update(self._zra_sync_request_vals())
 
-            # Handle post item data for each record
-            record._handle_post_item_data(record_vals, is_create=False)
+        super(ProductTemplate, self).write(vals)
+        if needs_sync:
+            self._trigger_item_sync()
 
         _logger.info("Products updated with IDs: %s", self.ids)
         return True
 
+    @api.model
+    def _zra_sync_request_vals(self):
+        return {
+            'zra_sync_state': 'pending',
+            'zra_sync_requested_at': fields.Datetime.now(),
+            'zra_sync_user_id': self.env.uid,
+            'zra_sync_company_id': self.env.company.id,
+        }
+
+    @api.model
+    def _item_sync_window(self):
+        try:
+            return int(self.env['ir.config_parameter'].sudo().get_param(ITEM_SYNC_WINDOW_PARAM,
+                                                                         DEFAULT_ITEM_SYNC_WINDOW))
+        except (TypeError, ValueError):
+            return DEFAULT_ITEM_SYNC_WINDOW
+
+    @api.model
+    def _trigger_item_sync(self, delay=True):
+        cron = self.env.ref('zra_smart_invoice.ir_cron_zra_item_sync', raise_if_not_found=False)
+        if cron:
+            at = fields.Datetime.now()
+            if delay:
+                at += timedelta(seconds=self._item_sync_window())
+            cron._trigger(at=at)
+
+    @api.model
+    def _cron_sync_zra_items(self, limit=500, batch_size=50):
+        """Send one saveItem/updateItem per pending product, batch by batch.
+
+        Products still being edited (changed within the sync window) wait for
+        the next run, so a burst of edits results in a single call. Deferred
+        registrations are sent right away.
+        """
+        settle = fields.Datetime.now() - timedelta(seconds=self._item_sync_window())
+        products = self.search([('zra_sync_state', '=', 'pending'),
+                                '|', ('zra_sync_action', '=', 'register'),
+                                ('zra_sync_requested_at', '<=', settle)],
+                               limit=limit, order='zra_sync_requested_at, id')
+        total = len(products)
+        _logger.info(f'Syncing {total} products with ZRA')
+        # Sent for the taxpayer the product belongs to, see _sync_zra_items for the user
+        groups = {}
+        for product in products:
+            company = product.company_id or product.zra_sync_company_id or self.env.company
+            groups.setdefault(company, []).append(product.id)
+        done = 0
+        for company, product_ids in groups.items():
+            group = self.with_company(company).browse(product_ids)
+            for start in range(0, len(group), batch_size):
+                group[start:start + batch_size]._sync_zra_items()
+                # Each batch is kept even if a later one fails
+                self.env.cr.commit()
+                done += len(group[start:start + batch_size])
+                _logger.info(f'ZRA item sync: {done}/{total} products processed')
+        if self.search_count([('zra_sync_state', '=', 'pending')], limit=1):
+            self._trigger_item_sync()
+
+    def _sync_zra_items(self):
+        """Send the pending registrations and updates concurrently through the VSDC client,
+        then record each outcome."""
+        config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
+        urls = {'register': config_settings.inventory_endpoint, 'update': config_settings.inventory_update_endpoint}
+        fingerprints = self.env['zra.vsdc.fingerprint']
+        products, payloads = self.browse().with_context(zra_item_sync=True), []
+        for product in self.with_context(zra_item_sync=True):
+            url = urls[product.zra_sync_action or 'update']
+            if not url:
+                _logger.error(f"Inventory endpoint for {product.zra_sync_action} is not set, ZRA item sync skipped.")
+                continue
+            if not product.item_Cd:
+                product.item_Cd = product.generate_item_code(product.cd, '2', product.packaging_unit_cd,
+                                                             product.quantity_unit_cd)
+            # regr/modr: the user who made the change, not the cron user
+            payload = product._zra_item_payload(url, user=product.zra_sync_user_id)
+            if fingerprints.is_unchanged(url, product.item_Cd, payload):
+                # Edited back and forth, the VSDC already has this content
+                product.write({'zra_sync_state': 'synced', 'zra_sync_action': 'update', 'zra_sync_error': False})
+                continue
+            products |= product
+            payloads.append((url, payload))
+        calls = [(url, {'json': payload, 'headers': {'Content-Type': 'application/json'}})
+                 for url, payload in payloads]
+        results = self.env['zra.vsdc.client'].post_many(calls)
+        for product, (url, payload), (response, error) in zip(products, payloads, results):
+            if isinstance(error, VsdcUnavailable):
+                # Not attempted, keep it pending for the next run
+                product.zra_sync_error = str(error)
+                continue
+            try:
+                if error:
+                    raise error
+                response.raise_for_status()
+                result_data = response.json()
+                result_cd = result_data.get('resultCd', 'No result code returned')
+                result_msg = result_data.get('resultMsg', 'No result message returned')
+                if result_cd != '000':
+                    raise UserError(f"API Error - {result_msg} (Result Code: {result_cd})")
+            except (requests.exceptions.RequestException, ValueError, UserError) as e:
+                error_message = str(e)
+                product.write({'zra_sync_state': 'failed', 'zra_sync_error': error_message})
+                product.message_post(
+                    body=f"Exception occurred: {error_message}\nProduct Name: {product.name}, "
+                         f"Classification Code: {product.item_cls_cd}")
+                continue
+            action = 'registered' if product.zra_sync_action == 'register' else 'updated'
+            try:
+                with self.env.cr.savepoint():
+                    fingerprints.remember(url, product.item_Cd, payload)
+                    product.write({'zra_sync_state': 'synced', 'zra_sync_action': 'update',
+                                   'zra_sync_error': False})
+                    product.message_post(
+                        body=f"API Response Item {action}: {result_msg}, \nProduct Name: {product.name}, "
+                             f"Classification Code: {product.item_cls_cd}")
+            except Exception as e:
+                # The VSDC has the item: never send it as a new registration again
+                _logger.exception(f'ZRA item sync: could not record the result of product {product.id}')
+                product.write({'zra_sync_state': 'synced', 'zra_sync_action': 'update',
+                               'zra_sync_error': f'Item {action}, but the result could not be recorded: {e}'})
+
+    def action_zra_retry_sync(self):
+        """Queue the selected products again for the item sync cron, e.g. after failed registrations."""
+        products = self.filtered(lambda p: p.zra_sync_state != 'synced')
+        products.with_context(zra_item_sync=True).write(self._zra_sync_request_vals())
+        self._trigger_item_sync(delay=False)
+        return True
+
+    def action_zra_sync_now(self):
+        self.with_context(zra_item_sync=True).write(self._zra_sync_request_vals())
+        # An explicit sync is sent even if the content was already acknowledged
+        for company in self.company_id:
+            self.filtered(lambda p: p.company_id == company).with_company(company).with_context(
+                zra_force_send=True)._sync_zra_items()
+        self.filtered(lambda p: not p.company_id).with_context(zra_force_send=True)._sync_zra_items()
+        return True
 
     def _handle_post_item_data(self, vals, is_create):
         self.ensure_one()
@@ -267,16 +501,48 @@ class ProductTemplate(models.Model):
 
     def _post_item_data(self, vals, url, success_message):
         self.ensure_one()
-        config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
-        company = self.env.company
-        current_user = self.env.user
         if not self.item_Cd:
             self.item_Cd = self.generate_item_code(self.cd, '2', self.packaging_unit_cd, self.quantity_unit_cd)
 
         if not url:
             raise ValidationError("URL is not set. Please configure the URL in settings.")
 
-            # Determine if it's a create operation based on the presence of 'createItem' in the URL
+        payload = self._zra_item_payload(url)
+        headers = {'Content-Type': 'application/json'}
+        print(payload)
+        fingerprints = self.env['zra.vsdc.fingerprint']
+        if fingerprints.is_unchanged(url, self.item_Cd, payload):
+            _logger.info(f"Item {self.item_Cd} unchanged since its last acknowledgement, not sent again")
+            return
+
+        try:
+            response = self.env['zra.vsdc.client'].post(url, json=payload, headers=headers)
+            response.raise_for_status()
+            result_data = response.json()
+            result_msg = result_data.get("resultMsg")
+
+            result_cd = result_data.get('resultCd', 'No result code returned')
+            result_msg = result_data.get('resultMsg', 'No result message returned')
+
+            if result_cd != '000':
+                raise UserError(f"API Error - {result_msg} (Result Code: {result_cd})")
+
+            fingerprints.remember(url, self.item_Cd, payload)
+            self.message_post(
+                body=f"{success_message}: {result_msg}, \nProduct Name: {self.name}, Classification Code: {self.item_cls_cd}")
+            self.action_client_action(result_msg, 'success')
+        except requests.exceptions.RequestException as e:
+            error_message = str(e)
+            # self.print(vals, error_message)
+            self.message_post(
+                body=f"Exception occurred: {error_message}\nProduct Name: {self.name}, Classification Code: {self.item_cls_cd}")
+            self.action_client_action(error_message, 'danger')
+
+    def _zra_item_payload(self, url, user=None):
+        self.ensure_one()
+        company = self.env.company
+        current_user = user or self.env.user
+        # Determine if it's a create operation based on the presence of 'createItem' in the URL
         is_create = "createItem" in url
 
         payload = {
@@ -303,7 +569,6 @@ class ProductTemplate(models.Model):
             "modrNm": current_user.name,
             "modrId": current_user.id
         }
-        headers = {'Content-Type': 'application/json'}
 
         # Additional payload modifications for update cases
         if not is_create:
@@ -322,29 +587,7 @@ class ProductTemplate(models.Model):
                 "tlCatCd": "TL",
                 "exciseTxCatCd": "EXEEG"
             })
-        print(payload)
-
-        try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            result_data = response.json()
-            result_msg = result_data.get("resultMsg")
-
-            result_cd = result_data.get('resultCd', 'No result code returned')
-            result_msg = result_data.get('resultMsg', 'No result message returned')
-
-            if result_cd != '000':
-                raise UserError(f"API Error - {result_msg} (Result Code: {result_cd})")
-
-            self.message_post(
-                body=f"{success_message}: {result_msg}, \nProduct Name: {self.name}, Classification Code: {self.item_cls_cd}")
-            self.action_client_action(result_msg, 'success')
-        except requests.exceptions.RequestException as e:
-            error_message = str(e)
-            # self.print(vals, error_message)
-            self.message_post(
-                body=f"Exception occurred: {error_message}\nProduct Name: {self.name}, Classification Code: {self.item_cls_cd}")
-            self.action_client_action(error_message, 'danger')
+        return payload
 
     def action_client_action(self, message, message_type):
         return {
@@ -359,6 +602,8 @@ class ProductTemplate(models.Model):
         }
 
 class ItemCodeSequence(models.Model):
+    # Legacy counter, superseded by the zra.item.code ir.sequence. Only read
+    # by the 17.0.1.1 migration to seed that sequence.
     _name = 'item.code.sequence'
     _description = 'Item Code Sequence'
 
@@ -53,28 +53,24 @@ class AccountMoveReversal(models.TransientModel):
         if from_currency == to_currency:
             return 1.0
 
-        rate = self.env['res.currency.rate'].search([
-            ('currency_id', '=', from_currency.id),
-            ('name', '<=', fields.Date.today())
-        ], order='name desc', limit=1)
+        company = self.env.company
+        today = fields.Date.today()
+        rate = self.env['res.currency.rate']._zra_rate_values(company.id, from_currency.id, today)
 
         if not rate:
             raise ValidationError(f"No exchange rate found for {from_currency.name} to {to_currency.name}.")
 
         # Assuming ZMW is the company currency, we need to get the inverse rate if needed.
-        if to_currency == self.env.company.currency_id:
-            return rate.rate
+        if to_currency == company.currency_id:
+            return rate[0]
 
         # If the to_currency is not the company currency, calculate the rate to the company currency and then to the target currency.
-        to_rate = self.env['res.currency.rate'].search([
-            ('currency_id', '=', to_currency.id),
-            ('name', '<=', fields.Date.today())
-        ], order='name desc', limit=1)
+        to_rate = self.env['res.currency.rate']._zra_rate_values(company.id, to_currency.id, today)
 
         if not to_rate:
             raise ValidationError(f"No exchange rate found for {to_currency.name}.")
 
-        return rate.rate / to_rate.rate
+        return rate[0] / to_rate[0]
 
     def get_tax_rate(self, tax):
         return tax.amount if tax else 0.0
@@ -117,7 +113,7 @@ class AccountMoveReversal(models.TransientModel):
         print(f'Fetched Reversal Reason: {reversal_reason}')
 
         # Fetch the related sale order to get the LPO and export country code
-        sale_order = self.env['sale.order'].search([('name', '=', credit_move.invoice_origin)], limit=1)
+        sale_order = credit_move.zra_sale_order_id
         lpo = sale_order.lpo if sale_order else None
         export_country_code = sale_order.export_country_id.code if sale_order and sale_order.export_country_id else None
 
@@ -271,7 +267,7 @@ class AccountMoveReversal(models.TransientModel):
         print(f'Fetched Reversal Reason: {reversal_reason}')
 
         # Fetch the related sale order to get the LPO and export country code
-        sale_order = self.env['sale.order'].search([('name', '=', credit_move.invoice_origin)], limit=1)
+        sale_order = credit_move.zra_sale_order_id
         lpo = sale_order.lpo if sale_order else None
         export_country_code = sale_order.export_country_id.code if sale_order and sale_order.export_country_id else None
         for move in self.move_ids:
@@ -340,15 +336,8 @@ class AccountMoveReversal(models.TransientModel):
             move.message_post(body=f"API Response New Endpoint: {result_msg_new_endpoint}")
             # print(f"Save Stock Item API Response: {result_msg_new_endpoint}")
 
-            for line in credit_move.invoice_line_ids:
-                # Fetch the available quantity from the stock quant model
-                available_quants = self.env['stock.quant'].search([
-                    ('product_id', '=', line.product_id.id),
-                    ('location_id.usage', '=', 'internal')
-                ])
-                available_qty = sum(quant.quantity for quant in available_quants)
-
-                remaining_qty = available_qty + line.quantity
+            # Remaining quantity per line, from one grouped read of the internal stock
+            on_hand = self.env['stock.quant']._zra_on_hand(credit_move.invoice_line_ids.product_id)
 
             payload_stock = {
                 "tpin": company.tpin,
@@ -360,7 +349,7 @@ class AccountMoveReversal(models.TransientModel):
                 "stockItemList": [
                     {
                         "itemCd": line.product_id.product_tmpl_id.item_Cd,
-                        "rsdQty": remaining_qty
+                        "rsdQty": on_hand.get(line.product_id.id, 0.0) + line.quantity
                     } for line in credit_move.invoice_line_ids
                 ]
             }
@@ -371,7 +360,7 @@ class AccountMoveReversal(models.TransientModel):
 
     def _post_to_api(self, url, payload, success_message_prefix):
         try:
-            response = requests.post(url, json=payload)
+            response = self.env['zra.vsdc.client'].post(url, json=payload)
             response.raise_for_status()
             result_msg = response.json().get('resultMsg', 'No result message returned')
             _logger.info(f'{success_message_prefix}: {result_msg}')
@@ -0,0 +1,43 @@
+from odoo import models, api, tools
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class ResCurrencyRate(models.Model):
+    _inherit = 'res.currency.rate'
+
+    @api.model
+    @tools.ormcache('company_id', 'currency_id', 'date')
+    def _zra_rate_values(self, company_id, currency_id, date):
+        """(rate, inverse_company_rate) of the latest rate on or before date, or None.
+
+        Cached per (company, currency, day); any change to a rate clears the cache.
+        """
+        rate = self.sudo().with_company(company_id).search([
+            ('currency_id', '=', currency_id),
+            ('company_id', 'in', [company_id, False]),
+            ('name', '<=', date)
+        ], order='name desc', limit=1)
+        if not rate:
+            return None
+        return rate.rate, rate.inverse_company_rate
+
+    # Cleared once the change is written, so a concurrent read cannot cache the old rate
+    # back. This drops every ormcache of the 'default' group, on all workers, not only
+    # _zra_rate_values; the other cache groups (assets, templates, ...) are kept.
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env.registry.clear_cache('default')
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache('default')
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache('default')
+        return res
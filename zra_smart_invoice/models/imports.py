@@ -4,16 +4,12 @@ import requests
 import json
 import logging
 from datetime import datetime
+from . import vsdc_stream
 
 _logger = logging.getLogger(__name__)
 
-
-compute_fetch_selection_counter = 0
-fetch_import_data_counter = 0
-
-# Initialize cache
-compute_fetch_selection_cache = None
-compute_fetch_selection_last_request = None
+# Staged VSDC import items per batch of fetch_all_import_data
+IMPORT_BATCH_SIZE = 1000
 
 
 class ImportData(models.Model):
@@ -61,6 +57,13 @@ class ImportData(models.Model):
     mjr_tg_yn = fields.Char(string='Major Target', readonly=True, store=True)
     use_yn = fields.Char(string='Use', readonly=True, store=True)
 
+    def init(self):
+        # Declarations are resolved by (task_cd, dcl_no) when VSDC import items are loaded
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS import_data_task_cd_dcl_no_index
+            ON import_data (task_cd, dcl_no)
+        """)
+
     def values(self):
         print('item name', self.item_nm)
 
@@ -79,13 +82,13 @@ class ImportData(models.Model):
             self.mjr_tg_yn = False
             self.use_yn = False
 
-    def _fetch_import_items_data(self):
-        global compute_fetch_selection_counter, fetch_import_data_counter
-        global compute_fetch_selection_cache, compute_fetch_selection_last_request
+    def _stream_import_items(self):
+        """Yield the import items of the VSDC one at a time, as the response is read.
+
+        Network fetch; only the staging sync should call this, views read
+        zra.import.staging. Raises on transport errors and unexpected result codes.
+        """
         company = self.env.company
-        # config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
-        company_id = self.env.company.id
-        company_id = self.env.company.id
         config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
         api_url = config_settings.import_endpoint
         payload = {
@@ -94,61 +97,29 @@ class ImportData(models.Model):
             "lastReqDt": "20240105210300"
         }
 
-        # Check if cache is empty or last request date has changed
-        if compute_fetch_selection_cache is None or compute_fetch_selection_last_request != payload['lastReqDt']:
-            compute_fetch_selection_counter += 1
-            fetch_import_data_counter += 1
-            print('Compute Fetch Selection Endpoint Hit Count:', compute_fetch_selection_counter)
-            print('Fetch Import Data Endpoint Hit Count:', fetch_import_data_counter)
+        _logger.debug(f'Fetching import items from {api_url}')
 
-            try:
-                response = requests.post(api_url, json=payload)
-                response.raise_for_status()
-                result = response.json()
-
-                if result.get('resultCd') != '000':
-                    return []
-
-                item_list = result.get('data', {}).get('itemList', [])
-                compute_fetch_selection_cache = item_list
-                compute_fetch_selection_last_request = payload['lastReqDt']
-            except requests.exceptions.RequestException as e:
-                _logger.error('Error fetching fetch options:', e)
-                return []
-
-        return compute_fetch_selection_cache
+        response = self.env['zra.vsdc.client'].post(api_url, json=payload, stream=True)
+        stream, items = vsdc_stream.stream_list(response, 'itemList')
+        yield from items
+        # 001: no import items for this taxpayer
+        if stream.envelope.get('resultCd') not in ('000', '001'):
+            raise UserError(f"Import items fetch failed: {stream.envelope.get('resultMsg')} "
+                            f"({stream.envelope.get('resultCd')})")
 
     def _compute_fetch_selection(self):
-        item_list = self._fetch_import_items_data()
-
-        if not item_list:
-            return []
-
-        selection_data = [
-            (
-                f"{item['taskCd']}_{item['itemSeq']}",
-                f"{item['itemNm']} - {item['taskCd']} - {item['orgnNatCd']}"
-            )
-            for item in item_list
-        ]
-        return selection_data
+        return self.env['zra.import.staging']._selection()
+
     @api.onchange('fetch_selection')
     def _onchange_fetch_selection(self):
         if self.fetch_selection:
             self.fetch_import_data()
 
     def fetch_import_data(self):
-        item_list = self._fetch_import_items_data()
-
         if not self.fetch_selection:
             raise UserError(_('No selection made.'))
 
-        task_cd, item_seq = self.fetch_selection.split('_')
-
-        selected_item = next(
-            (item for item in item_list if str(item['taskCd']) == task_cd and str(item['itemSeq']) == item_seq),
-            None
-        )
+        selected_item = self.env['zra.import.staging']._get_payload(self.fetch_selection)
 
         if not selected_item:
             raise UserError(_('Selected item not found in the fetched data.'))
@@ -168,63 +139,56 @@ class ImportData(models.Model):
             'target': 'current',
         }
 
-    def print_endpoint_hits(self):
-        print('Compute Fetch Selection Endpoint Hit Count:', compute_fetch_selection_counter)
-        print('Fetch Import Data Endpoint Hit Count:', fetch_import_data_counter)
+    def _zra_product_lookup(self):
+        return self.env['product.template']._zra_lookup_products(names=self.item_list.mapped('item_nm'))
 
     def fetch_existing_quantities(self):
+        lookup = self._zra_product_lookup()
         product_quantities = {}
         for item in self.item_list:
-            product_template = self.env['product.template'].search(
-                [('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                product = self.env['product.product'].search([('product_tmpl_id', '=', product_template.id)], limit=1)
-                if product:
-                    stock_quant = self.env['stock.quant'].search(
-                        [('product_id', '=', product.id),
-                         ('location_id', '=', self.env.ref('stock.stock_location_stock').id)], limit=1)
-                    quantity = stock_quant.quantity if stock_quant else 0
-                    product_quantities[item.item_nm] = quantity
-                    print(f"Product Name: {item.item_nm}, Quantity: {quantity}")
-                else:
-                    product_quantities[item.item_nm] = 0
-                    print(f"Product Name: {item.item_nm}, Quantity: 0")
-            else:
-                product_quantities[item.item_nm] = 0
-                print(f"Product Name: {item.item_nm}, Quantity: 0")
+            quantity = lookup.quantity(item.item_nm)
+            product_quantities[item.item_nm] = quantity
+            print(f"Product Name: {item.item_nm}, Quantity: {quantity}")
 
         return product_quantities
 
     def fetch_existing_quantities_Full_confirm(self):
+        lookup = self._zra_product_lookup()
         product_quantities = {}
         for item in self.item_list:
-            product_template = self.env['product.template'].search([('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                product = self.env['product.product'].search([('product_tmpl_id', '=', product_template.id)], limit=1)
-                if product:
-                    stock_quant = self.env['stock.quant'].search([
-                        ('product_id', '=', product.id),
-                        ('location_id', '=', self.env.ref('stock.stock_location_stock').id)
-                    ], limit=1)
-                    quantity = stock_quant.quantity if stock_quant else 0
-                    product_quantities[item.item_nm] = quantity
-                    print(f"Product Name: {item.item_nm}, Quantity: {quantity}")
-                else:
-                    product_quantities[item.item_nm] = 0
-                    print(f"Product Name: {item.item_nm}, Quantity: 0")
-            else:
-                product_quantities[item.item_nm] = 0
-                print(f"Product Name: {item.item_nm}, Quantity: 0")
+            quantity = lookup.quantity(item.item_nm)
+            product_quantities[item.item_nm] = quantity
+            print(f"Product Name: {item.item_nm}, Quantity: {quantity}")
 
         return product_quantities
 
     def create_or_update_import_data(self, item):
-        if not item.get('taskCd') or not item.get('dclNo'):
-            _logger.warning('Skipped creation of record due to missing taskCd or dclNo')
-            return
+        self._upsert_import_items([item])
+
+    @api.model
+    def _import_header_vals(self, item):
+        return {
+            'task_cd': item.get('taskCd'),
+            'dcl_de': self._parse_date(item.get('dclDe')),
+            'dcl_no': item.get('dclNo'),
+            'tot_wt': item.get('totWt'),
+            'item_nm': item.get('itemNm'),
+            'net_wt': item.get('netWt'),
+            'agnt_nm': item.get('agntNm'),
+            'orgn_nat_cd': item.get('orgnNatCd'),
+            'invc_fcur_amt': item.get('invcFcurAmt'),
+            'invc_fcur_cd': item.get('invcFcurCd'),
+            'invc_fcur_excrt': item.get('invcFcurExcrt'),
+            'remark': item.get('remark'),
+            'status': 'draft',
+            'fetched': True,
+        }
 
-        existing_record = self.search([('task_cd', '=', item.get('taskCd')), ('dcl_no', '=', item.get('dclNo'))])
-        item_values = {
+    @api.model
+    def _import_item_vals(self, item):
+        return {
+            'task_cd': item.get('taskCd'),
+            'dcl_no': item.get('dclNo'),
             'item_seq': item.get('itemSeq'),
             'hs_cd': item.get('hsCd'),
             'item_nm': item.get('itemNm'),
@@ -240,55 +204,85 @@ class ImportData(models.Model):
             'invc_fcur_amt': item.get('invcFcurAmt')
         }
 
-        if existing_record:
-            # Update existing record
-            existing_record.write({
-                'task_cd': item.get('taskCd'),
-                'dcl_de': self._parse_date(item.get('dclDe')),
-                'dcl_no': item.get('dclNo'),
-                'tot_wt': item.get('totWt'),
-                'net_wt': item.get('netWt'),
-                'agnt_nm': item.get('agntNm'),
-                'invc_fcur_amt': item.get('invcFcurAmt'),
-                'invc_fcur_cd': item.get('invcFcurCd'),
-                'invc_fcur_excrt': item.get('invcFcurExcrt'),
-                'remark': item.get('remark'),
-                'status': 'draft',
-                'fetched': True,
-            })
-
-            # Update or create item in item_list
-            existing_item = existing_record.item_list.filtered(lambda x: x.item_seq == item.get('itemSeq'))
-            if existing_item:
-                existing_item.write(item_values)
-            else:
-                existing_record.write({'item_list': [(0, 0, item_values)]})
-
-        else:
-            # Create new record
-            vals = {
-                'task_cd': item.get('taskCd'),
-                'dcl_de': self._parse_date(item.get('dclDe')),
-                'dcl_no': item.get('dclNo'),
-                'tot_wt': item.get('totWt'),
-                'item_nm': item.get('itemNm'),
-                'net_wt': item.get('netWt'),
-                'agnt_nm': item.get('agntNm'),
-                'orgn_nat_cd': item.get('orgnNatCd'),
-                'invc_fcur_amt': item.get('invcFcurAmt'),
-                'invc_fcur_cd': item.get('invcFcurCd'),
-                'invc_fcur_excrt': item.get('invcFcurExcrt'),
-                'remark': item.get('remark'),
-                'status': 'draft',
-                'fetched': True,
-                'item_list': [(0, 0, item_values)]
-            }
-            self.create(vals)
-
-            import_data_instance = self.search(
-                [('task_cd', '=', item.get('taskCd')), ('dcl_no', '=', item.get('dclNo'))])
-            for item in import_data_instance.item_list:
-                item.check_item_name()
+    @api.model
+    def _upsert_import_items(self, items):
+        """Create or update the declarations and lines of VSDC import items.
+
+        Items are grouped by (taskCd, dclNo); existing declarations and lines are
+        resolved with one query each, new ones are created in batch and only the
+        lines whose values changed are written.
+        """
+        declarations = {}
+        for item in items:
+            if not item.get('taskCd') or not item.get('dclNo'):
+                _logger.warning('Skipped creation of record due to missing taskCd or dclNo')
+                continue
+            declarations.setdefault((item['taskCd'], item['dclNo']), []).append(item)
+        if not declarations:
+            return self.browse()
+
+        headers = {}
+        for record in self.search([('task_cd', 'in', list({key[0] for key in declarations})),
+                                   ('dcl_no', 'in', list({key[1] for key in declarations}))], order='id'):
+            headers.setdefault((record.task_cd, record.dcl_no), record)
+        for key, record in headers.items():
+            if key in declarations:
+                vals = self._import_header_vals(declarations[key][0])
+                del vals['item_nm'], vals['orgn_nat_cd']
+                record.write(vals)
+        new_keys = [key for key in declarations if key not in headers]
+        headers.update(zip(new_keys, self.create([self._import_header_vals(declarations[key][0])
+                                                  for key in new_keys])))
+
+        import_item_model = self.env['import.item']
+        lines = {}
+        # The oldest line wins, it is the one holding the declaration keys after migration
+        for line in import_item_model.search([('import_id', 'in', [h.id for h in headers.values()])], order='id'):
+            lines.setdefault((line.import_id.id, line.item_seq), line)
+        to_create = {}
+        updated = 0
+        for key, declaration_items in declarations.items():
+            header = headers[key]
+            for item in declaration_items:
+                vals = self._import_item_vals(item)
+                line = lines.get((header.id, vals['item_seq']))
+                if line:
+                    changes = {name: value for name, value in vals.items() if (line[name] or False) != (value or False)}
+                    if changes:
+                        line.write(changes)
+                        updated += 1
+                else:
+                    to_create[(header.id, vals['item_seq'])] = dict(vals, import_id=header.id)
+        new_lines = import_item_model.create(list(to_create.values()))
+
+        lookup = self.env['product.template']._zra_lookup_products(names=new_lines.mapped('item_nm'))
+        missing = {name for name in new_lines.mapped('item_nm') if name and not lookup.template(name)}
+        if missing:
+            _logger.info(f'{len(missing)} imported item name(s) have no product yet')
+        _logger.info(f'Import declarations: {len(new_keys)} created, {len(declarations) - len(new_keys)} updated, '
+                     f'{len(new_lines)} lines created, {updated} lines updated')
+        return self.browse([headers[key].id for key in declarations])
+
+    def fetch_all_import_data(self):
+        """Load every staged import item into the declarations, batch by batch."""
+        staging = self.env['zra.import.staging'].sudo()
+        staged_ids = staging.search([('company_id', '=', self.env.company.id)]).ids
+        for start in range(0, len(staged_ids), IMPORT_BATCH_SIZE):
+            records = staging.browse(staged_ids[start:start + IMPORT_BATCH_SIZE])
+            self._upsert_import_items([json.loads(record.payload) for record in records if record.payload])
+            self.env.flush_all()
+            self.env.invalidate_all()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': 'Import Data',
+            'res_model': 'import.data',
+            'view_mode': 'tree,form',
+            'views': [
+                (self.env.ref('zra_smart_invoice.view_import_data_tree').id, 'tree'),
+                (self.env.ref('zra_smart_invoice.view_import_data_form').id, 'form')
+            ],
+            'target': 'current',
+        }
 
     def _parse_date(self, date_str):
         try:
@@ -297,23 +291,14 @@ class ImportData(models.Model):
             return False
 
     def refresh_list(self):
-
-        global compute_fetch_selection_cache, compute_fetch_selection_last_request
-
-        compute_fetch_selection_cache = None
-        compute_fetch_selection_last_request = None
+        if not self.env['zra.import.staging']._sync_company(self.env.company):
+            raise UserError(_('Could not fetch the import list from the VSDC. Please try again.'))
         return {
             'type': 'ir.actions.client',
             'tag': 'reload',
         }
 
     def action_confirm_import(self):
-
-        global compute_fetch_selection_cache, compute_fetch_selection_last_request
-
-        compute_fetch_selection_cache = None
-        compute_fetch_selection_last_request = None
-
         self.ensure_one()
 
         print('Cache reset after confirming import')
@@ -333,7 +318,8 @@ class ImportData(models.Model):
         rejected_io_items = []
 
         # Fetch existing quantities
-        product_quantities = self.fetch_existing_quantities()
+        lookup = self._zra_product_lookup()
+        product_quantities = {item.item_nm: lookup.quantity(item.item_nm) for item in self.item_list}
 
         for item in self.item_list:
             confirmed_qty = item.qty
@@ -351,11 +337,7 @@ class ImportData(models.Model):
                 rejected_items.append(item)
                 io_rejected_items.append(item)
             else:
-                product_template = self.env['product.template'].search([('name', '=', item.item_nm)], limit=1)
-                if product_template:
-                    item_cd = product_template.item_Cd
-                else:
-                    item_cd = False
+                item_cd = lookup.template(item.item_nm).item_Cd
 
                 confirmed_items.append(item)
                 io_confirmed_items.append(item)
@@ -393,11 +375,7 @@ class ImportData(models.Model):
                 all_rejected = False
 
             if rejected_qty > 0:
-                product_template = self.env['product.template'].search([('name', '=', item.item_nm)], limit=1)
-                if product_template:
-                    item_cd = product_template.item_Cd
-                else:
-                    item_cd = False
+                item_cd = lookup.template(item.item_nm).item_Cd
 
                 rejected_items.append(item)
                 io_rejected_items.append(item)
@@ -487,10 +465,13 @@ class ImportData(models.Model):
         }
 
     def create_or_update_products(self):
-        product_template_model = self.env['product.template']
+        # New products are registered with ZRA in the background, not one saveItem call each here
+        product_template_model = self.env['product.template'].with_context(zra_defer_registration=True)
         product_product_model = self.env['product.product']
         stock_quant_model = self.env['stock.quant']
         stock_location = self.env.ref('stock.stock_location_stock')
+        lookup = self._zra_product_lookup()
+        created_templates = {}
 
         for item in self.item_list:
             product_name = item.item_nm
@@ -499,7 +480,7 @@ class ImportData(models.Model):
                 continue
 
             # Check if product template exists, or create a new one
-            existing_template = product_template_model.search([('name', '=', product_name)], limit=1)
+            existing_template = created_templates.get(product_name) or lookup.template(product_name)
             template_values = {
                 'name': product_name,
                 'type': 'product',
@@ -520,9 +501,12 @@ class ImportData(models.Model):
             else:
                 # Create new product template
                 existing_template = product_template_model.create(template_values)
+                created_templates[product_name] = existing_template
 
             # Ensure the product variant exists
-            product_variant = product_product_model.search([('product_tmpl_id', '=', existing_template.id)], limit=1)
+            product_variant = lookup.product(product_name) if lookup.template(product_name) == existing_template else None
+            if not product_variant:
+                product_variant = product_product_model.search([('product_tmpl_id', '=', existing_template.id)], limit=1)
             if not product_variant:
                 product_variant = product_product_model.create({'product_tmpl_id': existing_template.id})
 
@@ -557,14 +541,7 @@ class ImportData(models.Model):
         rejected_qty = fetched_qty - confirmed_qty
         print('rejected', rejected_qty)
 
-        for item in self.item_list:
-            product_template = self.env['product.template'].search([('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                item_cd = product_template.item_Cd
-                class_cd = product_template.item_cls_cd
-            else:
-                item_cd = False
-                class_cd = False
+        lookup = self._zra_product_lookup()
         company = self.env.company
         company_id = self.env.company.id
         config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
@@ -577,8 +554,8 @@ class ImportData(models.Model):
             "importItemList": [{
                 "itemSeq": item.item_seq,
                 "hsCd": item.hs_cd,
-                "itemClsCd": item.item_cls_cd or class_cd,
-                "itemCd": item.item_cd or item_cd,
+                "itemClsCd": item.item_cls_cd or lookup.template(item.item_nm).item_cls_cd,
+                "itemCd": item.item_cd or lookup.template(item.item_nm).item_Cd,
                 "imptItemSttsCd": "3",
                 "remark": item.remark or "Imports",
                 "modrNm": self.create_uid.name,
@@ -586,7 +563,7 @@ class ImportData(models.Model):
             } for item in self.item_list]
         }
         print(json.dumps(payload, indent=4))
-        response = requests.post(api_url, json=payload)
+        response = self.env['zra.vsdc.client'].post(api_url, json=payload)
         if response.status_code != 200:
             raise UserError(_('Failed to update import items: HTTP %s') % response.status_code)
         _logger.info('Import items updated: %s', response.json())
@@ -602,14 +579,7 @@ class ImportData(models.Model):
         rejected_qty = fetched_qty - confirmed_qty
         print('rejected', rejected_qty)
 
-        for item in self.item_list:
-            product_template = self.env['product.template'].search([('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                item_cd = product_template.item_Cd
-                class_cd = product_template.item_cls_cd
-            else:
-                item_cd = False
-                class_cd = False
+        lookup = self._zra_product_lookup()
 
         company_id = self.env.company.id
         config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
@@ -622,8 +592,8 @@ class ImportData(models.Model):
             "importItemList": [{
                 "itemSeq": item.item_seq,
                 "hsCd": item.hs_cd,
-                "itemClsCd": item.item_cls_cd or class_cd,
-                "itemCd": item.item_cd or item_cd,
+                "itemClsCd": item.item_cls_cd or lookup.template(item.item_nm).item_cls_cd,
+                "itemCd": item.item_cd or lookup.template(item.item_nm).item_Cd,
                 "imptItemSttsCd": "3",
                 "remark": item.remark or "remark",
                 "modrNm": self.create_uid.name,
@@ -631,7 +601,7 @@ class ImportData(models.Model):
             } for item in self.item_list]
         }
         print(payload)
-        response = requests.post(api_url, json=payload)
+        response = self.env['zra.vsdc.client'].post(api_url, json=payload)
         if response.status_code != 200:
             raise UserError(_('Failed to update import items: HTTP %s') % response.status_code)
         _logger.info('Import items updated: %s', response.json())
@@ -646,14 +616,7 @@ class ImportData(models.Model):
         fetched_qty = sum(item.fetched_qty for item in self.item_list)
         rejected_qty = fetched_qty - confirmed_qty
 
-        for item in self.item_list:
-            product_template = self.env['product.template'].search([('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                item_cd = product_template.item_Cd
-                class_cd = product_template.item_cls_cd
-            else:
-                item_cd = False
-                class_cd = False
+        lookup = self._zra_product_lookup()
 
         company_id = self.env.company.id
         config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
@@ -666,8 +629,8 @@ class ImportData(models.Model):
             "importItemList": [{
                 "itemSeq": item.item_seq,
                 "hsCd": item.hs_cd,
-                "itemClsCd": item.item_cls_cd or class_cd,
-                "itemCd": item.item_cd or item_cd,
+                "itemClsCd": item.item_cls_cd or lookup.template(item.item_nm).item_cls_cd,
+                "itemCd": item.item_cd or lookup.template(item.item_nm).item_Cd,
                 "imptItemSttsCd": "4",
                 "remark": item.remark or "",
                 "modrNm": self.create_uid.name,
@@ -678,7 +641,7 @@ class ImportData(models.Model):
         # print("Payload:")
         print(json.dumps(payload, indent=4))  # Print the payload in JSON format
 
-        response = requests.post(api_url, json=payload)
+        response = self.env['zra.vsdc.client'].post(api_url, json=payload)
         if response.status_code != 200:
             raise UserError(_('Failed to update import items: HTTP %s') % response.status_code)
         _logger.info('Import items updated: %s', response.json())
@@ -693,14 +656,7 @@ class ImportData(models.Model):
         fetched_qty = sum(item.fetched_qty for item in self.item_list)
         rejected_qty = fetched_qty - confirmed_qty
 
-        for item in self.item_list:
-            product_template = self.env['product.template'].search([('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                item_cd = product_template.item_Cd
-                class_cd = product_template.item_cls_cd
-            else:
-                item_cd = False
-                class_cd = False
+        lookup = self._zra_product_lookup()
 
         company_id = self.env.company.id
         config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
@@ -713,8 +669,8 @@ class ImportData(models.Model):
             "importItemList": [{
                 "itemSeq": item.item_seq,
                 "hsCd": item.hs_cd,
-                "itemClsCd": item.item_cls_cd or class_cd,
-                "itemCd": item.item_cd or item_cd,
+                "itemClsCd": item.item_cls_cd or lookup.template(item.item_nm).item_cls_cd,
+                "itemCd": item.item_cd or lookup.template(item.item_nm).item_Cd,
                 "imptItemSttsCd": "4",
                 "remark": item.remark or "",
                 "modrNm": self.create_uid.name,
@@ -725,7 +681,7 @@ class ImportData(models.Model):
         # print("Payload:")
         # print(json.dumps(payload, indent=4))  # Print the payload in JSON format
 
-        response = requests.post(api_url, json=payload)
+        response = self.env['zra.vsdc.client'].post(api_url, json=payload)
         if response.status_code != 200:
             raise UserError(_('Failed to update import items: HTTP %s') % response.status_code)
         _logger.info('Import items updated: %s', response.json())
@@ -761,7 +717,7 @@ class ImportData(models.Model):
         print("Save Stock Items Payload:")
         # print(payload)
 
-        response = requests.post(api_url, json=payload)
+        response = self.env['zra.vsdc.client'].post(api_url, json=payload)
         if response.status_code != 200:
             print(f"Response Status Code: {response.status_code}")
             # print(f"Response Content: {response.content}")
@@ -786,7 +742,7 @@ class ImportData(models.Model):
         # print("Save Stock Master Payload:")
         print(payload)
 
-        response = requests.post(api_url, json=payload)
+        response = self.env['zra.vsdc.client'].post(api_url, json=payload)
 
         if response.status_code != 200:
             raise UserError(_('Failed to save stock master: HTTP %s') % response.status_code)
@@ -799,7 +755,8 @@ class ImportData(models.Model):
         api_url = config_settings.stock_io_endpoint
 
         # Fetch existing quantities
-        product_quantities = self.fetch_existing_quantities()
+        lookup = self._zra_product_lookup()
+        product_quantities = {item.item_nm: lookup.quantity(item.item_nm) for item in self.item_list}
 
         payload = {
             "tpin": company.tpin,
@@ -828,12 +785,7 @@ class ImportData(models.Model):
             confirmed_qty = item.qty
             existing_qty = product_quantities.get(item.item_nm, 0)
 
-            # Search for product template based on item name
-            product_template = self.env['product.template'].search([('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                item_cd = product_template.item_Cd
-            else:
-                item_cd = False  # Set default value if product template not found
+            item_cd = lookup.template(item.item_nm).item_Cd
 
             payload["itemList"].append({
                 "itemSeq": item.item_seq,
@@ -867,7 +819,7 @@ class ImportData(models.Model):
 
         # Send the request to save stock items
         try:
-            response = requests.post(api_url, json=payload)
+            response = self.env['zra.vsdc.client'].post(api_url, json=payload)
             response.raise_for_status()
             _logger.info('Stock items saved successfully: %s', response.json())
             print('Save stock saved successfully:', response.json())
@@ -880,7 +832,8 @@ class ImportData(models.Model):
         api_url = config_settings.stock_master_endpoint
 
         # Fetch existing quantities
-        product_quantities = self.fetch_existing_quantities()
+        lookup = self._zra_product_lookup()
+        product_quantities = {item.item_nm: lookup.quantity(item.item_nm) for item in self.item_list}
         company = self.env.company
 
         # Prepare the payload with updated quantities
@@ -898,12 +851,7 @@ class ImportData(models.Model):
             confirmed_qty = item.qty
             existing_qty = product_quantities.get(item.item_nm, 0)
 
-            # Search for product template based on item name
-            product_template = self.env['product.template'].search([('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                item_cd = product_template.item_Cd
-            else:
-                item_cd = False
+            item_cd = lookup.template(item.item_nm).item_Cd
 
             total_qty = existing_qty + confirmed_qty
             print('existing', existing_qty)
@@ -919,7 +867,7 @@ class ImportData(models.Model):
 
         # Send the request to save stock master
         try:
-            response = requests.post(api_url, json=payload)
+            response = self.env['zra.vsdc.client'].post(api_url, json=payload)
             response.raise_for_status()
             _logger.info('Stock master saved successfully: %s', response.json())
             print('Save master saved successfully:', response.json())
@@ -951,6 +899,7 @@ class ImportItem(models.Model):
     remark = fields.Text(string='Remark')
     item_cd = fields.Char(string='Item Code')
     task_cd = fields.Char(string='Task Code')
+    dcl_no = fields.Char(string='Declaration Number')
     classification = fields.Many2one(
         'zra.item.data',
         string='Item Classification',
@@ -963,6 +912,12 @@ class ImportItem(models.Model):
     use_yn = fields.Char(string='Use', readonly=True, store=True)
     _item_cd_options_array = []
 
+    # Also the lookup index of the bulk import upsert; lines created before dcl_no existed keep it NULL
+    _sql_constraints = [
+        ('task_dcl_item_seq_unique', 'unique(task_cd, dcl_no, item_seq)',
+         'An import declaration line must be unique per task code, declaration number and item sequence.'),
+    ]
+
     def check_product_exists(self):
         print(f"Checking product for item_nm: {self.item_nm}")
         if not self.item_nm:
@@ -1041,25 +996,32 @@ class ImportItem(models.Model):
         product = self.env['product.template'].search(domain, limit=1)
         return product.classification if product else False
 
-    @api.model
-    def create(self, vals):
-        if not vals.get('classification'):
-            classification = self._find_product_classification(vals.get('item_nm'), vals.get('item_cd'))
-            if classification:
-                vals['classification'] = classification.id
-
-        if 'classification' in vals:
-            classification = self.env['zra.item.data'].browse(vals['classification'])
-            if classification.exists():
-                vals.update({
-                    'item_cls_cd': classification.itemClsCd,
-                    'item_cls_lvl': classification.itemClsLvl,
-                    'tax_ty_cd': classification.taxTyCd,
-                    'mjr_tg_yn': classification.mjrTgYn,
-                    'use_yn': classification.useYn
-                })
-
-        res = super(ImportItem, self).create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        # Classifications of the products named by the lines, resolved in one lookup
+        unclassified = [vals for vals in vals_list if not vals.get('classification')]
+        if unclassified:
+            lookup = self.env['product.template']._zra_lookup_products(
+                names=[vals.get('item_nm') for vals in unclassified],
+                item_codes=[vals.get('item_cd') for vals in unclassified])
+            for vals in unclassified:
+                product = lookup.template(vals.get('item_nm'), vals.get('item_cd') or None)
+                if product.classification:
+                    vals['classification'] = product.classification.id
+
+        for vals in vals_list:
+            if 'classification' in vals:
+                classification = self.env['zra.item.data'].browse(vals['classification'])
+                if classification.exists():
+                    vals.update({
+                        'item_cls_cd': classification.itemClsCd,
+                        'item_cls_lvl': classification.itemClsLvl,
+                        'tax_ty_cd': classification.taxTyCd,
+                        'mjr_tg_yn': classification.mjrTgYn,
+                        'use_yn': classification.useYn
+                    })
+
+        res = super(ImportItem, self).create(vals_list)
         return res
 
     def write(self, vals):
@@ -1113,18 +1075,11 @@ class ImportItem(models.Model):
                 'context': self.env.context,
             }
 
-        # Locking mechanism to prevent race conditions
-        sequence = self.env['item.code.sequence'].sudo().search([], limit=1)
-        if not sequence:
-            sequence = self.env['item.code.sequence'].sudo().create({})
-
-        next_number = sequence.next_number
-        sequence.sudo().write({'next_number': next_number + 1})
-        next_number_str = str(next_number).zfill(7)
+        next_number_str = self.env['product.template']._zra_next_item_number()
         item_code = f"{self.item_nm[:2]}{self.pkg_unit_cd[:2]}{self.qty_unit_cd[:2]}{next_number_str}"
 
         # Ensure the item code is added to selection options
-        self.env['product.template'].create({
+        self.env['product.template'].with_context(zra_defer_registration=True).create({
             'name': self.item_nm,
             'item_Cd': item_code,
         })
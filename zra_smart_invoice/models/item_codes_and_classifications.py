@@ -1,53 +1,126 @@
 from odoo import models, fields, api
+from datetime import datetime
 import logging
 import requests
+import pytz
+from . import vsdc_stream
 
 _logger = logging.getLogger(__name__)
 
+# lastReqDt used when a company has never synchronised a table
+INITIAL_CLASSIFICATION_REQ_DT = "20240123121449"
+INITIAL_CODE_REQ_DT = "20180520000000"
+# The reference tables are shared by all companies, so is their lastReqDt watermark
+CLASSIFICATION_REQ_DT_PARAM = 'zra_smart_invoice.classification_last_req_dt'
+CODE_REQ_DT_PARAM = 'zra_smart_invoice.code_last_req_dt'
+# Rows per multi-row INSERT when loading reference data
+CREATE_BATCH_SIZE = 1000
+
+
+def _vsdc_now():
+    return datetime.now(pytz.timezone("Africa/Lusaka")).strftime('%Y%m%d%H%M%S')
+
+
+def _upsert_by_code(model, code_field, rows):
+    """Apply {code: vals} to model, updating changed rows and creating missing ones.
+
+    Rows are never deleted so Many2one references from products stay valid;
+    codes withdrawn by ZRA come through with active=False and are archived.
+    """
+    model = model.sudo().with_context(active_test=False, tracking_disable=True)
+    existing = {}
+    if model.search_count([], limit=1):
+        for record in model.search([(code_field, 'in', list(rows))]):
+            existing[record[code_field]] = record
+    to_create = []
+    updated = 0
+    for code, vals in rows.items():
+        record = existing.get(code)
+        if record:
+            changes = {key: value for key, value in vals.items() if record[key] != value}
+            if changes:
+                record.write(changes)
+                updated += 1
+        elif vals.get('active', True):
+            to_create.append(vals)
+    for start in range(0, len(to_create), CREATE_BATCH_SIZE):
+        model.create(to_create[start:start + CREATE_BATCH_SIZE])
+    _logger.info(f'{model._name}: {len(to_create)} created, {updated} updated')
+    return len(to_create), updated
+
+
+def _code_rows(data, cd_cls, code_field, name_field):
+    rows = {}
+    for cls_item in data:
+        if cls_item.get('cdCls') == cd_cls:
+            for item in cls_item.get('dtlList') or []:
+                rows[item['cd']] = {
+                    code_field: item['cd'],
+                    name_field: item['cdNm'],
+                    'active': item.get('useYn', 'Y') == 'Y',
+                }
+    return rows
+
 
 class ZraItemData(models.Model):
     _name = 'zra.item.data'
     _description = 'ZRA Item Data'
     _rec_name = 'itemClsNm'  # Specify the field to be used as the name
 
-    itemClsCd = fields.Char(string='Item Classification Code')
+    itemClsCd = fields.Char(string='Item Classification Code', index=True)
     itemClsNm = fields.Char(string='Item Classification Name')
     itemClsLvl = fields.Integer(string='Item Classification Level')
     taxTyCd = fields.Char(string='Tax Type Code')
     mjrTgYn = fields.Char(string='Major Target')
     useYn = fields.Char(string='Use')
+    active = fields.Boolean(string='Active', default=True)
 
     @api.model
     def fetch_and_store_classification_data(self):
         config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
         company = self.env.company
         url = config_settings.classification_endpoint
+        params = self.env['ir.config_parameter'].sudo()
+        request_dt = _vsdc_now()
         payload = {
             "tpin": company.tpin,
             "bhfId": company.bhf_id,
-            "lastReqDt": "20240123121449"
+            "lastReqDt": params.get_param(CLASSIFICATION_REQ_DT_PARAM) or INITIAL_CLASSIFICATION_REQ_DT
         }
         headers = {
             'Content-Type': 'application/json'
         }
+        # The full list runs to tens of thousands of entries: parse and store it chunk by chunk
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            # ResConfigSettings.endpoint_hit_counts['endpoint_1'] += 1
-            data = response.json().get('data', {}).get('itemClsList', [])
-            self.sudo().search([]).unlink()  # Clear existing records
-            for item in data:
-                if item['useYn'] == 'Y':
-                    self.create({
+            response = self.env['zra.vsdc.client'].post(url, json=payload, headers=headers, stream=True)
+            stream, items = vsdc_stream.stream_list(response, 'itemClsList')
+            for chunk in vsdc_stream.iter_chunks(items, CREATE_BATCH_SIZE):
+                rows = {}
+                for item in chunk:
+                    rows[item['itemClsCd']] = {
                         'itemClsCd': item['itemClsCd'],
                         'itemClsNm': item['itemClsNm'],
                         'itemClsLvl': item['itemClsLvl'],
-                        'taxTyCd': item.get('taxTyCd', ''),
-                        'mjrTgYn': item.get('mjrTgYn', ''),
-                        'useYn': item['useYn']
-                    })
-        except requests.exceptions.RequestException as e:
+                        'taxTyCd': item.get('taxTyCd') or '',
+                        'mjrTgYn': item.get('mjrTgYn') or '',
+                        'useYn': item['useYn'],
+                        'active': item['useYn'] == 'Y',
+                    }
+                _upsert_by_code(self, 'itemClsCd', rows)
+                self.env.flush_all()
+                self.env.invalidate_all()
+        except (requests.exceptions.RequestException, ValueError) as e:
             _logger.error('Failed to fetch classification data from ZRA: %s', e)
+            return False
+
+        # 001 means nothing changed since lastReqDt
+        result = stream.envelope
+        if result.get('resultCd') not in ('000', '001'):
+            _logger.error(f"Classification sync failed: {result.get('resultMsg')} ({result.get('resultCd')})")
+            return False
+
+        params.set_param(CLASSIFICATION_REQ_DT_PARAM, request_dt)
+        return True
 
 
 class CodeData(models.AbstractModel):
@@ -55,26 +128,50 @@ class CodeData(models.AbstractModel):
     _description = 'Common Code Data'
 
     @api.model
-    def fetch_common_code_data(self):
+    def fetch_common_code_data(self, last_req_dt=None):
+        return self._fetch_common_codes(last_req_dt or INITIAL_CODE_REQ_DT) or []
+
+    @api.model
+    def _fetch_common_codes(self, last_req_dt):
+        # Returns None when the request failed, [] when nothing changed since last_req_dt
         config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
         company = self.env.company
         url = config_settings.class_codes_endpoint
         payload = {
             "tpin": company.tpin,
             "bhfId": company.bhf_id,
-            "lastReqDt": "20180520000000"
+            "lastReqDt": last_req_dt
         }
         headers = {
             'Content-Type': 'application/json'
         }
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.env['zra.vsdc.client'].post(url, json=payload, headers=headers)
             response.raise_for_status()
-            # ResConfigSettings.endpoint_hit_counts['endpoint_2'] += 1
-            return response.json().get('data', {}).get('clsList', [])
-        except requests.exceptions.RequestException as e:
+            result = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
             _logger.error('Failed to fetch common code data: %s', e)
-            return []
+            return None
+        # 001 means nothing changed since lastReqDt
+        if result.get('resultCd') not in ('000', '001'):
+            _logger.error(f"Common code sync failed: {result.get('resultMsg')} ({result.get('resultCd')})")
+            return None
+        return (result.get('data') or {}).get('clsList') or []
+
+    @api.model
+    def sync_common_code_data(self):
+        """Apply the code changes since the last sync and move the lastReqDt forward."""
+        params = self.env['ir.config_parameter'].sudo()
+        request_dt = _vsdc_now()
+        data = self._fetch_common_codes(params.get_param(CODE_REQ_DT_PARAM) or INITIAL_CODE_REQ_DT)
+        if data is None:
+            return False
+        if data:
+            self.env['quantity.unit.data'].store_quantity_data(data)
+            self.env['packaging.unit.data'].store_packaging_data(data)
+            self.env['country.data'].store_country_data(data)
+        params.set_param(CODE_REQ_DT_PARAM, request_dt)
+        return True
 
 
 class QuantityUnitData(models.Model):
@@ -82,19 +179,13 @@ class QuantityUnitData(models.Model):
     _description = 'Quantity Unit Data'
     _rec_name = 'quantity_unit_cdNm'  # Specify the field to be used as the name
 
-    quantity_unit_cd = fields.Char(string='Quantity Unit Code')
+    quantity_unit_cd = fields.Char(string='Quantity Unit Code', index=True)
     quantity_unit_cdNm = fields.Char(string='Quantity Unit Name')
+    active = fields.Boolean(string='Active', default=True)
 
     @api.model
     def store_quantity_data(self, data):
-        self.sudo().search([]).unlink()  # Clear existing records
-        for cls_item in data:
-            if cls_item['cdCls'] == '10':
-                for item in cls_item.get('dtlList', []):
-                    self.create({
-                        'quantity_unit_cd': item['cd'],
-                        'quantity_unit_cdNm': item['cdNm']
-                    })
+        _upsert_by_code(self, 'quantity_unit_cd', _code_rows(data, '10', 'quantity_unit_cd', 'quantity_unit_cdNm'))
 
 
 class PackagingUnitData(models.Model):
@@ -102,19 +193,13 @@ class PackagingUnitData(models.Model):
     _description = 'Packaging Unit Data'
     _rec_name = 'packaging_unit_cdNm'  # Specify the field to be used as the name
 
-    packaging_unit_cd = fields.Char(string='Packaging Unit Code')
+    packaging_unit_cd = fields.Char(string='Packaging Unit Code', index=True)
     packaging_unit_cdNm = fields.Char(string='Packaging Unit Name')
+    active = fields.Boolean(string='Active', default=True)
 
     @api.model
     def store_packaging_data(self, data):
-        self.sudo().search([]).unlink()  # Clear existing records
-        for cls_item in data:
-            if cls_item['cdCls'] == '17':
-                for item in cls_item.get('dtlList', []):
-                    self.create({
-                        'packaging_unit_cd': item['cd'],
-                        'packaging_unit_cdNm': item['cdNm']
-                    })
+        _upsert_by_code(self, 'packaging_unit_cd', _code_rows(data, '17', 'packaging_unit_cd', 'packaging_unit_cdNm'))
 
 
 class CountryData(models.Model):
@@ -122,16 +207,10 @@ class CountryData(models.Model):
     _description = 'Country Data'
     _rec_name = 'country_cdNm'  # Specify the field to be used as the name
 
-    country_cd = fields.Char(string='Country Code')
+    country_cd = fields.Char(string='Country Code', index=True)
     country_cdNm = fields.Char(string='Country Name')
+    active = fields.Boolean(string='Active', default=True)
 
     @api.model
     def store_country_data(self, data):
-        self.sudo().search([]).unlink()  # Clear existing records
-        for cls_item in data:
-            if cls_item['cdCls'] == '05':
-                for item in cls_item.get('dtlList', []):
-                    self.create({
-                        'country_cd': item['cd'],
-                        'country_cdNm': item['cdNm']
-                    })
+        _upsert_by_code(self, 'country_cd', _code_rows(data, '05', 'country_cd', 'country_cdNm'))
@@ -53,7 +53,7 @@ class MrpBom(models.Model):
             headers = {'Content-Type': 'application/json'}
 
             try:
-                response = requests.post(url, json=payload, headers=headers)
+                response = self.env['zra.vsdc.client'].post(url, json=payload, headers=headers)
                 response.raise_for_status()
                 response_data = response.json()
                 message = f"API request successful. Response: {json.dumps(response_data, indent=2)}"
@@ -0,0 +1,218 @@
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+import requests
+import json
+import logging
+from .vsdc_client import VsdcUnavailable
+
+_logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+
+class ZraOutbox(models.Model):
+    _name = 'zra.outbox'
+    _description = 'ZRA VSDC Outbox'
+    _order = 'id'
+
+    name = fields.Char(string='Description', required=True)
+    move_id = fields.Many2one('account.move', string='Invoice', index=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', string='Company', required=True,
+                                 default=lambda self: self.env.company)
+    kind = fields.Selection([
+        ('sales', 'Save Sales'),
+        ('stock_items', 'Save Stock Items'),
+        ('stock_master', 'Save Stock Master'),
+    ], string='Type', required=True)
+    endpoint = fields.Char(string='Endpoint', required=True)
+    payload = fields.Text(string='Payload', required=True)
+    message_prefix = fields.Char(string='Message Prefix')
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='pending', required=True, index=True)
+    attempts = fields.Integer(string='Attempts', default=0)
+    last_error = fields.Text(string='Last Error')
+    response = fields.Text(string='Response')
+    processed_at = fields.Datetime(string='Processed At')
+
+    @api.model
+    def enqueue(self, move, kind, endpoint, payload, message_prefix, trigger=True):
+        """Store a VSDC submission to be sent by the outbox cron."""
+        _logger.info(f'Queueing {kind} submission for {move.name}')
+        entry = self.sudo().create({
+            'name': f'{move.name} - {kind}',
+            'move_id': move.id,
+            'company_id': move.company_id.id or self.env.company.id,
+            'kind': kind,
+            'endpoint': endpoint,
+            'payload': json.dumps(payload),
+            'message_prefix': message_prefix,
+        })
+        if trigger:
+            entry._trigger_cron()
+        return entry
+
+    @api.model
+    def _trigger_cron(self):
+        cron = self.env.ref('zra_smart_invoice.ir_cron_zra_outbox', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    @api.model
+    def _cron_process_outbox(self, limit=200, batch_size=50):
+        entries = self.search([('state', '=', 'pending')], limit=limit)
+        _logger.info(f'Processing {len(entries)} pending VSDC outbox entries')
+        for start in range(0, len(entries), batch_size):
+            entries[start:start + batch_size]._process_batch(commit=True)
+            self.env.cr.commit()
+
+    def _claim(self):
+        """Lock the entries still pending for this transaction, skipping those another
+        transaction (cron, Process now, Submit now) is already sending."""
+        if not self:
+            return self.browse()
+        self.flush_recordset(['state'])
+        self.env.cr.execute("""
+            SELECT id FROM zra_outbox
+            WHERE id IN %s AND state = 'pending'
+            ORDER BY id
+            FOR UPDATE SKIP LOCKED
+        """, (tuple(self.ids),))
+        claimed = self.browse([row[0] for row in self.env.cr.fetchall()])
+        # Another transaction may have completed them since this one started
+        claimed.invalidate_recordset(['state'])
+        if len(claimed) < len(self):
+            _logger.info(f'{len(self) - len(claimed)} outbox entries skipped, already being processed')
+        return claimed
+
+    def _process_batch(self, commit=False):
+        """Send the pending entries, then apply each response in this thread.
+
+        Entries are claimed first, so a given entry is only ever sent by one transaction.
+        The entries of one move are sent in order (sale, stock items, stock master),
+        each only once the previous one is done; different moves go in parallel.
+        With ``commit``, the results are committed after each round, so that a later
+        failure cannot roll back submissions the VSDC has already accepted.
+        """
+        pending = self._claim().filtered(lambda e: e.state == 'pending').sorted('id')
+        # An entry waits while an older submission of its move is still open outside this batch
+        blockers = {}
+        if pending.move_id:
+            for entry in self.search([('move_id', 'in', pending.move_id.ids), ('state', '!=', 'done'),
+                                      ('id', 'not in', pending.ids)], order='id'):
+                blockers.setdefault(entry.move_id.id, entry.id)
+        queues = {}
+        for entry in pending:
+            if entry.move_id and blockers.get(entry.move_id.id, entry.id) < entry.id:
+                continue
+            queues.setdefault(('move', entry.move_id.id) if entry.move_id else ('entry', entry.id), []).append(entry)
+
+        while queues:
+            # The commit released the locks: claim the next entries again
+            heads = self.browse([queue[0].id for queue in queues.values()])._claim()
+            for key, queue in list(queues.items()):
+                if queue[0] not in heads:
+                    del queues[key]
+            heads._send_entries()
+            if commit:
+                self.env.cr.commit()
+            for key, queue in list(queues.items()):
+                entry = queue.pop(0)
+                if entry.state != 'done' or not queue:
+                    # The rest of the move waits for the next run
+                    del queues[key]
+
+    def _send_entries(self):
+        """Send the entries concurrently, one call each."""
+        # Rate limits and in-flight caps are per company
+        for company in self.company_id:
+            entries = self.filtered(lambda e: e.company_id == company)
+            fingerprints = self.env['zra.vsdc.fingerprint'].with_company(company)
+            to_send, calls = self.browse(), []
+            for entry in entries:
+                payload = json.loads(entry.payload)
+                if entry.kind == 'stock_master':
+                    # Quantities already acknowledged by the VSDC are not reported again
+                    payload = fingerprints.filter_stock_master(entry.endpoint, payload)
+                    if payload is None:
+                        entry.write({'state': 'done', 'response': 'Skipped: quantities unchanged',
+                                     'last_error': False, 'processed_at': fields.Datetime.now()})
+                        continue
+                    entry.payload = json.dumps(payload)
+                to_send |= entry
+                calls.append((entry.endpoint, {'json': payload}))
+            results = self.env['zra.vsdc.client'].with_company(company).post_many(calls)
+            for entry, (response, error) in zip(to_send, results):
+                entry._handle_result(response, error)
+
+    def _handle_result(self, response, error):
+        self.ensure_one()
+        move = self.move_id.with_company(self.company_id)
+        if isinstance(error, VsdcUnavailable):
+            # Not attempted, the endpoint is known to be down: keep it pending without using an attempt
+            self.last_error = str(error)
+            return
+        try:
+            if error:
+                raise error
+            response.raise_for_status()
+            response_data = response.json()
+        except requests.exceptions.HTTPError as e:
+            # 5xx may be transient; a 4xx would be refused again
+            self._record_failure(str(e), retry=e.response is None or e.response.status_code >= 500)
+            return
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._record_failure(str(e))
+            return
+        self.response = json.dumps(response_data)
+        try:
+            with self.env.cr.savepoint():
+                if self.kind == 'stock_master' and response_data.get('resultCd') == '000':
+                    self.env['zra.vsdc.fingerprint'].with_company(self.company_id).remember_stock_master(
+                        self.endpoint, json.loads(self.payload))
+                if move:
+                    if self.kind == 'sales':
+                        move._apply_sales_response(response_data, self.message_prefix)
+                    else:
+                        move._apply_stock_response(response_data, self.message_prefix)
+        except UserError as e:
+            # Rejected by the VSDC (resultCd other than 000): the same payload would be rejected again
+            self._record_failure(str(e), retry=False)
+            return
+        except Exception as e:
+            # The VSDC has the submission, it must not be sent again: keep its response for a manual fix
+            _logger.exception(f'VSDC outbox entry {self.id}: could not apply the response')
+            self.write({'state': 'done', 'last_error': f'Response not applied: {e}',
+                        'processed_at': fields.Datetime.now()})
+            if move:
+                move.message_post(body=f"{self.message_prefix}: accepted by the VSDC, but its response "
+                                       f"could not be applied: {e}")
+            return
+        self.write({'state': 'done', 'last_error': False, 'processed_at': fields.Datetime.now()})
+
+    def _record_failure(self, error_msg, retry=True):
+        self.ensure_one()
+        attempts = self.attempts + 1
+        _logger.error(f'VSDC outbox entry {self.id} failed (attempt {attempts}): {error_msg}')
+        self.write({
+            'attempts': attempts,
+            'last_error': error_msg,
+            'state': 'pending' if retry and attempts < MAX_ATTEMPTS else 'failed',
+        })
+        if self.state == 'failed' and self.move_id:
+            if retry:
+                body = f"{self.message_prefix}: submission failed after {attempts} attempts: {error_msg}"
+            else:
+                body = f"{self.message_prefix}: submission rejected: {error_msg}"
+            self.move_id.message_post(body=body)
+
+    def action_retry(self):
+        self.write({'state': 'pending', 'attempts': 0})
+        self._trigger_cron()
+        return True
+
+    def action_process_now(self):
+        self._process_batch()
+        return True
@@ -0,0 +1,78 @@
+from odoo import models, fields, api
+from datetime import timedelta
+import random
+import time
+import uuid
+import logging
+
+_logger = logging.getLogger(__name__)
+
+SAMPLE_RATE_PARAM = 'zra_smart_invoice.post_timing_sample_rate'
+RETENTION_DAYS_PARAM = 'zra_smart_invoice.post_timing_retention_days'
+
+
+class PostTimer(object):
+    """Lap timer for one posting: each lap records wall time and SQL queries since the previous one.
+
+    A disabled timer (posting not sampled) ignores every call.
+    """
+
+    def __init__(self, env, enabled, batch_size=0):
+        self.env = env
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.ref = uuid.uuid4().hex[:12] if enabled else False
+        self.rows = []
+        self._started = time.perf_counter()
+        self._queries = env.cr.sql_log_count
+
+    def lap(self, stage, move=None):
+        if not self.enabled:
+            return
+        now, queries = time.perf_counter(), self.env.cr.sql_log_count
+        self.rows.append({
+            'name': self.ref,
+            'move_id': move.id if move else False,
+            'stage': stage,
+            'sequence': len(self.rows),
+            'duration_ms': (now - self._started) * 1000.0,
+            'query_count': queries - self._queries,
+            'batch_size': self.batch_size,
+        })
+        self._started, self._queries = now, queries
+
+    def save(self):
+        if self.enabled and self.rows:
+            self.env['zra.post.timing'].sudo().create(self.rows)
+            self.rows = []
+
+
+class ZraPostTiming(models.Model):
+    _name = 'zra.post.timing'
+    _description = 'ZRA Posting Stage Timing'
+    _order = 'id desc'
+
+    name = fields.Char(string='Posting', required=True, index=True)
+    move_id = fields.Many2one('account.move', string='Invoice', index='btree_not_null', ondelete='cascade')
+    stage = fields.Char(string='Stage', required=True)
+    sequence = fields.Integer(string='Sequence')
+    duration_ms = fields.Float(string='Duration (ms)', group_operator='avg')
+    query_count = fields.Integer(string='SQL Queries', group_operator='avg')
+    batch_size = fields.Integer(string='Moves in Batch')
+
+    @api.model
+    def _start(self, moves):
+        """Timer for posting ``moves``, enabled for the sampled share of postings."""
+        try:
+            rate = float(self.env['ir.config_parameter'].sudo().get_param(SAMPLE_RATE_PARAM, 0.0))
+        except (TypeError, ValueError):
+            rate = 0.0
+        return PostTimer(self.env, rate > 0 and random.random() < rate, len(moves))
+
+    @api.autovacuum
+    def _gc_timings(self):
+        try:
+            days = int(self.env['ir.config_parameter'].sudo().get_param(RETENTION_DAYS_PARAM, 30))
+        except (TypeError, ValueError):
+            days = 30
+        self.search([('create_date', '<', fields.Datetime.now() - timedelta(days=days))]).unlink()
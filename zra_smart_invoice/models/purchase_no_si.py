@@ -33,6 +33,7 @@ class StockPicking(models.Model):
 
             # Construct itemList once
             item_list = []
+            on_hand = self.env['stock.quant']._zra_on_hand(moves.product_id, picking.location_dest_id)
             for idx, move in enumerate(moves):
                 product = move.product_id
                 product_template = product.product_tmpl_id
@@ -90,18 +91,13 @@ class StockPicking(models.Model):
                 })
 
                 # Calculate the updated stock quantity
-                stock_quant = self.env['stock.quant'].search(
-                    [('product_id', '=', product.id), ('location_id', '=', picking.location_dest_id.id)], limit=1)
-                if not stock_quant:
-                    current_stock_qty = 0
-                else:
-                    current_stock_qty = stock_quant.quantity
+                current_stock_qty = on_hand.get(product.id, 0.0)
 
                 # Adjust stock quantity based on operation type
                 if picking.picking_type_id.code == 'incoming':
                     updated_stock_qty = current_stock_qty
                 elif picking.picking_type_id.code == 'outgoing':
-                    updated_stock_qty = stock_quant.quantity
+                    updated_stock_qty = current_stock_qty
 
             company = self.env.company
 
@@ -141,7 +137,7 @@ class StockPicking(models.Model):
                 _logger.info('Payload being sent:', json.dumps(payload_purchase, indent=4))
 
                 try:
-                    response = requests.post(config_settings.purchase_endpoint, json=payload_purchase)
+                    response = self.env['zra.vsdc.client'].post(config_settings.purchase_endpoint, json=payload_purchase)
                     response.raise_for_status()
                     result_msg_purchase = response.json().get('resultMsg', 'No result message returned')
 
@@ -175,7 +171,7 @@ class StockPicking(models.Model):
                 _logger.info('Payload being sent:', json.dumps(payload_stock_master, indent=4))
 
                 try:
-                    response = requests.post(config_settings.stock_master_endpoint,
+                    response = self.env['zra.vsdc.client'].post(config_settings.stock_master_endpoint,
                                              json=payload_stock_master)
                     response.raise_for_status()
                     result_msg_stock_master = response.json().get('resultMsg', 'No result message returned')
@@ -218,7 +214,7 @@ class StockPicking(models.Model):
                 _logger.info('Payload being sent:', json.dumps(payload_new_endpoint, indent=4))
 
                 try:
-                    response = requests.post(config_settings.stock_io_endpoint, json=payload_new_endpoint)
+                    response = self.env['zra.vsdc.client'].post(config_settings.stock_io_endpoint, json=payload_new_endpoint)
                     response.raise_for_status()
                     result_msg_new_endpoint = response.json().get('resultMsg', 'No result message returned')
 
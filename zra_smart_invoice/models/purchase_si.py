@@ -5,17 +5,10 @@ import requests
 import json
 import logging
 from datetime import datetime
+from . import vsdc_stream
 
 _logger = logging.getLogger(__name__)
 
-fetch_options_counter = 0
-fetch_purchase_data_counter = 0
-fetch_counter = 0
-
-fetch_options_cache = None
-fetch_options_last_request = None
-fetch_data_cache = None
-
 
 class PurchaseData(models.Model):
     _name = 'purchase.data'
@@ -38,6 +31,8 @@ class PurchaseData(models.Model):
     cd = fields.Char(string='Country Code')
     item_nm = fields.Char(string='Item Name')
     location_id = fields.Many2one('stock.location', string='Location', required=False)
+    company_id = fields.Many2one('res.company', string='Company', index=True,
+                                 default=lambda self: self.env.company)
     tot_tax_amt = fields.Float(string='Total Tax Amount')
     tot_amt = fields.Float(string='Total Amount')
     remark = fields.Text(string='Remark')
@@ -64,7 +59,7 @@ class PurchaseData(models.Model):
     )
 
     def action_fetch_data(self):
-        self._fetch_data_from_endpoint()
+        self.env['zra.purchase.staging']._sync_company(self.env.company)
         return {
             'type': 'ir.actions.act_window',
             'name': 'Fetched Data',
@@ -174,23 +169,18 @@ class PurchaseData(models.Model):
                 print("Error processing sale:", sale)
                 print("Exception:", e)
 
-    def log_endpoint_hits(self):
-        print('Fetch Options Endpoint Hit Count: %d', fetch_options_counter)
-        print('Fetch Purchase Data Endpoint Hit Count: %d', fetch_purchase_data_counter)
-
-    def _fetch_data_from_endpoint(self):
-        global fetch_counter, fetch_data_cache, fetch_options_last_request
-
-        # Check if the cache is valid
-        if fetch_data_cache is not None and fetch_options_last_request == "20240105210300":
-            return fetch_data_cache
-
-        fetch_counter += 1
-        print('Fetch Endpoint Hit Count:', fetch_counter)
+    def _stream_purchase_sales(self):
+        """Yield the purchase sales of the VSDC one at a time, as the response is read.
 
+        Network fetch; only the staging sync should call this, views read
+        zra.purchase.staging. Raises on transport errors and unexpected result codes.
+        """
         company = self.env.company
         config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
         url = config_settings.purchase_si_endpoint
+
+        _logger.debug(f'Fetching purchase sales from {url}')
+
         headers = {'Content-Type': 'application/json'}
         payload = {
             "tpin": company.tpin,
@@ -198,47 +188,23 @@ class PurchaseData(models.Model):
             "lastReqDt": "20240105210300"
         }
 
-        try:
-            response = requests.post(url, data=json.dumps(payload), headers=headers)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            print('Error fetching data:', e)
-            return None
-
-        try:
-            result = response.json()
-        except ValueError as e:
-            print('Error parsing JSON response:', e)
-            return None
-
-        if result.get('resultCd') == '000':
-            fetch_data_cache = result['data']
-            fetch_options_last_request = "20240105210300"
-            return result['data']
-        else:
-            print('Failed to fetch data:', result.get('resultMsg'))
-            return None
+        response = self.env['zra.vsdc.client'].post(url, data=json.dumps(payload), headers=headers, stream=True)
+        stream, sales = vsdc_stream.stream_list(response, 'saleList')
+        yield from sales
+        # 001: no purchases for this taxpayer
+        if stream.envelope.get('resultCd') not in ('000', '001'):
+            raise UserError(f"Purchase fetch failed: {stream.envelope.get('resultMsg')} "
+                            f"({stream.envelope.get('resultCd')})")
 
     def _get_fetch_options(self):
-        global fetch_options_cache, fetch_options_last_request
-
-        if fetch_options_cache is None or fetch_options_last_request != "20240105210300":
-            data = self._fetch_data_from_endpoint()
-            if data is None:
-                return []
-
-            sale_list = data.get('saleList', [])
-            existing_invoices = self.search([]).mapped('spplr_invc_no')
-            new_options = []
-            for sale in sale_list:
-                if sale['spplrInvcNo'] and sale['spplrInvcNo'] not in existing_invoices:
-                    item_nm = sale['itemList'][0]['itemNm'] if sale['itemList'] else 'No Item'
-                    option_label = f"{sale['spplrNm']} - {sale['spplrTpin']} - {item_nm}"
-                    new_options.append((str(sale['spplrInvcNo']), option_label))
-            fetch_options_cache = new_options
-            fetch_options_last_request = "20240105210300"
-
-        return fetch_options_cache
+        self.env['purchase.data'].flush_model(['spplr_invc_no', 'company_id'])
+        self.env.cr.execute("""
+            SELECT DISTINCT spplr_invc_no FROM purchase_data
+            WHERE spplr_invc_no IS NOT NULL AND company_id = %s
+        """, (self.env.company.id,))
+        existing_invoices = [row[0] for row in self.env.cr.fetchall()]
+        domain = [('spplr_invc_no', 'not in', existing_invoices)] if existing_invoices else []
+        return self.env['zra.purchase.staging']._selection(domain)
 
     # def fetch_purchase_data(self, *args, **kwargs):
     #     _logger.info(f"Fetching data for purchase record with ID: {self.id}")
@@ -324,60 +290,54 @@ class PurchaseData(models.Model):
         if not selected_option:
             raise UserError(_('Please select an option to fetch data.'))
 
-        data = self._fetch_data_from_endpoint()
-        if data is None:
-            raise UserError(_('Failed to fetch data from the endpoint.'))
-
-        selected_invoice_number = int(selected_option)
-        for sale in data['saleList']:
-            if sale['spplrInvcNo'] == selected_invoice_number:
-                self.spplr_tpin = sale['spplrTpin']
-                self.spplr_nm = sale['spplrNm']
-                self.spplr_bhf_id = sale['spplrBhfId']
-                self.spplr_invc_no = sale['spplrInvcNo']
-                self.rcpt_ty_cd = sale['rcptTyCd']
-                self.pmt_ty_cd = sale['pmtTyCd']
-                self.item_nm = sale['itemList'][0]['itemNm']
-
-                def parse_date(date_str):
-                    if not date_str:
-                        return None
-                    for fmt in ('%Y%m%d%H%M%S', '%Y-%m-%d %H:%M:%S', '%Y%m%d'):
-                        try:
-                            return datetime.strptime(date_str, fmt)
-                        except ValueError:
-                            pass
-                    raise ValueError(f"Date format for {date_str} is not supported")
-
-                self.cfm_dt = parse_date(sale['cfmDt']) if sale.get('cfmDt') else None
-                self.sales_dt = parse_date(sale['salesDt']).date() if sale.get('salesDt') else None
-                self.stock_rls_dt = parse_date(sale['stockRlsDt']) if sale.get('stockRlsDt') else None
-
-                self.tot_item_cnt = sale['totItemCnt']
-                self.tot_taxbl_amt = sale['totTaxblAmt']
-                self.tot_tax_amt = sale['totTaxAmt']
-                self.tot_amt = sale['totAmt']
-                self.remark = sale.get('remark', '')
-
-                items = [(0, 0, {
-                    'item_seq': item['itemSeq'],
-                    'item_cd': item['itemCd'],
-                    'item_nm': item['itemNm'],
-                    'qty': item['qty'],
-                    'fetched': item['qty'],
-                    'prc': item['prc'],
-                    'vat_cat_cd': item['vatCatCd'],
-                    'tot_amt': item['totAmt'],
-                    'qty_unit_cd': item['qtyUnitCd'],
-                    'item_cls_cd': item['itemClsCd'],
-                    'pkg_unit_cd': item['pkgUnitCd'],
-                }) for item in sale['itemList']]
-                self.item_list = items
-                self.fetched = True
-                break
-        else:
+        selected_sale = self.env['zra.purchase.staging']._get_payload(selected_option)
+        if selected_sale is None or selected_sale['spplrInvcNo'] != int(selected_option):
             raise UserError(_('Selected invoice not found in the fetched data.'))
 
+        self.spplr_tpin = selected_sale['spplrTpin']
+        self.spplr_nm = selected_sale['spplrNm']
+        self.spplr_bhf_id = selected_sale['spplrBhfId']
+        self.spplr_invc_no = selected_sale['spplrInvcNo']
+        self.rcpt_ty_cd = selected_sale['rcptTyCd']
+        self.pmt_ty_cd = selected_sale['pmtTyCd']
+        self.item_nm = selected_sale['itemList'][0]['itemNm']
+
+        def parse_date(date_str):
+            if not date_str:
+                return None
+            for fmt in ('%Y%m%d%H%M%S', '%Y-%m-%d %H:%M:%S', '%Y%m%d'):
+                try:
+                    return datetime.strptime(date_str, fmt)
+                except ValueError:
+                    pass
+            raise ValueError(f"Date format for {date_str} is not supported")
+
+        self.cfm_dt = parse_date(selected_sale['cfmDt']) if selected_sale.get('cfmDt') else None
+        self.sales_dt = parse_date(selected_sale['salesDt']).date() if selected_sale.get('salesDt') else None
+        self.stock_rls_dt = parse_date(selected_sale['stockRlsDt']) if selected_sale.get('stockRlsDt') else None
+
+        self.tot_item_cnt = selected_sale['totItemCnt']
+        self.tot_taxbl_amt = selected_sale['totTaxblAmt']
+        self.tot_tax_amt = selected_sale['totTaxAmt']
+        self.tot_amt = selected_sale['totAmt']
+        self.remark = selected_sale.get('remark', '')
+
+        items = [(0, 0, {
+            'item_seq': item['itemSeq'],
+            'item_cd': item['itemCd'],
+            'item_nm': item['itemNm'],
+            'qty': item['qty'],
+            'fetched': item['qty'],
+            'prc': item['prc'],
+            'vat_cat_cd': item['vatCatCd'],
+            'tot_amt': item['totAmt'],
+            'qty_unit_cd': item['qtyUnitCd'],
+            'item_cls_cd': item['itemClsCd'],
+            'pkg_unit_cd': item['pkgUnitCd'],
+        }) for item in selected_sale['itemList']]
+        self.item_list = items
+        self.fetched = True
+
         return {
             'type': 'ir.actions.act_window',
             'name': 'Purchase Data',
@@ -390,96 +350,50 @@ class PurchaseData(models.Model):
             'target': 'current',
         }
 
-    # To log the count whenever needed, you can add a separate method
-    def print_endpoint_hits(self):
-        print('Fetch Options Endpoint Hit Count:', fetch_options_counter)
-        print('Fetch Purchase Data Endpoint Hit Count:', fetch_purchase_data_counter)
+    def _zra_product_lookup(self, location=None):
+        return self.env['product.template']._zra_lookup_products(
+            names=self.item_list.mapped('item_nm'), item_codes=self.item_list.mapped('item_cd'), location=location)
 
     def get_product_quantities(self):
+        lookup = self._zra_product_lookup(self.location_id)
         product_quantities = {}
         for item in self.item_list:
-            product_template = self.env['product.template'].search(
-                [('item_Cd', '=', item.item_cd), ('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                product = self.env['product.product'].search([('product_tmpl_id', '=', product_template.id)], limit=1)
-                if product:
-                    stock_quant = self.env['stock.quant'].search(
-                        [('product_id', '=', product.id), ('location_id', '=', self.location_id.id)], limit=1)
-                    quantity = stock_quant.quantity if stock_quant else 0
-                    product_quantities[(item.item_cd, item.item_nm)] = quantity
-                    print(f"Product Name: {item.item_nm}, Item Code: {item.item_cd}, Quantity: {quantity}")
-                else:
-                    product_quantities[(item.item_cd, item.item_nm)] = 0
-                    print(f"Product Name: {item.item_nm}, Item Code: {item.item_cd}, Quantity: 0")
-            else:
-                product_quantities[(item.item_cd, item.item_nm)] = 0
-                print(f"Product Name: {item.item_nm}, Item Code: {item.item_cd}, Quantity: 0")
+            quantity = lookup.quantity(item.item_nm, item.item_cd)
+            product_quantities[(item.item_cd, item.item_nm)] = quantity
+            print(f"Product Name: {item.item_nm}, Item Code: {item.item_cd}, Quantity: {quantity}")
 
         return product_quantities
 
     def fetch_existing_quantities(self):
+        lookup = self._zra_product_lookup()
         product_quantities = {}
         for item in self.item_list:
-            product_template = self.env['product.template'].search(
-                [('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                product = self.env['product.product'].search([('product_tmpl_id', '=', product_template.id)], limit=1)
-                if product:
-                    stock_quant = self.env['stock.quant'].search(
-                        [('product_id', '=', product.id),
-                         ('location_id', '=', self.env.ref('stock.stock_location_stock').id)], limit=1)
-                    quantity = stock_quant.quantity if stock_quant else 0
-                    product_quantities[item.item_nm] = quantity
-                    print(f"Product Name: {item.item_nm}, Quantity: {quantity}")
-                else:
-                    product_quantities[item.item_nm] = 0
-                    print(f"Product Name: {item.item_nm}, Quantity: 0")
-            else:
-                product_quantities[item.item_nm] = 0
-                print(f"Product Name: {item.item_nm}, Quantity: 0")
+            quantity = lookup.quantity(item.item_nm)
+            product_quantities[item.item_nm] = quantity
+            print(f"Product Name: {item.item_nm}, Quantity: {quantity}")
 
         return product_quantities
 
     def get_total_quantities(self):
+        lookup = self._zra_product_lookup(self.location_id)
         product_quantities = {}
         for item in self.item_list:
-            product_template = self.env['product.template'].search(
-                [('item_Cd', '=', item.item_cd), ('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                product = self.env['product.product'].search([('product_tmpl_id', '=', product_template.id)], limit=1)
-                if product:
-                    stock_quant = self.env['stock.quant'].search(
-                        [('product_id', '=', product.id), ('location_id', '=', self.location_id.id)], limit=1)
-                    quantity = stock_quant.quantity if stock_quant else 0
-                    product_quantities[(item.item_cd, item.item_nm)] = quantity + item.qty
-                    print(
-                        f"Product Name: {item.item_nm}, Item Code: {item.item_cd}, Quantity: {quantity}, Total: {quantity + item.qty}")
-                else:
-                    product_quantities[(item.item_cd, item.item_nm)] = item.qty
-                    print(f"Product Name: {item.item_nm}, Item Code: {item.item_cd}, Quantity: 0, Total: {item.qty}")
-            else:
-                product_quantities[(item.item_cd, item.item_nm)] = item.qty
-                print(f"Product Name: {item.item_nm}, Item Code: {item.item_cd}, Quantity: 0, Total: {item.qty}")
+            quantity = lookup.quantity(item.item_nm, item.item_cd)
+            product_quantities[(item.item_cd, item.item_nm)] = quantity + item.qty
+            print(f"Product Name: {item.item_nm}, Item Code: {item.item_cd}, Quantity: {quantity}, "
+                  f"Total: {quantity + item.qty}")
 
         return product_quantities
 
     def refresh_list(self):
-
-        global fetch_options_cache, fetch_options_last_request
-
-        fetch_options_cache = None
-        fetch_options_last_request = None
+        if not self.env['zra.purchase.staging']._sync_company(self.env.company):
+            raise UserError(_('Could not fetch the purchase list from the VSDC. Please try again.'))
         return {
             'type': 'ir.actions.client',
             'tag': 'reload',
         }
 
     def confirm_invoice(self):
-
-        global fetch_options_cache, fetch_options_last_request
-
-        fetch_options_cache = None
-        fetch_options_last_request = None
         self.ensure_one()
 
         if not self.item_list:
@@ -632,10 +546,13 @@ class PurchaseData(models.Model):
         }
 
     def create_or_update_products(self):
-        product_template_model = self.env['product.template']
+        # New products are registered with ZRA in the background, not one saveItem call each here
+        product_template_model = self.env['product.template'].with_context(zra_defer_registration=True)
         product_product_model = self.env['product.product']
         stock_quant_model = self.env['stock.quant']
         stock_location = self.env.ref('stock.stock_location_stock')
+        lookup = self._zra_product_lookup()
+        created_templates = {}
 
         for item in self.item_list:
             product_name = item.item_nm
@@ -644,7 +561,7 @@ class PurchaseData(models.Model):
                 continue
 
             # Check if product template exists, or create a new one
-            existing_template = product_template_model.search([('name', '=', product_name)], limit=1)
+            existing_template = created_templates.get(product_name) or lookup.template(product_name)
             template_values = {
                 'name': item.item_nm,
                 'type': 'product',
@@ -665,9 +582,12 @@ class PurchaseData(models.Model):
                 # Create new product template
                 # print(f'Creating new product template with values: {template_values}')
                 existing_template = product_template_model.create(template_values)
+                created_templates[product_name] = existing_template
 
             # Ensure the product variant exists
-            product_variant = product_product_model.search([('product_tmpl_id', '=', existing_template.id)], limit=1)
+            product_variant = lookup.product(product_name) if lookup.template(product_name) == existing_template else None
+            if not product_variant:
+                product_variant = product_product_model.search([('product_tmpl_id', '=', existing_template.id)], limit=1)
             if not product_variant:
                 product_variant = product_product_model.create({'product_tmpl_id': existing_template.id})
 
@@ -769,7 +689,7 @@ class PurchaseData(models.Model):
         # print('Payload being sent:', json.dumps(payload, indent=4))
 
         try:
-            response = requests.post(url, data=json.dumps(payload), headers=headers)
+            response = self.env['zra.vsdc.client'].post(url, data=json.dumps(payload), headers=headers)
             response.raise_for_status()
             print('Purchase Rejected successfully:', response.json())
         except requests.exceptions.RequestException as e:
@@ -847,7 +767,7 @@ class PurchaseData(models.Model):
         # print('Payload being sent:', json.dumps(payload, indent=4))
 
         try:
-            response = requests.post(url, data=json.dumps(payload), headers=headers)
+            response = self.env['zra.vsdc.client'].post(url, data=json.dumps(payload), headers=headers)
             response.raise_for_status()
             print('Purchase saved successfully:', response.json())
         except requests.exceptions.RequestException as e:
@@ -885,7 +805,7 @@ class PurchaseData(models.Model):
         }
         print('Payload being sent:', json.dumps(payload, indent=4))
         try:
-            response = requests.post(url, data=json.dumps(payload), headers=headers)
+            response = self.env['zra.vsdc.client'].post(url, data=json.dumps(payload), headers=headers)
             response.raise_for_status()
             print('Stock items saved successfully:', response.json())
         except requests.exceptions.RequestException as e:
@@ -909,7 +829,7 @@ class PurchaseData(models.Model):
 
         config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
         try:
-            response = requests.post(config_settings.stock_master_endpoint, data=json.dumps(payload),
+            response = self.env['zra.vsdc.client'].post(config_settings.stock_master_endpoint, data=json.dumps(payload),
                                      headers={'Content-Type': 'application/json'})
             response.raise_for_status()
             print('Stock master saved successfully:', response.json())
@@ -971,7 +891,7 @@ class PurchaseData(models.Model):
         }
         # print('Payload being sent:', json.dumps(payload, indent=4))
         try:
-            response = requests.post(url, data=json.dumps(payload), headers=headers)
+            response = self.env['zra.vsdc.client'].post(url, data=json.dumps(payload), headers=headers)
             response.raise_for_status()
             print('Stock items saved successfully:', response.json())
         except requests.exceptions.RequestException as e:
@@ -985,8 +905,8 @@ class PurchaseData(models.Model):
         url = config_settings.stock_master_endpoint
         headers = {'Content-Type': 'application/json'}
 
-        total_quantities = self.get_total_quantities()
-        product_quantities = self.fetch_existing_quantities()
+        lookup = self._zra_product_lookup()
+        product_quantities = {item.item_nm: lookup.quantity(item.item_nm) for item in self.item_list}
 
         payload = {
             "tpin": company.tpin,
@@ -1002,12 +922,7 @@ class PurchaseData(models.Model):
             confirmed_qty = item.qty
             existing_qty = product_quantities.get(item.item_nm, 0)
 
-            # Search for product template based on item name
-            product_template = self.env['product.template'].search([('name', '=', item.item_nm)], limit=1)
-            if product_template:
-                item_cd = product_template.item_Cd
-            else:
-                item_cd = False
+            item_cd = lookup.template(item.item_nm).item_Cd
 
             total_qty = existing_qty + confirmed_qty
             print('existing', existing_qty)
@@ -1020,7 +935,7 @@ class PurchaseData(models.Model):
 
         print('Stock master Payload being sent:', json.dumps(payload, indent=4))
         try:
-            response = requests.post(url, data=json.dumps(payload), headers=headers)
+            response = self.env['zra.vsdc.client'].post(url, data=json.dumps(payload), headers=headers)
             response.raise_for_status()
             print('Stock master saved successfully:', response.json())
         except requests.exceptions.RequestException as e:
@@ -1097,17 +1012,12 @@ class PurchaseItem(models.Model):
                 raise ValidationError("Accepted Quantity cannot be greater than Received Quantity.")
 
     def generate_item_code(self):
-        sequence = self.env['item.code.sequence'].search([], limit=1)
-        if not sequence:
-            sequence = self.env['item.code.sequence'].create({})
-        next_number = sequence.next_number
-        sequence.next_number += 1
-        next_number_str = str(next_number).zfill(7)
+        next_number_str = self.env['product.template']._zra_next_item_number()
         item_code = f"{self.item_nm[:2]}{self.pkg_unit_cd[:2]}{self.qty_unit_cd[:2]}{next_number_str}"
         # Ensure the item code is added to selection options
         products = self.env['product.template'].search([('name', '=', self.item_nm)])
         if item_code not in [product.item_Cd for product in products]:
-            self.env['product.template'].create({
+            self.env['product.template'].with_context(zra_defer_registration=True).create({
                 'name': self.item_nm,
                 'item_Cd': item_code,
             })
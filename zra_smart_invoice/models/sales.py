@@ -3,15 +3,60 @@ import requests
 import logging
 from datetime import datetime
 import json
-import socket
 from odoo.exceptions import ValidationError, UserError
 import qrcode
 import base64
 from io import BytesIO
+import hashlib
 import pytz
+from .vsdc_cache import VsdcCache
+from .post_timing import PostTimer
 
 _logger = logging.getLogger(__name__)
 
+QR_ATTACHMENT_MODEL = 'zra.qr.code'
+QR_CACHE_TTL = 3600
+# The QR cron gives up on a move after this many failed renders
+QR_MAX_ATTEMPTS = 5
+# Hot reprints skip the attachment read; keyed by qr_code_url
+_qr_cache = VsdcCache(max_entries=256)
+
+
+def _render_qr_png(url):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    img = qr.make_image(fill='black', back_color='white')
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+# (payload suffix, category matched for taxblAmt*, category matched for taxAmt*)
+# Categories are matched as substrings of the line tax description, as before.
+TAX_BUCKETS = [
+    ('A', 'A', 'A'),
+    ('B', 'B', 'B'),
+    ('C', 'C', 'C'),
+    ('C1', 'C1', 'C1'),
+    ('C2', 'C2', 'C2'),
+    ('C3', 'C3', 'C3'),
+    ('D', 'D', 'D'),
+    ('Rvat', 'RVAT', 'Rvat'),
+    ('E', 'E', 'E'),
+    ('F', 'F', 'F'),
+    ('Ipl1', 'Ipl1', 'Ipl1'),
+    ('Ipl2', 'Ipl2', 'Ipl2'),
+    ('Tl', 'Tl', 'Tl'),
+    ('Ecm', 'Ecm', 'Ecm'),
+    ('Exeeg', 'Exeeg', 'Exeeg'),
+    ('Tot', 'Tot', 'Tot'),
+]
+
 
 class AccountMove(models.Model):
     _inherit = 'account.move'
@@ -34,22 +79,46 @@ class AccountMove(models.Model):
     sdc_id = fields.Char(string='SDC ID')
     mrc_no = fields.Char(string='MRC No')
     qr_code_url = fields.Char(string='QR Code URL')
-    qr_code_image = fields.Char(string='QR Code Image')
+    zra_outbox_ids = fields.One2many('zra.outbox', 'move_id', string='VSDC Submissions')
+    qr_code_attachment_id = fields.Many2one('ir.attachment', string='QR Code Attachment', copy=False,
+                                            index='btree_not_null')
+    qr_code_image = fields.Char(string='QR Code Image', compute='_compute_qr_code_image')
+    qr_code_attempts = fields.Integer(string='QR Code Failed Renders', copy=False, default=0)
     datetime_field = fields.Datetime(string='Date Time', default=fields.Datetime.now) 
+    zra_sale_order_id = fields.Many2one('sale.order', string='Source Sale Order', copy=False,
+                                        index='btree_not_null')
 
-    def create(self, vals):
-        """ Override create to set the values from sale order if they exist """
-        # Check for sales order reference in vals
-        if 'invoice_origin' in vals:
-            sale_order = self.env['sale.order'].search([('name', '=', vals['invoice_origin'])], limit=1)
+    @api.model
+    def _zra_sale_orders_by_name(self, origins):
+        """{name: sale.order} for the given invoice origins, in one search."""
+        origins = list({origin for origin in origins if origin})
+        if not origins:
+            return {}
+        sale_orders = {}
+        for order in self.env['sale.order'].search([('name', 'in', origins)], order='id'):
+            sale_orders.setdefault(order.name, order)
+        return sale_orders
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """ Override create to link the sale order and copy its values, if it exists """
+        sale_orders = self._zra_sale_orders_by_name(vals.get('invoice_origin') for vals in vals_list)
+        for vals in vals_list:
+            sale_order = sale_orders.get(vals.get('invoice_origin'))
             if sale_order:
+                vals['zra_sale_order_id'] = sale_order.id
                 vals['tpin'] = sale_order.tpin or ''
                 vals['lpo'] = sale_order.lpo or ''
                 vals['export_country_id'] = sale_order.export_country_id.id or False
 
         # Create the account move
-        move = super(AccountMove, self).create(vals)
-        return move
+        return super(AccountMove, self).create(vals_list)
+
+    def write(self, vals):
+        if 'invoice_origin' in vals and 'zra_sale_order_id' not in vals:
+            sale_order = self._zra_sale_orders_by_name([vals['invoice_origin']]).get(vals['invoice_origin'])
+            vals = dict(vals, zra_sale_order_id=sale_order.id if sale_order else False)
+        return super(AccountMove, self).write(vals)
 
     def send_to_external_api(self, order_payload):
         config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
@@ -59,8 +128,8 @@ class AccountMove(models.Model):
         headers = {'Content-Type': 'application/json'}
 
         try:
-            sales_response = requests.post(sales_url, json=order_payload.get('sales_payload'), headers=headers)
-            stock_response = requests.post(stock_url, json=order_payload.get('stock_payload'), headers=headers)
+            sales_response = self.env['zra.vsdc.client'].post(sales_url, json=order_payload.get('sales_payload'), headers=headers)
+            stock_response = self.env['zra.vsdc.client'].post(stock_url, json=order_payload.get('stock_payload'), headers=headers)
 
             sales_response.raise_for_status()  # Raise HTTPError for bad responses
             stock_response.raise_for_status()  # Raise HTTPError for bad responses
@@ -178,9 +247,8 @@ class AccountMove(models.Model):
     def _change_partner_id(self):
         if self.partner_id:
             # If there's a related sale order, get the TPIN and LPO from there
-            sale_orders = self.env['sale.order'].search([('partner_id', '=', self.partner_id.id)], limit=1)
-            if sale_orders:
-                sale_order = sale_orders[0]
+            sale_order = self.zra_sale_order_id
+            if sale_order:
                 self.tpin = sale_order.tpin or ''
                 self.lpo = sale_order.lpo or ''
                 self.export_country_id = sale_order.export_country_id or False
@@ -205,58 +273,99 @@ class AccountMove(models.Model):
         report_url = f'/report/pdf/zra_smart_invoice.custom_account_invoices/{self.id}'
         return {'success': True, 'report_url': report_url}
 
+    def init(self):
+        # QR attachments are looked up by name, keyed on the QR code URL
+        self.env.cr.execute(f"""
+            CREATE INDEX IF NOT EXISTS ir_attachment_zra_qr_code_name_index
+            ON ir_attachment (name) WHERE res_model = '{QR_ATTACHMENT_MODEL}'
+        """)
+
+    @api.depends('qr_code_url', 'qr_code_attachment_id')
+    def _compute_qr_code_image(self):
+        """Base64 PNG of the QR code. Read-only: the attachment is created by the QR cron,
+        until then the image is rendered in memory."""
+        for record in self:
+            url = record.qr_code_url
+            if not url:
+                record.qr_code_image = False
+                continue
+            image = _qr_cache.get(url)
+            if image is None:
+                try:
+                    attachment = record.qr_code_attachment_id.sudo()
+                    raw = attachment.raw if attachment else _render_qr_png(url)
+                    image = base64.b64encode(raw).decode('utf-8')
+                    _qr_cache.set(url, image, QR_CACHE_TTL)
+                except Exception as e:
+                    _logger.error(f'Failed to generate QR Code for record {record.id}: {str(e)}')
+                    image = False
+            record.qr_code_image = image
+
     @api.model
+    def _zra_qr_attachment(self, url):
+        """Return the PNG attachment of a QR code URL, rendering it only if none exists yet."""
+        name = f'zra_qr_{hashlib.sha1(url.encode()).hexdigest()}.png'
+        Attachment = self.env['ir.attachment'].sudo()
+        attachment = Attachment.search([('res_model', '=', QR_ATTACHMENT_MODEL), ('name', '=', name)], limit=1)
+        if not attachment:
+            attachment = Attachment.create({
+                'name': name,
+                'res_model': QR_ATTACHMENT_MODEL,
+                'description': url,
+                'mimetype': 'image/png',
+                'raw': _render_qr_png(url),
+            })
+        return attachment
+
     def generate_qr_code_button(self):
         for record in self:
             if record.qr_code_url:
                 try:
-                    qr = qrcode.QRCode(
-                        version=1,
-                        error_correction=qrcode.constants.ERROR_CORRECT_L,
-                        box_size=10,
-                        border=4,
-                    )
-                    qr.add_data(record.qr_code_url)
-                    qr.make(fit=True)
-
-                    img = qr.make_image(fill='black', back_color='white')
-                    buffer = BytesIO()
-                    img.save(buffer, format="PNG")
-                    qr_code_image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-
-                    record.write({'qr_code_image': qr_code_image_base64})
-                    print(f'QR Code image saved for record {record.id}')
+                    record.qr_code_attachment_id = self._zra_qr_attachment(record.qr_code_url)
+                    record.qr_code_attempts = 0
                 except Exception as e:
-                    print(f'Failed to generate QR Code for record {record.id}: {str(e)}')
+                    _logger.error(f'Failed to generate QR Code for record {record.id}: {str(e)}')
+                    record.qr_code_attempts += 1
             else:
-                record.write({'qr_code_image': False})
-                # print(f'No QR Code URL for record {record.id}')
+                record.qr_code_attachment_id = False
+
+    @api.model
+    def _cron_render_qr_codes(self, limit=500):
+        moves = self.search([
+            ('qr_code_url', '!=', False),
+            ('qr_code_attachment_id', '=', False),
+            ('qr_code_attempts', '<', QR_MAX_ATTEMPTS),
+        ], order='qr_code_attempts, id', limit=limit)
+        _logger.info(f'Rendering {len(moves)} pending QR codes')
+        moves.generate_qr_code_button()
+
+    @api.model
+    def _trigger_qr_cron(self):
+        cron = self.env.ref('zra_smart_invoice.ir_cron_zra_qr_codes', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
 
     def get_exchange_rate(self, from_currency, to_currency):
         """Retrieve the latest exchange rate between two currencies."""
         if from_currency == to_currency:
             return 1.0
 
-        rate = self.env['res.currency.rate'].search([
-            ('currency_id', '=', from_currency.id),
-            ('name', '<=', fields.Date.today())
-        ], order='name desc', limit=1)
+        company = self.env.company
+        today = fields.Date.today()
+        rate = self.env['res.currency.rate']._zra_rate_values(company.id, from_currency.id, today)
 
         if not rate:
             raise ValidationError(f"No exchange rate found for {from_currency.name} to {to_currency.name}.")
 
-        if to_currency == self.env.company.currency_id:
-            return rate.inverse_company_rate
+        if to_currency == company.currency_id:
+            return rate[1]
 
-        to_rate = self.env['res.currency.rate'].search([
-            ('currency_id', '=', to_currency.id),
-            ('name', '<=', fields.Date.today())
-        ], order='name desc', limit=1)
+        to_rate = self.env['res.currency.rate']._zra_rate_values(company.id, to_currency.id, today)
 
         if not to_rate:
             raise ValidationError(f"No exchange rate found for {to_currency.name}.")
 
-        return rate.inverse_company_rate / to_rate.inverse_company_rate
+        return rate[1] / to_rate[1]
 
     def get_primary_tax(self, partner):
         if partner.tax_id:
@@ -276,84 +385,106 @@ class AccountMove(models.Model):
     def get_tax_rate(self, tax):
         return tax.amount if tax else 0.0
 
-
-    # def calculate_taxable_amount(self, lines, tax_category):
-    #     total_amount = 0.0
-    #     for line in lines:
-    #         tax_description = self.get_tax_description(line.tax_ids)
-    #         if tax_category in tax_description:
-    #             tax_rate = sum(line.tax_ids.mapped('amount')) / 100
-    #             # Calculate discounted price with tax removed
-    #             line_price_incl_tax = line.price_unit * (1 + tax_rate)
-    #             discounted_price = line_price_incl_tax * (1 - (line.discount / 100))
-    #             taxable_amount = round((line.quantity * discounted_price) / (1 + tax_rate), 4)
-    #             total_amount += taxable_amount
-    #     return total_amount
-
-    def calculate_taxable_amount(self, lines, tax_category):
-        total_amount = 0.0
-        for line in lines:
-            tax_description = self.get_tax_description(line.tax_ids)
-            if tax_category in tax_description:
-                tax_rate = sum(line.tax_ids.mapped('amount')) / 100
-                # Calculate discounted price with tax removed
-                # line_price_excl_tax = line.price_unit
-                # discounted_price = round((line_price_excl_tax) * (1 - (line.discount / 100)), 2)
-                # taxable_amount = round((round(line.quantity, 2) * discounted_price) / (1 + tax_rate), 4)
-                
-                item_sply_amount = (line.quantity) * (line.price_unit)
-                item_discount_amount = ((item_sply_amount) * (line.discount / 100))
-                item_net_sply_amount = (item_sply_amount) - (round(item_discount_amount, 2))
-                taxable_amount_custom = round(item_net_sply_amount / (1 + tax_rate) , 4)
-                total_amount += taxable_amount_custom
-        return total_amount
-
-    def calculate_tax_amount(self, lines, tax_category):
-        total_tax = 0.0
-        for line in lines:
-            tax_description = self.get_tax_description(line.tax_ids)
-            if tax_category in tax_description:
-                tax_rate = sum(line.tax_ids.mapped('amount')) / 100
-                # Calculate the taxable amount without tax
-                # line_price_excl_tax = line.price_unit
-                # discounted_price = round((line_price_excl_tax) * (1 - (line.discount / 100)), 2)
-                # taxable_amount = round((round(line.quantity, 2) * discounted_price) / (1 + tax_rate), 4)
-                # tax_amount = round(taxable_amount * tax_rate, 4)
-                
-                item_sply_amount = (line.quantity) * (line.price_unit)
-                item_discount_amount = ((item_sply_amount) * (line.discount / 100))
-                item_net_sply_amount = (item_sply_amount) - (round(item_discount_amount, 2))
-                taxable_amount_custom = round(item_net_sply_amount / (1 + tax_rate) * tax_rate, 4)
-                
-                total_tax += taxable_amount_custom
-        return total_tax
-
-    # def calculate_tax_amount(self, lines, tax_category):
-    #     total_tax = 0.0
-    #     for line in lines:
-    #         tax_description = self.get_tax_description(line.tax_ids)
-    #         if tax_category in tax_description:
-    #             tax_rate = sum(line.tax_ids.mapped('amount')) / 100
-    #             # Calculate the taxable amount without tax
-    #             line_price_incl_tax = line.price_unit * (1 + tax_rate)
-    #             discounted_price = line_price_incl_tax * (1 - (line.discount / 100))
-    #             taxable_amount = round((line.quantity * discounted_price) / (1 + tax_rate), 4)
-    #             tax_amount = round(taxable_amount * tax_rate, 4)
-    #             total_tax += tax_amount
-    #     return total_tax
-
     def calculate_tax_inclusive_price(self, line):
         taxes = line.tax_ids.compute_all(line.price_unit, quantity=1, product=line.product_id, partner=self.partner_id)
         tax_inclusive_price = taxes['total_included']
         return tax_inclusive_price
 
+    def _line_amounts(self, line):
+        tax_rate = sum(line.tax_ids.mapped('amount')) / 100
+        item_sply_amount = (line.quantity) * (line.price_unit)
+        item_discount_amount = ((item_sply_amount) * (line.discount / 100))
+        item_net_sply_amount = (item_sply_amount) - (round(item_discount_amount, 2))
+        return {
+            'tax_rate': tax_rate,
+            'tax_description': self.get_tax_description(line.tax_ids),
+            'sply_amount': item_sply_amount,
+            'discount_amount': item_discount_amount,
+            'net_sply_amount': item_net_sply_amount,
+        }
+
+    def _aggregate_invoice_lines(self, lines, item_builder):
+        """Build the item list and the taxblAmt*/taxAmt* buckets in one pass over the lines."""
+        taxable_totals = dict.fromkeys((bucket[0] for bucket in TAX_BUCKETS), 0.0)
+        tax_totals = dict.fromkeys((bucket[0] for bucket in TAX_BUCKETS), 0.0)
+        item_list = []
+        for index, line in enumerate(lines):
+            amounts = self._line_amounts(line)
+            item_list.append(item_builder(index, line, amounts))
+
+            tax_rate = amounts['tax_rate']
+            tax_description = amounts['tax_description']
+            taxable_amount = round(amounts['net_sply_amount'] / (1 + tax_rate), 4)
+            tax_amount = round(amounts['net_sply_amount'] / (1 + tax_rate) * tax_rate, 4)
+            for suffix, taxable_category, tax_category in TAX_BUCKETS:
+                if taxable_category in tax_description:
+                    taxable_totals[suffix] += taxable_amount
+                if tax_category in tax_description:
+                    tax_totals[suffix] += tax_amount
+
+        taxable_amounts = {f'taxblAmt{suffix}': round(total, 4) for suffix, total in taxable_totals.items()}
+        tax_amounts = {f'taxAmt{suffix}': round(total, 4) for suffix, total in tax_totals.items()}
+        return item_list, taxable_amounts, tax_amounts
+
     def get_sales_order_fields(self):
         """Retrieve tpin, lpo, and export_country_id from related sale order."""
-        sale_order = self.env['sale.order'].search([('name', '=', self.invoice_origin)], limit=1)
+        sale_order = self.zra_sale_order_id
         return sale_order.tpin, sale_order.lpo, sale_order.export_country_id.code if sale_order.export_country_id else None
 
     def action_post(self):
+        timer = self.env['zra.post.timing']._start(self)
         res = super(AccountMove, self).action_post()
+        timer.lap('core_post', self if len(self) == 1 else None)
+        self._zra_process_posted_moves(timer)
+        timer.save()
+        return res
+
+    def _zra_prefetch(self):
+        """Load everything the payload builders read for a batch of moves in a few queries."""
+        lines = self.mapped('invoice_line_ids')
+        lines.fetch(['product_id', 'tax_ids', 'quantity', 'price_unit', 'discount'])
+        lines.mapped('tax_ids').fetch(['amount', 'description'])
+        products = lines.mapped('product_id')
+        products.fetch(['name', 'barcode', 'detailed_type', 'product_tmpl_id'])
+        products.mapped('product_tmpl_id').fetch(['item_Cd', 'item_cls_cd', 'packaging_unit_cd', 'quantity_unit_cd'])
+        self.mapped('partner_id').fetch(['name', 'vat'])
+        self.mapped('zra_sale_order_id').fetch(['tpin', 'lpo', 'export_country_id'])
+
+    def _zra_process_posted_moves(self, timer=None):
+        """Build and queue the VSDC submissions for every move in self.
+
+        Works on any number of moves so mass-confirmation goes through the same
+        path; the outbox then sends the queued submissions concurrently.
+        """
+        moves = self.filtered(lambda m: m.move_type in ['out_invoice', 'out_refund', 'in_refund'])
+        if not moves:
+            return self.env['zra.outbox']
+        timer = timer or PostTimer(self.env, False)
+        single = moves if len(moves) == 1 else None
+        moves._zra_prefetch()
+        timer.lap('prefetch', single)
+        entries = self.env['zra.outbox']
+        stock_deltas = {}
+        for move in moves:
+            entries |= move._zra_process_posted_move(stock_deltas, timer)
+        # All quant adjustments of the batch at once
+        self.env['stock.quant']._zra_apply_deltas(stock_deltas)
+        timer.lap('stock_adjustments', single)
+        _logger.info(f'Queued {len(entries)} VSDC submissions for {len(moves)} moves')
+        if entries:
+            entries._trigger_cron()
+        timer.lap('queue_trigger', single)
+        return entries
+
+    def _zra_process_posted_move(self, stock_deltas=None, timer=None):
+        """Queue the VSDC submissions of one move.
+
+        When stock_deltas is given the quant adjustments are collected into it
+        for the caller to apply, otherwise they are applied right away.
+        """
+        self.ensure_one()
+        timer = timer or PostTimer(self.env, False)
+        entries = self.env['zra.outbox']
         if self.move_type in ['out_refund', 'in_refund']:
             # Prevent automatic reconciliation for credit notes
             self.line_ids.remove_move_reconcile()
@@ -385,31 +516,36 @@ class AccountMove(models.Model):
                 self.write({
                     'exchange_rate': round(exchange_rate, 2)
                 })
+            timer.lap('validation', self)
 
-            # Always post the sales payload, even if no stockable products
+            # Always queue the sales payload, even if no stockable products
             if self.move_type == 'out_invoice':
                 payload = self.generate_sales_payload()  # Sales payload for all products (including services)
-                self._post_to_api(config_settings.sales_endpoint, payload, "Save Sales API Response resultMsg")
+                entries |= self._enqueue_vsdc('sales', config_settings.sales_endpoint, payload,
+                                              "Save Sales API Response resultMsg")
+
+            timer.lap('sales_payload', self)
 
             # Only handle stock-related operations for stockable products
             if stockable_product_lines:
                 # Process stockable products for stock APIs
                 if self.move_type == 'out_invoice':
                     payload_stock_items = self.generate_stock_payload_items(stockable_product_lines, '11', 'Normal Sale')
-                    self._post_to_stock_api(config_settings.stock_io_endpoint, payload_stock_items,
-                                            "Save Stock Item API Response")
+                    entries |= self._enqueue_vsdc('stock_items', config_settings.stock_io_endpoint, payload_stock_items,
+                                                  "Save Stock Item API Response")
 
-                    payload_stock_master = self.generate_stock_payload_master(stockable_product_lines)
-                    self._post_to_stock_api(config_settings.stock_master_endpoint, payload_stock_master,
-                                            "Stock Master API Response")
+                    payload_stock_master = self.generate_stock_payload_master(stockable_product_lines, stock_deltas)
+                    entries |= self._enqueue_vsdc('stock_master', config_settings.stock_master_endpoint, payload_stock_master,
+                                                  "Stock Master API Response")
 
                 elif self.move_type == 'out_refund':
                     if not self._is_internet_connected():
-                        raise UserError("Cannot perform credit note offline. Please check your internet connection.")
+                        raise UserError("Cannot perform credit note offline: the ZRA VSDC is not reachable. "
+                                        "Please try again later.")
 
                     payload = self.credit_note_payload()
-                    self._post_to_api(config_settings.sales_endpoint, payload,
-                                    "Save Credit Note API Response resultMsg")
+                    entries |= self._enqueue_vsdc('sales', config_settings.sales_endpoint, payload,
+                                                  "Save Credit Note API Response resultMsg")
 
                     reversal_id = self._context.get('active_id')
                     reversal_move = self.env['account.move.reversal'].browse(reversal_id)
@@ -418,17 +554,18 @@ class AccountMove(models.Model):
 
                     # Only if there are stockable products
                     payload_stock_items = self.generate_stock_payload_items(stockable_product_lines, '03', 'Credit Note')
-                    self._post_to_stock_api(config_settings.stock_io_endpoint, payload_stock_items,
-                                            "Save Stock Item API Response")
+                    entries |= self._enqueue_vsdc('stock_items', config_settings.stock_io_endpoint, payload_stock_items,
+                                                  "Save Stock Item API Response")
 
-                    payload_stock_master = self.generate_stock_payload_master(stockable_product_lines)
-                    self._post_to_stock_api(config_settings.stock_master_endpoint, payload_stock_master,
-                                            "Stock Master API Response")
+                    payload_stock_master = self.generate_stock_payload_master(stockable_product_lines, stock_deltas)
+                    entries |= self._enqueue_vsdc('stock_master', config_settings.stock_master_endpoint, payload_stock_master,
+                                                  "Stock Master API Response")
 
                 elif self.move_type == 'in_refund':
                     original_ref = self.ref
                     payload = self.debit_note_payload(original_ref)
-                    self._post_to_api(config_settings.sales_endpoint, payload, "Save Debit Note API Response resultMsg")
+                    entries |= self._enqueue_vsdc('sales', config_settings.sales_endpoint, payload,
+                                                  "Save Debit Note API Response resultMsg")
 
                     debit_reversal_id = self._context.get('active_id')
                     debit_reversal_move = self.env['account.debit.note'].browse(debit_reversal_id)
@@ -436,120 +573,79 @@ class AccountMove(models.Model):
                     self.write({'debit_note_reason': debit_note_reason})
 
                     payload_stock_items = self.generate_stock_payload_items(stockable_product_lines, '12' , 'Debit Note')
-                    self._post_to_stock_api(config_settings.stock_io_endpoint, payload_stock_items,
-                                            "Save Stock Item API Response")
+                    entries |= self._enqueue_vsdc('stock_items', config_settings.stock_io_endpoint, payload_stock_items,
+                                                  "Save Stock Item API Response")
+
+                    payload_stock_master = self.generate_stock_payload_master(stockable_product_lines, stock_deltas)
+                    entries |= self._enqueue_vsdc('stock_master', config_settings.stock_master_endpoint, payload_stock_master,
+                                                  "Stock Master API Response")
 
-                    payload_stock_master = self.generate_stock_payload_master(stockable_product_lines)
-                    self._post_to_stock_api(config_settings.stock_master_endpoint, payload_stock_master,
-                                            "Stock Master API Response")
+            timer.lap('note_and_stock_payloads', self)
 
             # Handle stock operations for stockable products only
-            for invoice in self:
-                if stockable_product_lines:
-                    if invoice.move_type == 'out_invoice' and invoice.invoice_origin:
-                        pickings = self.env['stock.picking'].search([
-                            ('origin', '=', invoice.invoice_origin),
-                            ('state', 'in', ['confirmed', 'assigned'])
-                        ])
-                        for picking in pickings:
-                            picking.action_confirm()
-                            picking.action_assign()
-                            picking.button_validate()
-                    else:
-                        self._accounting_update_stock_quantities(invoice, stockable_product_lines)
-
-                    if invoice.move_type == 'out_refund':
-                        self._update_stock_quantities(invoice, stockable_product_lines)
-
-                    if invoice.move_type == 'in_refund':
-                        self._debit_update_stock_quantities(invoice, stockable_product_lines)
-
-            self.generate_qr_code_button()
+            if stockable_product_lines:
+                if self.move_type == 'out_invoice' and self.invoice_origin:
+                    pickings = self.env['stock.picking'].search([
+                        ('origin', '=', self.invoice_origin),
+                        ('state', 'in', ['confirmed', 'assigned'])
+                    ])
+                    for picking in pickings:
+                        picking.action_confirm()
+                        picking.action_assign()
+                        picking.button_validate()
+                if stock_deltas is None:
+                    self.env['stock.quant']._zra_apply_deltas(
+                        self._zra_collect_stock_deltas(stockable_product_lines, {}))
+                else:
+                    self._zra_collect_stock_deltas(stockable_product_lines, stock_deltas)
+            timer.lap('pickings', self)
 
-        return res
+        return entries
 
-    def _is_internet_connected(self):
-        try:
-            # Try to connect to a reliable public host
-            socket.create_connection(("8.8.8.8", 53))
-            return True
-        except OSError:
-            return False
-
-    def _accounting_update_stock_quantities(self, invoice, stockable_product_lines):
-        # Process only stockable product lines
-        for line in stockable_product_lines:
-            product = line.product_id
-            if not product:  # Skip lines without a product
-                continue
-            quantity = line.quantity
-            stock_quant = self.env['stock.quant'].search([
-                ('product_id', '=', product.id),
-                ('location_id.usage', '=', 'internal')
-            ], limit=1)
-
-            if stock_quant:
-                stock_quant.quantity -= quantity
-            else:
-                # If no stock_quant is found, create a new one
-                self.env['stock.quant'].create({
-                    'product_id': product.id,
-                    'location_id': self.env['stock.location'].search([('usage', '=', 'internal')], limit=1).id,
-                    'quantity': -quantity,  # Deduct the quantity
-                })
+    def action_zra_submit_now(self):
+        """Send the pending VSDC submissions of the selected moves right away."""
+        pending = self.mapped('zra_outbox_ids').filtered(lambda e: e.state == 'pending')
+        pending._process_batch()
+        return True
 
-    def _update_stock_quantities(self, invoice, stockable_product_lines):
-        for line in stockable_product_lines:
-            product = line.product_id
-            if not product:  # Skip lines without a product
-                continue
-            quantity = line.quantity
-            stock_quant = self.env['stock.quant'].search([
-                ('product_id', '=', product.id),
-                ('location_id.usage', '=', 'internal')
-            ], limit=1)
-
-            if stock_quant:
-                stock_quant.quantity += quantity
-            else:
-                # If no stock_quant is found, create a new one
-                self.env['stock.quant'].create({
-                    'product_id': product.id,
-                    'location_id': self.env['stock.location'].search([('usage', '=', 'internal')], limit=1).id,
-                    'quantity': quantity,
-                })
+    def _enqueue_vsdc(self, kind, url, payload, success_message_prefix):
+        """Hand a VSDC submission to the outbox instead of calling the endpoint inline."""
+        self.ensure_one()
+        return self.env['zra.outbox'].enqueue(self, kind, url, payload, success_message_prefix, trigger=False)
+
+    def _is_internet_connected(self):
+        # Cached VSDC health, no network probe
+        config_settings = self.env['res.company'].sudo().browse(self.env.company.id)
+        return self.env['zra.vsdc.client'].is_available(config_settings.sales_endpoint)
 
-    def _debit_update_stock_quantities(self, invoice, stockable_product_lines):
+    def _zra_collect_stock_deltas(self, stockable_product_lines, stock_deltas):
+        """Add the signed stock movement of the lines to stock_deltas ({product_id: qty})."""
+        self.ensure_one()
+        sign = 0
+        # Invoices of a sale order are delivered through its pickings
+        if not (self.move_type == 'out_invoice' and self.invoice_origin):
+            sign -= 1
+        if self.move_type == 'out_refund':
+            sign += 1
+        if self.move_type == 'in_refund':
+            sign -= 1
+        if not sign:
+            return stock_deltas
         for line in stockable_product_lines:
-            product = line.product_id
-            if not product:  # Skip lines without a product
+            if not line.product_id:  # Skip lines without a product
                 continue
-            quantity = line.quantity
-            stock_quant = self.env['stock.quant'].search([
-                ('product_id', '=', product.id),
-                ('location_id.usage', '=', 'internal')
-            ], limit=1)
-
-            if stock_quant:
-                stock_quant.quantity -= quantity
-            else:
-                # If no stock_quant is found, create a new one
-                self.env['stock.quant'].create({
-                    'product_id': product.id,
-                    'location_id': self.env['stock.location'].search([('usage', '=', 'internal')], limit=1).id,
-                    'quantity': -quantity,  # Deduct the quantity
-                })
-
-    def _generate_item(self, index, line):
-        tax_rate = sum(line.tax_ids.mapped('amount')) / 100
-        item_price_with_tax_incl = line.price_unit * (1 + tax_rate)
-        # item_sply_amount_incl = line.quantity * round(item_price_with_tax, 4)
-        item_sply_amount = (line.quantity) * (line.price_unit)
-        item_discount_amount = ((item_sply_amount) * (line.discount / 100))
-        item_net_sply_amount = (item_sply_amount) - (round(item_discount_amount, 2))
-        vat_taxbleAmt = item_net_sply_amount / (1 + tax_rate)
+            product_id = line.product_id.id
+            stock_deltas[product_id] = stock_deltas.get(product_id, 0.0) + sign * line.quantity
+        return stock_deltas
+
+    def _generate_item(self, index, line, amounts=None):
+        amounts = amounts or self._line_amounts(line)
+        tax_rate = amounts['tax_rate']
+        item_sply_amount = amounts['sply_amount']
+        item_discount_amount = amounts['discount_amount']
+        vat_taxbleAmt = amounts['net_sply_amount'] / (1 + tax_rate)
         vat_Amt = vat_taxbleAmt * tax_rate
-        tot_Amt = item_net_sply_amount
+        tot_Amt = amounts['net_sply_amount']
 
         return {
             "itemSeq": index + 1,
@@ -571,7 +667,7 @@ class AccountMove(models.Model):
             "isrcRt": 0.0,
             "isrcAmt": 0.0,
             "totDcAmt": round(item_discount_amount, 2),
-            "vatCatCd": self.get_tax_description(line.tax_ids),
+            "vatCatCd": amounts['tax_description'],
             "exciseTxCatCd": None,
             "vatAmt": round(vat_Amt, 4),
             "taxblAmt": round(vat_taxbleAmt, 4),
@@ -584,6 +680,42 @@ class AccountMove(models.Model):
             "totAmt": round(tot_Amt, 4), 
         }
 
+    def _generate_note_item(self, index, line, amounts=None):
+        amounts = amounts or self._line_amounts(line)
+        tax_rate = amounts['tax_rate']
+        item_sply_amount = amounts['sply_amount']
+        item_discount_amount = amounts['discount_amount']
+        vat_taxbleAmt = amounts['net_sply_amount'] / (1 + tax_rate)
+        vat_Amt = vat_taxbleAmt * tax_rate
+        tot_Amt = amounts['net_sply_amount']
+
+        return {
+            "itemSeq": index + 1,
+            "itemCd": line.product_id.product_tmpl_id.item_Cd,
+            "itemClsCd": line.product_id.product_tmpl_id.item_cls_cd,
+            "itemNm": line.product_id.name,
+            "bcd": line.product_id.barcode,
+            "pkgUnitCd": line.product_id.product_tmpl_id.packaging_unit_cd,
+            "pkg": line.quantity,
+            "qtyUnitCd": line.product_id.product_tmpl_id.quantity_unit_cd,
+            "qty": round(line.quantity, 4),
+            "prc": round(line.price_unit, 4),
+            "splyAmt": round(item_sply_amount, 4),
+            "dcRt": line.discount,
+            "dcAmt": round(item_discount_amount, 2),
+            "isrccCd": "",
+            "isrccNm": "",
+            "isrcRt": 0.0,
+            "isrcAmt": 0.0,
+            "vatCatCd": amounts['tax_description'],
+            "exciseTxCatCd": None,
+            "vatTaxblAmt": round(vat_taxbleAmt, 4),
+            "exciseTaxblAmt": 0.0,
+            "vatAmt": round(vat_Amt, 4),
+            "exciseTxAmt": 0.0,
+            "totAmt": round(tot_Amt, 4),
+        }
+
     def generate_sales_payload(self):
         current_user = self.env.user
         company = self.env.company
@@ -598,7 +730,6 @@ class AccountMove(models.Model):
             sequence_number = self.name.split('/')[-1]  # Get the last part, which is the numeric sequence
         cisInvcNo_value = f'INV/{date_prefix}/{sequence_number}'
         exchange_rate = self.get_exchange_rate(self.currency_id, self.env.company.currency_id)
-        tax_rates = [(sum(line.tax_ids.mapped('amount')) / 100) for line in self.invoice_line_ids]
         
         # Get tpin value
         customer = self.partner_id
@@ -608,10 +739,8 @@ class AccountMove(models.Model):
             "1000000000"  # Default fallback value
         )
 
-        item_list = []
-        for index, line in enumerate(self.invoice_line_ids):    
-            item = self._generate_item(index, line)
-            item_list.append(item)
+        item_list, taxable_amounts, tax_amounts = self._aggregate_invoice_lines(
+            self.invoice_line_ids, self._generate_item)
 
         # Summary amounts
         totTaxblAmt = sum(item['vatTaxblAmt'] for item in item_list)
@@ -637,22 +766,7 @@ class AccountMove(models.Model):
             "rfdDt": None,
             "rfdRsnCd": "",
             "totItemCnt": len(self.invoice_line_ids),
-            "taxblAmtA": round(self.calculate_taxable_amount(self.invoice_line_ids, 'A'), 4),
-            "taxblAmtB": round(self.calculate_taxable_amount(self.invoice_line_ids, 'B'), 4),
-            "taxblAmtC": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C'), 4),
-            "taxblAmtC1": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C1'), 4),
-            "taxblAmtC2": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C2'), 4),
-            "taxblAmtC3": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C3'), 4),
-            "taxblAmtD": round(self.calculate_taxable_amount(self.invoice_line_ids, 'D'), 4),
-            "taxblAmtRvat": round(self.calculate_taxable_amount(self.invoice_line_ids, 'RVAT'), 4),
-            "taxblAmtE": round(self.calculate_taxable_amount(self.invoice_line_ids, 'E'), 4),
-            "taxblAmtF": round(self.calculate_taxable_amount(self.invoice_line_ids, 'F'), 4),
-            "taxblAmtIpl1": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Ipl1'), 4),
-            "taxblAmtIpl2": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Ipl2'), 4),
-            "taxblAmtTl": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Tl'), 4),
-            "taxblAmtEcm": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Ecm'), 4),
-            "taxblAmtExeeg": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Exeeg'), 4),
-            "taxblAmtTot": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Tot'), 4),
+            **taxable_amounts,
             "taxRtA": 16,
             "taxRtB": 16,
             "taxRtC1": 0.0,
@@ -668,22 +782,7 @@ class AccountMove(models.Model):
             "taxRtEcm": 5,
             "taxRtExeeg": 3,
             "taxRtTot": 0.0,
-            "taxAmtA": round(self.calculate_tax_amount(self.invoice_line_ids, 'A'), 4),
-            "taxAmtB": round(self.calculate_tax_amount(self.invoice_line_ids, 'B'), 4),
-            "taxAmtC": round(self.calculate_tax_amount(self.invoice_line_ids, 'C'), 4),
-            "taxAmtC1": round(self.calculate_tax_amount(self.invoice_line_ids, 'C1'), 4),
-            "taxAmtC2": round(self.calculate_tax_amount(self.invoice_line_ids, 'C2'), 4),
-            "taxAmtC3": round(self.calculate_tax_amount(self.invoice_line_ids, 'C3'), 4),
-            "taxAmtD": round(self.calculate_tax_amount(self.invoice_line_ids, 'D'), 4),
-            "taxAmtRvat": round(self.calculate_tax_amount(self.invoice_line_ids, 'Rvat'), 4),
-            "taxAmtE": round(self.calculate_tax_amount(self.invoice_line_ids, 'E'), 4),
-            "taxAmtF": round(self.calculate_tax_amount(self.invoice_line_ids, 'F'), 4),
-            "taxAmtIpl1": round(self.calculate_tax_amount(self.invoice_line_ids, 'Ipl1'), 4),
-            "taxAmtIpl2": round(self.calculate_tax_amount(self.invoice_line_ids, 'Ipl2'), 4),
-            "taxAmtTl": round(self.calculate_tax_amount(self.invoice_line_ids, 'Tl'), 4),
-            "taxAmtEcm": round(self.calculate_tax_amount(self.invoice_line_ids, 'Ecm'), 4),
-            "taxAmtExeeg": round(self.calculate_tax_amount(self.invoice_line_ids, 'Exeeg'), 4),
-            "taxAmtTot": round(self.calculate_tax_amount(self.invoice_line_ids, 'Tot'), 4),
+            **tax_amounts,
             "totTaxblAmt": round(totTaxblAmt, 4),
             "totTaxAmt": round(totTaxAmt, 4),
             "totAmt": round(totAmt, 4),
@@ -749,9 +848,13 @@ class AccountMove(models.Model):
         }
         return payload_stock_items
 
-    def generate_stock_payload_master(self, stockable_product_lines):
+    def generate_stock_payload_master(self, stockable_product_lines, pending_deltas=None):
+        """pending_deltas: quant adjustments of earlier moves in the batch, not applied yet."""
         current_user = self.env.user
         company = self.env.company
+        on_hand = self.env['stock.quant']._zra_on_hand(stockable_product_lines.product_id)
+        for product_id, delta in (pending_deltas or {}).items():
+            on_hand[product_id] = on_hand.get(product_id, 0.0) + delta
         payload_stock_master = {
             "tpin": company.tpin,
             "bhfId": company.bhf_id,
@@ -762,11 +865,8 @@ class AccountMove(models.Model):
             "stockItemList": [
                 {
                     "itemCd": line.product_id.product_tmpl_id.item_Cd,
-                    # Calculate available_qty and remaining_qty for each item
-                    "rsdQty": sum(quant.quantity for quant in self.env['stock.quant'].search([
-                        ('product_id', '=', line.product_id.id),
-                        ('location_id.usage', '=', 'internal')
-                    ])) - line.quantity
+                    # Remaining quantity once this line is delivered
+                    "rsdQty": on_hand.get(line.product_id.id, 0.0) - line.quantity
                 } for index, line in enumerate(stockable_product_lines)
             ]
         }
@@ -802,7 +902,7 @@ class AccountMove(models.Model):
         reversal_move = self.env['account.move.reversal'].browse(reversal_id)
         reversal_reason = reversal_move.reason if reversal_move else "01"
         print(f'Fetched Reversal Reason: {reversal_reason}')
-        sale_order = self.env['sale.order'].search([('name', '=', self.invoice_origin)], limit=1)
+        sale_order = self.zra_sale_order_id
         lpo = sale_order.lpo if sale_order else None
         export_country_code = sale_order.export_country_id.code if sale_order and sale_order.export_country_id else None
         exchange_rate = self.get_exchange_rate(self.currency_id, self.env.company.currency_id)
@@ -813,44 +913,8 @@ class AccountMove(models.Model):
                 "1000000000"  # Default fallback value
         )
 
-        item_list = []
-        for index, line in enumerate(self.invoice_line_ids):
-            tax_rate = sum(line.tax_ids.mapped('amount')) / 100
-            item_price_with_tax_incl = line.price_unit * (1 + tax_rate)
-            # item_sply_amount_incl = line.quantity * round(item_price_with_tax, 4)
-            item_sply_amount = (line.quantity) * (line.price_unit)
-            item_discount_amount = ((item_sply_amount) * (line.discount / 100))
-            item_net_sply_amount = (item_sply_amount) - (round(item_discount_amount, 2))
-            vat_taxbleAmt = item_net_sply_amount / (1 + tax_rate)
-            vat_Amt = vat_taxbleAmt * tax_rate
-            tot_Amt = item_net_sply_amount
-
-            item_list.append({
-                "itemSeq": index + 1,
-                "itemCd": line.product_id.product_tmpl_id.item_Cd,
-                "itemClsCd": line.product_id.product_tmpl_id.item_cls_cd,
-                "itemNm": line.product_id.name,
-                "bcd": line.product_id.barcode,
-                "pkgUnitCd": line.product_id.product_tmpl_id.packaging_unit_cd,
-                "pkg": line.quantity,
-                "qtyUnitCd": line.product_id.product_tmpl_id.quantity_unit_cd,
-                "qty": round(line.quantity, 4),
-                "prc": round(line.price_unit, 4),
-                "splyAmt": round(item_sply_amount, 4),
-                "dcRt": line.discount,
-                "dcAmt": round(item_discount_amount, 2),
-                "isrccCd": "",
-                "isrccNm": "",
-                "isrcRt": 0.0,
-                "isrcAmt": 0.0,
-                "vatCatCd": self.get_tax_description(line.tax_ids),
-                "exciseTxCatCd": None,
-                "vatTaxblAmt": round(vat_taxbleAmt, 4),
-                "exciseTaxblAmt": 0.0,
-                "vatAmt": round(vat_Amt, 4),
-                "exciseTxAmt": 0.0,
-                "totAmt": round(tot_Amt, 4),
-            })
+        item_list, taxable_amounts, tax_amounts = self._aggregate_invoice_lines(
+            self.invoice_line_ids, self._generate_note_item)
 
         # Summary amounts
         totTaxblAmt = sum(item['vatTaxblAmt'] for item in item_list)
@@ -877,22 +941,7 @@ class AccountMove(models.Model):
             "rfdDt": None,
             "rfdRsnCd": reversal_reason or '01',
             "totItemCnt": len(self.invoice_line_ids),
-            "taxblAmtA": round(self.calculate_taxable_amount(self.invoice_line_ids, 'A'), 4),
-            "taxblAmtB": round(self.calculate_taxable_amount(self.invoice_line_ids, 'B'), 4),
-            "taxblAmtC": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C'), 4),
-            "taxblAmtC1": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C1'), 4),
-            "taxblAmtC2": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C2'), 4),
-            "taxblAmtC3": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C3'), 4),
-            "taxblAmtD": round(self.calculate_taxable_amount(self.invoice_line_ids, 'D'), 4),
-            "taxblAmtRvat": round(self.calculate_taxable_amount(self.invoice_line_ids, 'RVAT'), 4),
-            "taxblAmtE": round(self.calculate_taxable_amount(self.invoice_line_ids, 'E'), 4),
-            "taxblAmtF": round(self.calculate_taxable_amount(self.invoice_line_ids, 'F'), 4),
-            "taxblAmtIpl1": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Ipl1'), 4),
-            "taxblAmtIpl2": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Ipl2'), 4),
-            "taxblAmtTl": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Tl'), 4),
-            "taxblAmtEcm": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Ecm'), 4),
-            "taxblAmtExeeg": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Exeeg'), 4),
-            "taxblAmtTot": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Tot'), 4),
+            **taxable_amounts,
             "taxRtA": 16,
             "taxRtB": 16,
             "taxRtC1": 0.0,
@@ -908,22 +957,7 @@ class AccountMove(models.Model):
             "taxRtEcm": 5,
             "taxRtExeeg": 3,
             "taxRtTot": 0.0,
-            "taxAmtA": round(self.calculate_tax_amount(self.invoice_line_ids, 'A'), 4),
-            "taxAmtB": round(self.calculate_tax_amount(self.invoice_line_ids, 'B'), 4),
-            "taxAmtC": round(self.calculate_tax_amount(self.invoice_line_ids, 'C'), 4),
-            "taxAmtC1": round(self.calculate_tax_amount(self.invoice_line_ids, 'C1'), 4),
-            "taxAmtC2": round(self.calculate_tax_amount(self.invoice_line_ids, 'C2'), 4),
-            "taxAmtC3": round(self.calculate_tax_amount(self.invoice_line_ids, 'C3'), 4),
-            "taxAmtD": round(self.calculate_tax_amount(self.invoice_line_ids, 'D'), 4),
-            "taxAmtRvat": round(self.calculate_tax_amount(self.invoice_line_ids, 'Rvat'), 4),
-            "taxAmtE": round(self.calculate_tax_amount(self.invoice_line_ids, 'E'), 4),
-            "taxAmtF": round(self.calculate_tax_amount(self.invoice_line_ids, 'F'), 4),
-            "taxAmtIpl1": round(self.calculate_tax_amount(self.invoice_line_ids, 'Ipl1'), 4),
-            "taxAmtIpl2": round(self.calculate_tax_amount(self.invoice_line_ids, 'Ipl2'), 4),
-            "taxAmtTl": round(self.calculate_tax_amount(self.invoice_line_ids, 'Tl'), 4),
-            "taxAmtEcm": round(self.calculate_tax_amount(self.invoice_line_ids, 'Ecm'), 4),
-            "taxAmtExeeg": round(self.calculate_tax_amount(self.invoice_line_ids, 'Exeeg'), 4),
-            "taxAmtTot": round(self.calculate_tax_amount(self.invoice_line_ids, 'Tot'), 4),
+            **tax_amounts,
             "totTaxblAmt": round(totTaxblAmt, 4),
             "totTaxAmt": round(totTaxAmt, 4),
             "totAmt": round(totAmt, 4),
@@ -950,7 +984,7 @@ class AccountMove(models.Model):
             payload_json = json.dumps(payload, indent=4)
             _logger.info(payload_json)
             # Send the POST request
-            response = requests.post(url, json=payload)
+            response = self.env['zra.vsdc.client'].post(url, json=payload)
 
             # Print and log the response status code
             print(f'API responded with status code: {response.status_code}')
@@ -963,53 +997,7 @@ class AccountMove(models.Model):
             response_data = response.json()
             print(f'API Response: {response_data}')  # Print the entire response for debugging
 
-            result_cd = response_data.get('resultCd', 'No result code returned')
-            result_msg = response_data.get('resultMsg', 'No result message returned')
-            data = response_data.get('data')
-
-            # Raise an error if the result code is not '000'
-            if result_cd != '000':
-                raise UserError(f"API Error - {result_msg} (Result Code: {result_cd})")
-
-            # If result code is '000', process the data as before
-            if data:
-                rcpt_no = data.get('rcptNo')
-                intrl_data = data.get('intrlData')
-                rcpt_sign = data.get('rcptSign')
-                vsdc_rcpt_pbct_date = data.get('vsdcRcptPbctDate')
-                sdc_id = data.get('sdcId')
-                mrc_no = data.get('mrcNo')
-                qr_code_url = data.get('qrCodeUrl')
-
-                # Log the extracted response data
-                print(f'Response Data - rcpt_no: {rcpt_no}, intrl_data: {intrl_data}, rcpt_sign: {rcpt_sign}, '
-                      f'vsdc_rcpt_pbct_date: {vsdc_rcpt_pbct_date}, sdc_id: {sdc_id}, mrc_no: {mrc_no}, '
-                      f'qr_code_url: {qr_code_url}')
-
-                # Update the record with response data
-                if self:
-                    record = self[0]
-                    record.message_post(body=f"{success_message_prefix}: {result_msg}")
-                    _logger.info(f'{success_message_prefix}: {result_msg}')
-                    print(f'{success_message_prefix}: {result_msg}')
-
-                    # Update the record with response data
-                    record.write({
-                        'rcpt_no': rcpt_no,
-                        'intrl_data': intrl_data,
-                        'rcpt_sign': rcpt_sign,
-                        'vsdc_rcpt_pbct_date': vsdc_rcpt_pbct_date,
-                        'sdc_id': sdc_id,
-                        'mrc_no': mrc_no,
-                        'qr_code_url': qr_code_url
-                    })
-                else:
-                    _logger.warning('No records to post messages to')
-                    print('No records to post messages to')
-
-            else:
-                _logger.error('No data returned in the response')
-                print('No data returned in the response')
+            self._apply_sales_response(response_data, success_message_prefix)
 
         except requests.exceptions.HTTPError as http_err:
             _logger.error(f'HTTP error occurred: {str(http_err)}')
@@ -1028,21 +1016,75 @@ class AccountMove(models.Model):
             print(f'API request failed: {str(req_err)}')
             raise UserError(f"API request failed: {str(req_err)}")
 
+    def _apply_sales_response(self, response_data, success_message_prefix):
+        result_cd = response_data.get('resultCd', 'No result code returned')
+        result_msg = response_data.get('resultMsg', 'No result message returned')
+        data = response_data.get('data')
+
+        # Raise an error if the result code is not '000'
+        if result_cd != '000':
+            raise UserError(f"API Error - {result_msg} (Result Code: {result_cd})")
+
+        # If result code is '000', process the data as before
+        if data:
+            rcpt_no = data.get('rcptNo')
+            intrl_data = data.get('intrlData')
+            rcpt_sign = data.get('rcptSign')
+            vsdc_rcpt_pbct_date = data.get('vsdcRcptPbctDate')
+            sdc_id = data.get('sdcId')
+            mrc_no = data.get('mrcNo')
+            qr_code_url = data.get('qrCodeUrl')
+
+            # Log the extracted response data
+            print(f'Response Data - rcpt_no: {rcpt_no}, intrl_data: {intrl_data}, rcpt_sign: {rcpt_sign}, '
+                  f'vsdc_rcpt_pbct_date: {vsdc_rcpt_pbct_date}, sdc_id: {sdc_id}, mrc_no: {mrc_no}, '
+                  f'qr_code_url: {qr_code_url}')
+
+            # Update the record with response data
+            if self:
+                record = self[0]
+                record.message_post(body=f"{success_message_prefix}: {result_msg}")
+                _logger.info(f'{success_message_prefix}: {result_msg}')
+                print(f'{success_message_prefix}: {result_msg}')
+
+                # Update the record with response data
+                record.write({
+                    'rcpt_no': rcpt_no,
+                    'intrl_data': intrl_data,
+                    'rcpt_sign': rcpt_sign,
+                    'vsdc_rcpt_pbct_date': vsdc_rcpt_pbct_date,
+                    'sdc_id': sdc_id,
+                    'mrc_no': mrc_no,
+                    'qr_code_url': qr_code_url
+                })
+                # The image is rendered in the background, or on first print
+                record._trigger_qr_cron()
+            else:
+                _logger.warning('No records to post messages to')
+                print('No records to post messages to')
+
+        else:
+            _logger.error('No data returned in the response')
+            print('No data returned in the response')
+
+    def _apply_stock_response(self, response_data, success_message_prefix):
+        result_msg = response_data.get('resultMsg', 'No result message returned')
+        if not self:
+            _logger.warning('No records to post messages to')
+            return
+        for record in self:
+            record.message_post(body=f"{success_message_prefix}: {result_msg}")
+            _logger.info(f'{success_message_prefix}: {result_msg}')
+            print(f'{success_message_prefix}: {result_msg}')
+
     def _post_to_stock_api(self, url, payload, success_message_prefix):
         _logger.info(payload)
 
         print('Stock Payload being sent:', json.dumps(payload, indent=4))
         try:
-            response = requests.post(url, json=payload)
+            response = self.env['zra.vsdc.client'].post(url, json=payload)
             response.raise_for_status()
-            result_msg = response.json().get('resultMsg', 'No result message returned')
-            if not self:
-                _logger.warning('No records to post messages to')
-                return
-            for record in self:
-                record.message_post(body=f"{success_message_prefix}: {result_msg}")
-                _logger.info(f'{success_message_prefix}: {result_msg}')
-                print(f'{success_message_prefix}: {result_msg}')
+            self._apply_stock_response(response.json(), success_message_prefix)
         except requests.exceptions.RequestException as e:
             error_msg = str(e)
             if not self:
@@ -1143,48 +1185,12 @@ class AccountMove(models.Model):
                 "1000000000"  # Default fallback value
         )
 
-        sale_order = self.env['sale.order'].search([('name', '=', self.invoice_origin)], limit=1)
+        sale_order = self.zra_sale_order_id
         lpo = sale_order.lpo if sale_order else None
         export_country_code = sale_order.export_country_id.code if sale_order and sale_order.export_country_id else None
         exchange_rate = self.get_exchange_rate(self.currency_id, self.env.company.currency_id)
-        item_list = []
-        for index, line in enumerate(self.invoice_line_ids):
-            tax_rate = sum(line.tax_ids.mapped('amount')) / 100
-            item_price_with_tax_incl = line.price_unit * (1 + tax_rate)
-            # item_sply_amount_incl = line.quantity * round(item_price_with_tax, 4)
-            item_sply_amount = (line.quantity) * (line.price_unit)
-            item_discount_amount = ((item_sply_amount) * (line.discount / 100))
-            item_net_sply_amount = (item_sply_amount) - (round(item_discount_amount, 2))
-            vat_taxbleAmt = item_net_sply_amount / (1 + tax_rate)
-            vat_Amt = vat_taxbleAmt * tax_rate
-            tot_Amt = item_net_sply_amount
-
-            item_list.append({
-                "itemSeq": index + 1,
-                "itemCd": line.product_id.product_tmpl_id.item_Cd,
-                "itemClsCd": line.product_id.product_tmpl_id.item_cls_cd,
-                "itemNm": line.product_id.name,
-                "bcd": line.product_id.barcode,
-                "pkgUnitCd": line.product_id.product_tmpl_id.packaging_unit_cd,
-                "pkg": line.quantity,
-                "qtyUnitCd": line.product_id.product_tmpl_id.quantity_unit_cd,
-                "qty": round(line.quantity, 4),
-                "prc": round(line.price_unit, 4),
-                "splyAmt": round(item_sply_amount, 4),
-                "dcRt": line.discount,
-                "dcAmt": round(item_discount_amount, 2),
-                "isrccCd": "",
-                "isrccNm": "",
-                "isrcRt": 0.0,
-                "isrcAmt": 0.0,
-                "vatCatCd": self.get_tax_description(line.tax_ids),
-                "exciseTxCatCd": None,
-                "vatTaxblAmt": round(vat_taxbleAmt, 4),
-                "exciseTaxblAmt": 0.0,
-                "vatAmt": round(vat_Amt, 4),
-                "exciseTxAmt": 0.0,
-                "totAmt": round(tot_Amt, 4),
-            })
+        item_list, taxable_amounts, tax_amounts = self._aggregate_invoice_lines(
+            self.invoice_line_ids, self._generate_note_item)
 
         # Summary amounts
         totTaxblAmt = sum(item['vatTaxblAmt'] for item in item_list)
@@ -1210,22 +1216,7 @@ class AccountMove(models.Model):
             "rfdDt": None,
             "rfdRsnCd": None,
             "totItemCnt": len(self.invoice_line_ids),
-            "taxblAmtA": round(self.calculate_taxable_amount(self.invoice_line_ids, 'A'), 4),
-            "taxblAmtB": round(self.calculate_taxable_amount(self.invoice_line_ids, 'B'), 4),
-            "taxblAmtC": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C'), 4),
-            "taxblAmtC1": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C1'), 4),
-            "taxblAmtC2": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C2'), 4),
-            "taxblAmtC3": round(self.calculate_taxable_amount(self.invoice_line_ids, 'C3'), 4),
-            "taxblAmtD": round(self.calculate_taxable_amount(self.invoice_line_ids, 'D'), 4),
-            "taxblAmtRvat": round(self.calculate_taxable_amount(self.invoice_line_ids, 'RVAT'), 4),
-            "taxblAmtE": round(self.calculate_taxable_amount(self.invoice_line_ids, 'E'), 4),
-            "taxblAmtF": round(self.calculate_taxable_amount(self.invoice_line_ids, 'F'), 4),
-            "taxblAmtIpl1": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Ipl1'), 4),
-            "taxblAmtIpl2": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Ipl2'), 4),
-            "taxblAmtTl": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Tl'), 4),
-            "taxblAmtEcm": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Ecm'), 4),
-            "taxblAmtExeeg": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Exeeg'), 4),
-            "taxblAmtTot": round(self.calculate_taxable_amount(self.invoice_line_ids, 'Tot'), 4),
+            **taxable_amounts,
             "taxRtA": 16,
             "taxRtB": 16,
             "taxRtC1": 0.0,
@@ -1241,22 +1232,7 @@ class AccountMove(models.Model):
             "taxRtEcm": 5,
             "taxRtExeeg": 3,
             "taxRtTot": 0.0,
-            "taxAmtA": round(self.calculate_tax_amount(self.invoice_line_ids, 'A'), 4),
-            "taxAmtB": round(self.calculate_tax_amount(self.invoice_line_ids, 'B'), 4),
-            "taxAmtC": round(self.calculate_tax_amount(self.invoice_line_ids, 'C'), 4),
-            "taxAmtC1": round(self.calculate_tax_amount(self.invoice_line_ids, 'C1'), 4),
-            "taxAmtC2": round(self.calculate_tax_amount(self.invoice_line_ids, 'C2'), 4),
-            "taxAmtC3": round(self.calculate_tax_amount(self.invoice_line_ids, 'C3'), 4),
-            "taxAmtD": round(self.calculate_tax_amount(self.invoice_line_ids, 'D'), 4),
-            "taxAmtRvat": round(self.calculate_tax_amount(self.invoice_line_ids, 'Rvat'), 4),
-            "taxAmtE": round(self.calculate_tax_amount(self.invoice_line_ids, 'E'), 4),
-            "taxAmtF": round(self.calculate_tax_amount(self.invoice_line_ids, 'F'), 4),
-            "taxAmtIpl1": round(self.calculate_tax_amount(self.invoice_line_ids, 'Ipl1'), 4),
-            "taxAmtIpl2": round(self.calculate_tax_amount(self.invoice_line_ids, 'Ipl2'), 4),
-            "taxAmtTl": round(self.calculate_tax_amount(self.invoice_line_ids, 'Tl'), 4),
-            "taxAmtEcm": round(self.calculate_tax_amount(self.invoice_line_ids, 'Ecm'), 4),
-            "taxAmtExeeg": round(self.calculate_tax_amount(self.invoice_line_ids, 'Exeeg'), 4),
-            "taxAmtTot": round(self.calculate_tax_amount(self.invoice_line_ids, 'Tot'), 4),
+            **tax_amounts,
             "totTaxblAmt": round(totTaxblAmt, 4),
             "totTaxAmt": round(totTaxAmt, 4),
             "totAmt": round(totAmt, 4),
@@ -1375,6 +1351,17 @@ class AccountDebitNoteWizard(models.TransientModel):
         debit_note.write({'state': 'draft'})
 
 
+class ValidateAccountMove(models.TransientModel):
+    _inherit = 'validate.account.move'
+
+    def validate_move(self):
+        # Mass confirmation posts through _post(), so queue the VSDC submissions here
+        draft_moves = self.move_ids.filtered(lambda m: m.state == 'draft')
+        res = super(ValidateAccountMove, self).validate_move()
+        draft_moves.filtered(lambda m: m.state == 'posted')._zra_process_posted_moves()
+        return res
+
+
 class AccountMoveSend(models.TransientModel):
     _inherit = 'account.move.send'
 
@@ -42,12 +42,20 @@ class StockChangeProductQty(models.TransientModel):
                 ]
             }
 
+            fingerprints = self.env['zra.vsdc.fingerprint']
+            if not fingerprints.filter_stock_master(config_settings.stock_master_endpoint, payload):
+                _logger.info(f'Quantity of {product.display_name} already reported to ZRA, not sent again')
+                continue
+
             try:
                 print('Payload being sent:', json.dumps(payload, indent=4))
                 # Make the POST request to the given endpoint
-                response = requests.post(config_settings.stock_master_endpoint, json=payload)
+                response = self.env['zra.vsdc.client'].post(config_settings.stock_master_endpoint, json=payload)
                 response.raise_for_status()
-                result_msg = response.json().get('resultMsg', 'No result message received')
+                result_data = response.json()
+                result_msg = result_data.get('resultMsg', 'No result message received')
+                if result_data.get('resultCd') == '000':
+                    fingerprints.remember_stock_master(config_settings.stock_master_endpoint, payload)
                 _logger.info(f'Endpoint response: {result_msg}')
                 print(f'Endpoint response: {result_msg}')
             except requests.exceptions.RequestException as e:
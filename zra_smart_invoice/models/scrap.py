@@ -92,7 +92,7 @@ class StockScrap(models.Model):
             print("Payload for saveStockMaster:", json.dumps(save_stock_items_payload, indent=4))
             # Send the request to the first endpoint
             headers = {'Content-Type': 'application/json'}
-            response = requests.post(config_settings.stock_io_endpoint,
+            response = self.env['zra.vsdc.client'].post(config_settings.stock_io_endpoint,
                                      data=json.dumps(save_stock_items_payload),
                                      headers=headers)
             print(f"First endpoint response status: {response.status_code}")
@@ -117,9 +117,13 @@ class StockScrap(models.Model):
                 "rsdQty": new_qty + record.scrap_qty
             }
             save_stock_master_payload['stockItemList'].append(item)
+            fingerprints = self.env['zra.vsdc.fingerprint']
+            if not fingerprints.filter_stock_master(config_settings.stock_master_endpoint, save_stock_master_payload):
+                # The VSDC already has this residual quantity
+                continue
             print("Payload for saveStockMaster:", json.dumps(save_stock_master_payload, indent=4))
             # Send the request to the second endpoint
-            response = requests.post(config_settings.stock_master_endpoint,
+            response = self.env['zra.vsdc.client'].post(config_settings.stock_master_endpoint,
                                      data=json.dumps(save_stock_master_payload),
                                      headers=headers)
             print(f"Second endpoint response status: {response.status_code}")
@@ -127,5 +131,7 @@ class StockScrap(models.Model):
 
             if response.status_code != 200:
                 raise UserError('Failed to send data to the second endpoint.')
+            if response.json().get('resultCd') == '000':
+                fingerprints.remember_stock_master(config_settings.stock_master_endpoint, save_stock_master_payload)
 
         return res
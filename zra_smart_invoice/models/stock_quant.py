@@ -0,0 +1,78 @@
+from odoo import models, api
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class StockQuant(models.Model):
+    _inherit = 'stock.quant'
+
+    @api.model
+    def _zra_on_hand_by_location(self, products, location=None):
+        """On-hand quantities as {(product_id, location_id): qty}, in a single grouped query.
+
+        Without ``location`` every internal location is included, otherwise
+        only ``location`` itself (an empty recordset matches nothing).
+        """
+        product_ids = list(set(products.ids))
+        if not product_ids:
+            return {}
+        domain = [('product_id', 'in', product_ids)]
+        if location is None:
+            domain.append(('location_id.usage', '=', 'internal'))
+        else:
+            domain.append(('location_id', '=', location.id))
+        groups = self.read_group(domain, ['quantity:sum'], ['product_id', 'location_id'], lazy=False)
+        return {(group['product_id'][0], group['location_id'][0]): group['quantity'] for group in groups}
+
+    @api.model
+    def _zra_on_hand(self, products, location=None):
+        """On-hand quantities as {product_id: qty}, summed over the locations above.
+
+        Products without stock are missing from the result.
+        """
+        quantities = {}
+        for (product_id, location_id), quantity in self._zra_on_hand_by_location(products, location).items():
+            quantities[product_id] = quantities.get(product_id, 0.0) + quantity
+        return quantities
+
+    @api.model
+    def _zra_apply_deltas(self, deltas):
+        """Add signed quantities to the internal stock, given as {product_id: delta}.
+
+        Each product is adjusted on its first internal quant, or on a new quant
+        in the first internal location. Existing quants are updated with one
+        UPDATE statement and the missing ones created in a single batch.
+        """
+        deltas = {product_id: delta for product_id, delta in deltas.items() if product_id and delta}
+        if not deltas:
+            return
+        quants = {}
+        for quant in self.search([('product_id', 'in', list(deltas)), ('location_id.usage', '=', 'internal')],
+                                 order='id'):
+            quants.setdefault(quant.product_id.id, quant)
+
+        if quants:
+            self.flush_model(['quantity'])
+            values = ', '.join(['(%s, %s)'] * len(quants))
+            params = []
+            for product_id, quant in quants.items():
+                params += [quant.id, deltas[product_id]]
+            self.env.cr.execute(f"""
+                UPDATE stock_quant
+                SET quantity = stock_quant.quantity + delta.qty, write_date = NOW() AT TIME ZONE 'UTC',
+                    write_uid = %s
+                FROM (VALUES {values}) AS delta(id, qty)
+                WHERE stock_quant.id = delta.id
+            """, [self.env.uid] + params)
+            self.invalidate_model(['quantity', 'write_date', 'write_uid'])
+
+        missing = [product_id for product_id in deltas if product_id not in quants]
+        if missing:
+            location = self.env['stock.location'].search([('usage', '=', 'internal')], limit=1)
+            self.create([{
+                'product_id': product_id,
+                'location_id': location.id,
+                'quantity': deltas[product_id],
+            } for product_id in missing])
+        _logger.info(f'Applied stock deltas: {len(quants)} quants updated, {len(missing)} created')
@@ -0,0 +1,45 @@
+from collections import OrderedDict
+import threading
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 128
+
+
+class VsdcCache(object):
+    """Size-bounded LRU cache whose entries expire after a TTL. Thread-safe."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+                return
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
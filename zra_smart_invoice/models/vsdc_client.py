@@ -0,0 +1,400 @@
+from odoo import models, api
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from contextlib import contextmanager, ExitStack
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from . import vsdc_metrics
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 60.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 60.0
+DEFAULT_RATE_LIMIT = 10.0
+DEFAULT_RATE_BURST = 20
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_THROTTLE_MAX_WAIT = 30.0
+
+# Per worker thread: one session for writes and one for select* lookups, keyed by their retry settings
+_local = threading.local()
+# Shared dispatch pool, kept alive so its threads reuse their sessions between batches
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+class VsdcUnavailable(requests.exceptions.ConnectionError):
+    """Raised without a network call while the breaker of an endpoint is open."""
+
+
+class VsdcBusy(VsdcUnavailable):
+    """Raised without a network call when no rate or in-flight slot freed up in time."""
+
+
+def _endpoint_key(url):
+    return (url or '').split('?')[0]
+
+
+class CircuitBreaker(object):
+    """Health of one VSDC endpoint, fed by the outcome of real calls. Thread-safe.
+
+    closed: calls go through. After ``threshold`` consecutive failures the
+    breaker opens and calls fail fast. Once ``reset_timeout`` has elapsed it
+    is half-open: a single probe call is let through, its outcome closes or
+    re-opens the breaker.
+    """
+
+    def __init__(self):
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def available(self, reset_timeout):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= reset_timeout:
+                self.state = 'half_open'
+            return self.state != 'open'
+
+    def allow(self, reset_timeout):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record(self, success, threshold):
+        with self._lock:
+            self.probing = False
+            if success:
+                self.state = 'closed'
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= threshold:
+                if self.state != 'open':
+                    _logger.warning(f'VSDC circuit breaker opened after {self.failures} failures')
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+# Breakers are per worker process, keyed by endpoint URL
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    key = _endpoint_key(url)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker()
+        return breaker
+
+
+def _is_failure(response, error):
+    # Client errors mean the VSDC answered, only transport errors and 5xx count against it
+    return error is not None or response.status_code >= 500
+
+
+def _is_read_endpoint(url):
+    # selectItems, selectImportItems, ...: lookups the VSDC can safely answer twice
+    return url.rstrip('/').rsplit('/', 1)[-1].startswith('select')
+
+
+def _build_session(max_retries, backoff, read_only=False):
+    # A request that reached the VSDC may have been processed even if the gateway answered
+    # 502/504: writes (saveSales, saveStockMaster, ...) are only retried when the connection
+    # could not be made, further retries are left to the outbox.
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        other=0,
+        status=max_retries if read_only else 0,
+        backoff_factor=backoff,
+        status_forcelist=(502, 503, 504) if read_only else (),
+        allowed_methods=frozenset(['GET', 'POST']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=DEFAULT_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Content-Type': 'application/json'})
+    return session
+
+
+def get_session(max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF, read_only=False):
+    sessions = getattr(_local, 'sessions', None)
+    if sessions is None:
+        sessions = _local.sessions = {}
+    key = (max_retries, backoff)
+    session_key, session = sessions.get(read_only, (None, None))
+    if session_key != key:
+        if session is not None:
+            session.close()
+        session = _build_session(max_retries, backoff, read_only)
+        sessions[read_only] = (key, session)
+        _logger.info(f'Opened VSDC HTTP session (retries={max_retries}, backoff={backoff}, read_only={read_only})')
+    return session
+
+
+def get_executor(max_workers):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            # The previous pool is not shut down: callers that fetched it may still be
+            # submitting. Its threads exit once those callers drop it.
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='zra_vsdc')
+            _executor_workers = max_workers
+        return _executor
+
+
+def _send(url, kwargs, max_retries, backoff):
+    # Runs in a worker thread: plain HTTP only, no access to the Odoo environment
+    started = time.monotonic()
+    try:
+        session = get_session(max_retries, backoff, _is_read_endpoint(url))
+        return session.post(url, **kwargs), None, time.monotonic() - started
+    except requests.exceptions.RequestException as e:
+        return None, e, time.monotonic() - started
+
+
+def _release_on_close(response, stack):
+    """Close ``stack`` (the in-flight slot of a streamed call) along with ``response``."""
+    close = response.close
+
+    def _close():
+        try:
+            close()
+        finally:
+            stack.close()
+
+    response.close = _close
+
+
+class ZraVsdcClient(models.AbstractModel):
+    _name = 'zra.vsdc.client'
+    _description = 'ZRA VSDC HTTP Client'
+
+    def init(self):
+        # Token buckets shared by every worker, one row per (company, endpoint)
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS zra_vsdc_throttle (
+                company_id integer NOT NULL,
+                endpoint varchar NOT NULL,
+                tokens double precision NOT NULL,
+                refreshed_at double precision NOT NULL,
+                PRIMARY KEY (company_id, endpoint)
+            )
+        """)
+
+    @api.model
+    def _get_settings(self):
+        params = self.env['ir.config_parameter'].sudo()
+
+        def _float(key, default):
+            try:
+                return float(params.get_param(f'zra_smart_invoice.{key}', default))
+            except (TypeError, ValueError):
+                return default
+
+        return {
+            'connect_timeout': _float('vsdc_connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+            'read_timeout': _float('vsdc_read_timeout', DEFAULT_READ_TIMEOUT),
+            'max_retries': int(_float('vsdc_max_retries', DEFAULT_MAX_RETRIES)),
+            'backoff': _float('vsdc_backoff', DEFAULT_BACKOFF),
+            'max_workers': max(1, int(_float('vsdc_max_workers', DEFAULT_MAX_WORKERS))),
+            'breaker_threshold': max(1, int(_float('vsdc_breaker_threshold', DEFAULT_BREAKER_THRESHOLD))),
+            'breaker_reset': _float('vsdc_breaker_reset', DEFAULT_BREAKER_RESET),
+            'rate_limit': _float('vsdc_rate_limit', DEFAULT_RATE_LIMIT),
+            'rate_burst': max(1, int(_float('vsdc_rate_burst', DEFAULT_RATE_BURST))),
+            'max_in_flight': int(_float('vsdc_max_in_flight', DEFAULT_MAX_IN_FLIGHT)),
+            'throttle_max_wait': _float('vsdc_throttle_max_wait', DEFAULT_THROTTLE_MAX_WAIT),
+        }
+
+    @api.model
+    def is_available(self, url):
+        """Cached health of an endpoint; False only while its circuit breaker is open."""
+        return get_breaker(url).available(self._get_settings()['breaker_reset'])
+
+    @api.model
+    def _take_tokens(self, url, count, settings):
+        """Block until ``count`` requests may be sent to ``url`` for the current company.
+
+        Token bucket refilled at ``vsdc_rate_limit`` requests per second, up to
+        ``vsdc_rate_burst``. The bucket lives in the database and is updated in
+        short transactions of its own, so all workers share it.
+        """
+        rate = settings['rate_limit']
+        if rate <= 0:
+            return
+        burst = settings['rate_burst']
+        key = (self.env.company.id, _endpoint_key(url))
+        deadline = time.monotonic() + settings['throttle_max_wait']
+        while count > 0:
+            with self.env.registry.cursor() as cr:
+                now = time.time()
+                cr.execute("""
+                    INSERT INTO zra_vsdc_throttle (company_id, endpoint, tokens, refreshed_at)
+                    VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING
+                """, key + (burst, now))
+                cr.execute("""
+                    SELECT tokens, refreshed_at FROM zra_vsdc_throttle
+                    WHERE company_id = %s AND endpoint = %s FOR UPDATE
+                """, key)
+                tokens, refreshed_at = cr.fetchone()
+                tokens = min(burst, tokens + max(0.0, now - refreshed_at) * rate)
+                granted = min(count, int(tokens))
+                tokens -= granted
+                cr.execute("""
+                    UPDATE zra_vsdc_throttle SET tokens = %s, refreshed_at = %s
+                    WHERE company_id = %s AND endpoint = %s
+                """, (tokens, now) + key)
+            count -= granted
+            if count:
+                wait = (min(count, burst) - tokens) / rate
+                if time.monotonic() + wait > deadline:
+                    raise VsdcBusy(f'VSDC endpoint {url} is rate limited, retry later.')
+                time.sleep(wait)
+
+    @contextmanager
+    def _in_flight_slots(self, url, wanted, settings):
+        """Hold up to ``wanted`` of the ``vsdc_max_in_flight`` slots of ``url`` for the current company.
+
+        Slots are transaction-level advisory locks taken on a cursor of their
+        own, so they are shared by all workers and released even if the
+        worker dies. Yields the number of slots held, at least one.
+        """
+        cap = settings['max_in_flight']
+        if cap <= 0:
+            yield wanted
+            return
+        lock_key = zlib.crc32(f'{self.env.company.id}:{_endpoint_key(url)}'.encode()) & 0x7fffffff
+        deadline = time.monotonic() + settings['throttle_max_wait']
+        cr = self.env.registry.cursor()
+        try:
+            held = 0
+            while not held:
+                for slot in range(cap):
+                    if held >= wanted:
+                        break
+                    cr.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", (lock_key, slot))
+                    if cr.fetchone()[0]:
+                        held += 1
+                if not held:
+                    if time.monotonic() >= deadline:
+                        raise VsdcBusy(f'Too many VSDC requests in flight to {url}, retry later.')
+                    time.sleep(0.2)
+            yield held
+        finally:
+            cr.rollback()
+            cr.close()
+
+    @api.model
+    def post(self, url, **kwargs):
+        """POST to the VSDC over the pooled session.
+
+        Accepts the same keyword arguments as ``requests.post`` and raises the
+        same ``requests`` exceptions, so existing error handling keeps working.
+        """
+        settings = self._get_settings()
+        breaker = get_breaker(url)
+        if not breaker.available(settings['breaker_reset']):
+            raise VsdcUnavailable(f'VSDC endpoint {url} is unavailable, retry later.')
+        kwargs.setdefault('timeout', (settings['connect_timeout'], settings['read_timeout']))
+        with ExitStack() as slot:
+            slot.enter_context(self._in_flight_slots(url, 1, settings))
+            self._take_tokens(url, 1, settings)
+            if not breaker.allow(settings['breaker_reset']):
+                raise VsdcUnavailable(f'VSDC endpoint {url} is unavailable, retry later.')
+            try:
+                response, error, latency = _send(url, kwargs, settings['max_retries'], settings['backoff'])
+            except Exception:
+                # Anything but a RequestException (bad kwargs, ...): still end a half-open probe
+                breaker.record(False, settings['breaker_threshold'])
+                raise
+            breaker.record(not _is_failure(response, error), settings['breaker_threshold'])
+            if response is not None and kwargs.get('stream'):
+                # The body is still to be read: keep the slot until the response is closed
+                _release_on_close(response, slot.pop_all())
+        vsdc_metrics.record(_endpoint_key(url), latency, kwargs, response, error)
+        vsdc_metrics.flush(self.env.registry)
+        if error is not None:
+            raise error
+        return response
+
+    @api.model
+    def post_many(self, calls):
+        """POST several requests concurrently on a bounded thread pool.
+
+        ``calls`` is a list of ``(url, kwargs)`` tuples. Returns a list of
+        ``(response, exception)`` tuples in the same order; exactly one of the
+        two is set. The worker threads only do HTTP, callers apply the results.
+        Calls to an endpoint whose breaker is open get a ``VsdcUnavailable``,
+        calls that could not get a rate or in-flight slot in time a ``VsdcBusy``.
+        """
+        if not calls:
+            return []
+        settings = self._get_settings()
+        timeout = (settings['connect_timeout'], settings['read_timeout'])
+        results = [None] * len(calls)
+        groups = {}
+        for index, (url, kwargs) in enumerate(calls):
+            kwargs = dict(kwargs)
+            kwargs.setdefault('timeout', timeout)
+            groups.setdefault(url, []).append((index, kwargs))
+        _logger.info(f"Dispatching {len(calls)} VSDC requests on {settings['max_workers']} workers")
+        executor = get_executor(settings['max_workers'])
+        for url, jobs in groups.items():
+            breaker = get_breaker(url)
+            try:
+                with self._in_flight_slots(url, min(len(jobs), settings['max_workers']), settings) as slots:
+                    for start in range(0, len(jobs), slots):
+                        chunk = jobs[start:start + slots]
+                        self._take_tokens(url, len(chunk), settings)
+                        futures = []
+                        for index, kwargs in chunk:
+                            if not breaker.allow(settings['breaker_reset']):
+                                results[index] = (None, VsdcUnavailable(
+                                    f'VSDC endpoint {url} is unavailable, retry later.'))
+                                continue
+                            try:
+                                futures.append((index, executor.submit(
+                                    _send, url, kwargs, settings['max_retries'], settings['backoff'])))
+                            except Exception:
+                                breaker.record(False, settings['breaker_threshold'])
+                                raise
+                        for index, future in futures:
+                            try:
+                                response, error, latency = future.result()
+                            except Exception as e:
+                                # Not a RequestException: count it as a failed call rather than
+                                # leaving a half-open probe pending forever
+                                response, error, latency = None, e, 0.0
+                            breaker.record(not _is_failure(response, error), settings['breaker_threshold'])
+                            vsdc_metrics.record(_endpoint_key(url), latency, calls[index][1], response, error)
+                            results[index] = (response, error)
+            except VsdcBusy as e:
+                _logger.warning(str(e))
+                for index, kwargs in jobs:
+                    if results[index] is None:
+                        results[index] = (None, e)
+        vsdc_metrics.flush(self.env.registry)
+        return results
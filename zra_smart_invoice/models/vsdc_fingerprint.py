@@ -0,0 +1,108 @@
+from odoo import models, fields, api
+from odoo.tools import float_compare
+import hashlib
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Audit fields that change with the user sending the data, not with the data itself
+VOLATILE_KEYS = ('regrId', 'regrNm', 'modrId', 'modrNm')
+QTY_PRECISION = 4
+
+
+class ZraVsdcFingerprint(models.Model):
+    _name = 'zra.vsdc.fingerprint'
+    _description = 'ZRA VSDC Acknowledged Payload'
+    _rec_name = 'item_cd'
+
+    company_id = fields.Many2one('res.company', string='Company', required=True, ondelete='cascade')
+    endpoint = fields.Char(string='Endpoint', required=True)
+    item_cd = fields.Char(string='Item Code', required=True)
+    digest = fields.Char(string='Payload Digest')
+    rsd_qty = fields.Float(string='Reported Quantity', digits=(16, QTY_PRECISION))
+    acknowledged_at = fields.Datetime(string='Acknowledged At')
+
+    _sql_constraints = [
+        ('company_endpoint_item_unique', 'unique(company_id, endpoint, item_cd)',
+         'Only one acknowledged payload is kept per company, endpoint and item.'),
+    ]
+
+    @api.model
+    def _digest(self, payload):
+        data = {key: value for key, value in payload.items() if key not in VOLATILE_KEYS}
+        return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+    @api.model
+    def _lookup(self, endpoint, item_codes):
+        records = self.sudo().search([
+            ('company_id', '=', self.env.company.id),
+            ('endpoint', '=', endpoint),
+            ('item_cd', 'in', list(item_codes)),
+        ])
+        return {record.item_cd: record for record in records}
+
+    @api.model
+    def _upsert(self, endpoint, rows):
+        """rows: [(item_cd, digest, rsd_qty)]; store them as the last acknowledged state."""
+        # One row per item, the last one wins (ON CONFLICT cannot update a row twice)
+        rows = list({row[0]: row for row in rows if row[0]}.values())
+        if not rows:
+            return
+        now = fields.Datetime.now()
+        company_id, uid = self.env.company.id, self.env.uid
+        values = [(company_id, endpoint, item_cd, digest, rsd_qty, now, uid, now, uid, now)
+                  for item_cd, digest, rsd_qty in rows]
+        self.env.cr.execute("""
+            INSERT INTO zra_vsdc_fingerprint
+                (company_id, endpoint, item_cd, digest, rsd_qty, acknowledged_at,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES %s
+            ON CONFLICT (company_id, endpoint, item_cd) DO UPDATE
+            SET digest = EXCLUDED.digest,
+                rsd_qty = EXCLUDED.rsd_qty,
+                acknowledged_at = EXCLUDED.acknowledged_at,
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+        """ % ', '.join(['%s'] * len(values)), values)
+        self.invalidate_model()
+
+    # Item registrations (saveItem/updateItem): one payload per item
+
+    @api.model
+    def is_unchanged(self, endpoint, item_cd, payload):
+        if not item_cd or self.env.context.get('zra_force_send'):
+            return False
+        record = self._lookup(endpoint, [item_cd]).get(item_cd)
+        return bool(record) and record.digest == self._digest(payload)
+
+    @api.model
+    def remember(self, endpoint, item_cd, payload):
+        self._upsert(endpoint, [(item_cd, self._digest(payload), 0.0)])
+
+    # Stock master (saveStockMaster): residual quantity per item
+
+    @api.model
+    def filter_stock_master(self, endpoint, payload):
+        """Return the payload restricted to the items whose rsdQty differs from the last
+        acknowledged one, or None when there is nothing left to report."""
+        items = payload.get('stockItemList') or []
+        if self.env.context.get('zra_force_send'):
+            return payload if items else None
+        known = self._lookup(endpoint, {item.get('itemCd') for item in items if item.get('itemCd')})
+        changed = [
+            item for item in items
+            if item.get('itemCd') not in known
+            or float_compare(known[item['itemCd']].rsd_qty, item.get('rsdQty') or 0.0,
+                             precision_digits=QTY_PRECISION) != 0
+        ]
+        if len(changed) < len(items):
+            _logger.info(f'Stock master: {len(items) - len(changed)} unchanged item(s) not sent to {endpoint}')
+        if not changed:
+            return None
+        return dict(payload, stockItemList=changed)
+
+    @api.model
+    def remember_stock_master(self, endpoint, payload):
+        self._upsert(endpoint, [(item.get('itemCd'), None, item.get('rsdQty') or 0.0)
+                                for item in payload.get('stockItemList') or []])
@@ -0,0 +1,176 @@
+from odoo import models, fields, api
+import threading
+import time
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FLUSH_INTERVAL = 30.0
+
+# Samples recorded by this worker and not yet flushed to zra_vsdc_metric
+_pending = {}
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _payload_size(kwargs):
+    if kwargs.get('data') is not None:
+        return len(kwargs['data'])
+    if kwargs.get('json') is not None:
+        return len(json.dumps(kwargs['json']))
+    return 0
+
+
+def _response_size(response, stream):
+    if response is None:
+        return 0
+    if stream:
+        return int(response.headers.get('Content-Length') or 0)
+    return len(response.content)
+
+
+def _result_code(response, error, stream=False):
+    if error is not None:
+        return 'error'
+    if response.status_code != 200:
+        return f'http_{response.status_code}'
+    if stream:
+        # The body is read by the caller as it arrives, its result code is not known here
+        return 'stream'
+    try:
+        return str(response.json().get('resultCd') or 'none')
+    except ValueError:
+        return 'invalid_json'
+
+
+def record(endpoint, latency, kwargs, response, error):
+    """Account one VSDC call. Cheap: only updates this worker's counters."""
+    stream = bool(kwargs.get('stream'))
+    key = (endpoint, _result_code(response, error, stream))
+    bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound), len(LATENCY_BUCKETS))
+    with _pending_lock:
+        sample = _pending.setdefault(key, {
+            'count': 0, 'latency_sum': 0.0, 'latency_max': 0.0, 'bytes_sent': 0, 'bytes_received': 0,
+            'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        })
+        sample['count'] += 1
+        sample['latency_sum'] += latency
+        sample['latency_max'] = max(sample['latency_max'], latency)
+        sample['bytes_sent'] += _payload_size(kwargs)
+        sample['bytes_received'] += _response_size(response, stream)
+        sample['buckets'][bucket] += 1
+
+
+def flush(registry, force=False):
+    """Add this worker's counters to the shared zra_vsdc_metric rows, at most every FLUSH_INTERVAL."""
+    global _pending, _last_flush
+    with _pending_lock:
+        if not _pending or (not force and time.monotonic() - _last_flush < FLUSH_INTERVAL):
+            return
+        samples, _pending = _pending, {}
+        _last_flush = time.monotonic()
+    bucket_columns = [f'bucket_{index}' for index in range(len(LATENCY_BUCKETS) + 1)]
+    columns = ['endpoint', 'result_cd', 'count', 'latency_sum', 'latency_max', 'bytes_sent', 'bytes_received'] \
+        + bucket_columns
+    updates = ', '.join(
+        [f'{column} = GREATEST(zra_vsdc_metric.{column}, EXCLUDED.{column})' if column == 'latency_max'
+         else f'{column} = zra_vsdc_metric.{column} + EXCLUDED.{column}' for column in columns[2:]])
+    try:
+        with registry.cursor() as cr:
+            for (endpoint, result_cd), sample in samples.items():
+                values = [endpoint, result_cd, sample['count'], sample['latency_sum'], sample['latency_max'],
+                          sample['bytes_sent'], sample['bytes_received']] + sample['buckets']
+                cr.execute(f"""
+                    INSERT INTO zra_vsdc_metric ({', '.join(columns)}, create_date, write_date)
+                    VALUES ({', '.join(['%s'] * len(columns))}, NOW() AT TIME ZONE 'UTC', NOW() AT TIME ZONE 'UTC')
+                    ON CONFLICT (endpoint, result_cd) DO UPDATE SET {updates}, write_date = EXCLUDED.write_date
+                """, values)
+    except Exception as e:
+        # Metrics must never break a VSDC call
+        _logger.warning(f'Could not flush VSDC metrics: {e}')
+
+
+class ZraVsdcMetric(models.Model):
+    _name = 'zra.vsdc.metric'
+    _description = 'ZRA VSDC Call Metrics'
+    _order = 'endpoint, result_cd'
+    _rec_name = 'endpoint'
+
+    endpoint = fields.Char(string='Endpoint', required=True, readonly=True)
+    result_cd = fields.Char(string='Result Code', required=True, readonly=True)
+    count = fields.Integer(string='Calls', readonly=True, group_operator='sum')
+    latency_sum = fields.Float(string='Total Latency (s)', readonly=True)
+    latency_max = fields.Float(string='Max Latency (s)', readonly=True, group_operator='max')
+    latency_avg = fields.Float(string='Average Latency (s)', compute='_compute_latency_avg')
+    bytes_sent = fields.Integer(string='Bytes Sent', readonly=True)
+    bytes_received = fields.Integer(string='Bytes Received', readonly=True)
+    bucket_0 = fields.Integer(string='<= 0.1s', readonly=True)
+    bucket_1 = fields.Integer(string='<= 0.25s', readonly=True)
+    bucket_2 = fields.Integer(string='<= 0.5s', readonly=True)
+    bucket_3 = fields.Integer(string='<= 1s', readonly=True)
+    bucket_4 = fields.Integer(string='<= 2.5s', readonly=True)
+    bucket_5 = fields.Integer(string='<= 5s', readonly=True)
+    bucket_6 = fields.Integer(string='<= 10s', readonly=True)
+    bucket_7 = fields.Integer(string='<= 30s', readonly=True)
+    bucket_8 = fields.Integer(string='> 30s', readonly=True)
+
+    _sql_constraints = [
+        ('endpoint_result_unique', 'unique(endpoint, result_cd)', 'One metric row per endpoint and result code.'),
+    ]
+
+    @api.depends('count', 'latency_sum')
+    def _compute_latency_avg(self):
+        for metric in self:
+            metric.latency_avg = metric.latency_sum / metric.count if metric.count else 0.0
+
+    def action_reset(self):
+        self.sudo().unlink()
+        return True
+
+    @api.model
+    def _prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        flush(self.env.registry, force=True)
+        metrics = self.sudo().search([])
+        lines = []
+
+        def _label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+        lines += ['# HELP zra_vsdc_request_duration_seconds VSDC call latency.',
+                  '# TYPE zra_vsdc_request_duration_seconds histogram']
+        by_endpoint = {}
+        for metric in metrics:
+            by_endpoint.setdefault(metric.endpoint, self.browse())
+            by_endpoint[metric.endpoint] |= metric
+        for endpoint, endpoint_metrics in by_endpoint.items():
+            cumulative = 0
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                cumulative += sum(endpoint_metrics.mapped(f'bucket_{index}'))
+                lines.append(f'zra_vsdc_request_duration_seconds_bucket{{endpoint="{_label(endpoint)}",le="{bound}"}} '
+                             f'{cumulative}')
+            total = sum(endpoint_metrics.mapped('count'))
+            lines.append(f'zra_vsdc_request_duration_seconds_bucket{{endpoint="{_label(endpoint)}",le="+Inf"}} {total}')
+            lines.append(f'zra_vsdc_request_duration_seconds_sum{{endpoint="{_label(endpoint)}"}} '
+                         f'{sum(endpoint_metrics.mapped("latency_sum"))}')
+            lines.append(f'zra_vsdc_request_duration_seconds_count{{endpoint="{_label(endpoint)}"}} {total}')
+
+        for name, field, help_text in (
+                ('zra_vsdc_requests_total', 'count', 'VSDC calls by result code.'),
+                ('zra_vsdc_request_bytes_total', 'bytes_sent', 'VSDC request payload bytes.'),
+                ('zra_vsdc_response_bytes_total', 'bytes_received', 'VSDC response payload bytes.')):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for metric in metrics:
+                lines.append(f'{name}{{endpoint="{_label(metric.endpoint)}",result_cd="{_label(metric.result_cd)}"}} '
+                             f'{metric[field]}')
+
+        lines += ['# HELP zra_vsdc_outbox_entries VSDC outbox entries by state and type.',
+                  '# TYPE zra_vsdc_outbox_entries gauge']
+        groups = self.env['zra.outbox'].sudo().read_group([], ['kind'], ['state', 'kind'], lazy=False)
+        for group in groups:
+            lines.append(f'zra_vsdc_outbox_entries{{state="{group["state"]}",kind="{group["kind"]}"}} '
+                         f'{group["__count"]}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,137 @@
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+import requests
+import json
+import logging
+from . import vsdc_stream
+
+_logger = logging.getLogger(__name__)
+
+# Remote rows written per round trip while the response is streamed
+STAGING_CHUNK_SIZE = 500
+
+
+class ZraStagingMixin(models.AbstractModel):
+    _name = 'zra.staging.mixin'
+    _description = 'ZRA VSDC Staging Mixin'
+    _order = 'id'
+
+    company_id = fields.Many2one('res.company', string='Company', required=True, index=True, ondelete='cascade')
+    key = fields.Char(string='Key', required=True, index=True)
+    name = fields.Char(string='Label')
+    payload = fields.Text(string='Payload')
+    synced_at = fields.Datetime(string='Synced At')
+
+    _sql_constraints = [
+        ('company_key_unique', 'unique(company_id, key)', 'A staged VSDC record must be unique per company.'),
+    ]
+
+    @api.model
+    def _iter_remote_rows(self):
+        """Yield (key, vals) for the current company; raise if the fetch fails."""
+        raise NotImplementedError()
+
+    @api.model
+    def _sync_company(self, company):
+        """Stage the remote rows chunk by chunk, so only one chunk is held in memory."""
+        model = self.with_company(company)
+        now = fields.Datetime.now()
+        seen = set()
+        created = 0
+        try:
+            for chunk in vsdc_stream.iter_chunks(model._iter_remote_rows(), STAGING_CHUNK_SIZE):
+                rows = dict(chunk)
+                staged = model.sudo().search([('company_id', '=', company.id), ('key', 'in', list(rows))])
+                existing = {record.key: record for record in staged}
+                to_create = []
+                for key, vals in rows.items():
+                    record = existing.get(key)
+                    if record:
+                        if record.payload != vals['payload'] or record.name != vals['name']:
+                            record.write(dict(vals, synced_at=now))
+                    else:
+                        to_create.append(dict(vals, key=key, company_id=company.id, synced_at=now))
+                if to_create:
+                    model.sudo().create(to_create)
+                    created += len(to_create)
+                seen.update(rows)
+                model.env.flush_all()
+                model.env.invalidate_all()
+        except (requests.exceptions.RequestException, ValueError, UserError) as e:
+            _logger.error(f'{model._name}: fetch failed for company {company.name}: {e}')
+            return False
+        # Drop what the VSDC no longer returns
+        stale = model.sudo().search([('company_id', '=', company.id), ('key', 'not in', list(seen))])
+        removed = len(stale)
+        stale.unlink()
+        _logger.info(f'{model._name}: {created} staged, {removed} removed for company {company.name}')
+        return True
+
+    @api.model
+    def _cron_sync(self):
+        companies = self.env['res.company'].sudo().search([('tpin', '!=', False)])
+        for company in companies:
+            self._sync_company(company)
+            self.env.cr.commit()
+
+    @api.model
+    def _selection(self, domain=None):
+        records = self.sudo().search_read([('company_id', '=', self.env.company.id)] + (domain or []),
+                                          ['key', 'name'])
+        return [(record['key'], record['name']) for record in records]
+
+    @api.model
+    def _get_payload(self, key):
+        record = self.sudo().search([('company_id', '=', self.env.company.id), ('key', '=', key)], limit=1)
+        return json.loads(record.payload) if record.payload else None
+
+    @api.model
+    def _get_payloads(self):
+        records = self.sudo().search([('company_id', '=', self.env.company.id)])
+        return [json.loads(record.payload) for record in records if record.payload]
+
+
+class ZraImportStaging(models.Model):
+    _name = 'zra.import.staging'
+    _inherit = 'zra.staging.mixin'
+    _description = 'ZRA Import Items Staging'
+
+    task_cd = fields.Char(string='Task Code', index=True)
+    dcl_no = fields.Char(string='Declaration Number')
+    item_seq = fields.Integer(string='Item Sequence')
+
+    @api.model
+    def _iter_remote_rows(self):
+        for item in self.env['import.data']._stream_import_items():
+            key = f"{item['taskCd']}_{item['itemSeq']}"
+            yield key, {
+                'name': f"{item['itemNm']} - {item['taskCd']} - {item['orgnNatCd']}",
+                'task_cd': item['taskCd'],
+                'dcl_no': item.get('dclNo'),
+                'item_seq': item['itemSeq'],
+                'payload': json.dumps(item, sort_keys=True),
+            }
+
+
+class ZraPurchaseStaging(models.Model):
+    _name = 'zra.purchase.staging'
+    _inherit = 'zra.staging.mixin'
+    _description = 'ZRA Purchase Sales Staging'
+
+    spplr_invc_no = fields.Integer(string='Supplier Invoice No', index=True)
+    spplr_tpin = fields.Char(string='Supplier TPIN')
+    spplr_nm = fields.Char(string='Supplier Name')
+
+    @api.model
+    def _iter_remote_rows(self):
+        for sale in self.env['purchase.data']._stream_purchase_sales():
+            if not sale.get('spplrInvcNo'):
+                continue
+            item_nm = sale['itemList'][0]['itemNm'] if sale['itemList'] else 'No Item'
+            yield str(sale['spplrInvcNo']), {
+                'name': f"{sale['spplrNm']} - {sale['spplrTpin']} - {item_nm}",
+                'spplr_invc_no': sale['spplrInvcNo'],
+                'spplr_tpin': sale['spplrTpin'],
+                'spplr_nm': sale['spplrNm'],
+                'payload': json.dumps(sale, sort_keys=True),
+            }
@@ -0,0 +1,150 @@
+import codecs
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+CHUNK_BYTES = 64 * 1024
+WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+class JsonListStream(object):
+    """Iterate over the elements of the first ``list_key`` array of a JSON document
+    read chunk by chunk. Only one element is decoded at a time, so memory stays
+    bounded by the largest element rather than by the whole response.
+
+    Elements must be objects or arrays. Once the iteration is over, ``envelope``
+    holds the rest of the document (resultCd, resultMsg, ...) with an empty list
+    in place of the streamed one.
+    """
+
+    def __init__(self, chunks, list_key):
+        self._chunks = iter(chunks)
+        self._key = list_key
+        self._decode = codecs.getincrementaldecoder('utf-8')().decode
+        self._buf = ''
+        self._pos = 0
+        self._in_list = False
+        self._outside = []  # parts of the document around the list
+        self._eof = False
+        self.envelope = None
+        self.count = 0
+
+    def _more(self):
+        """Read the next chunk; text already consumed is dropped, or kept for the envelope."""
+        if self._eof:
+            return False
+        if not self._in_list:
+            self._outside.append(self._buf[:self._pos])
+        self._buf, self._pos = self._buf[self._pos:], 0
+        for chunk in self._chunks:
+            if chunk:
+                self._buf += self._decode(chunk)
+                return True
+        self._buf += self._decode(b'', True)
+        self._eof = True
+        return False
+
+    def _skip_whitespace(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return True
+            if not self._more():
+                return False
+
+    def _raw_decode(self):
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                # Most likely cut by the chunk boundary
+                if not self._more():
+                    raise
+                continue
+            self._pos = end
+            return value
+
+    def _find_list(self):
+        while True:
+            if not self._skip_whitespace():
+                return False
+            char = self._buf[self._pos]
+            if char != '"':
+                self._pos += 1
+                continue
+            token = self._raw_decode()
+            if token != self._key or not self._skip_whitespace() or self._buf[self._pos] != ':':
+                continue
+            self._pos += 1
+            if self._skip_whitespace() and self._buf[self._pos] == '[':
+                self._pos += 1
+                return True
+
+    def _finish(self):
+        while self._more():
+            pass
+        self._outside.append(self._buf[self._pos:])
+        self._buf, self._pos = '', 0
+        self.envelope = json.loads(''.join(self._outside))
+
+    def __iter__(self):
+        if not self._find_list():
+            self._finish()
+            return
+        # Keep the opening bracket in the envelope, drop the elements
+        self._outside.append(self._buf[:self._pos])
+        self._buf, self._pos = self._buf[self._pos:], 0
+        self._in_list = True
+        while True:
+            if not self._skip_whitespace():
+                raise ValueError(f'Truncated JSON in {self._key}')
+            if self._buf[self._pos] == ']':
+                break
+            if self.count:
+                if self._buf[self._pos] != ',':
+                    raise ValueError(f'Malformed JSON in {self._key} at element {self.count}')
+                self._pos += 1
+                if not self._skip_whitespace():
+                    raise ValueError(f'Truncated JSON in {self._key}')
+            item = self._raw_decode()
+            self.count += 1
+            yield item
+        self._in_list = False
+        self._buf, self._pos = self._buf[self._pos:], 0
+        self._finish()
+
+
+def iter_chunks(items, size):
+    """Group an iterable into lists of at most ``size`` elements."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_list(response, list_key):
+    """Stream ``list_key`` out of a ``stream=True`` VSDC response; the connection
+    is released once the iteration is over."""
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    stream = JsonListStream(response.iter_content(CHUNK_BYTES), list_key)
+
+    def _items():
+        try:
+            for item in stream:
+                yield item
+        finally:
+            response.close()
+        _logger.info(f'Streamed {stream.count} {list_key} entries from {response.url}')
+
+    return stream, _items()
@@ -50,7 +50,7 @@ class ZraSmartInvoice(models.Model):
             "dvcSrlNo": f"{company.tpin}_VSDC"
         }
         try:
-            response = requests.post(url, json=payload)
+            response = self.env['zra.vsdc.client'].post(url, json=payload)
             if response.status_code == 200:
                 result = response.json()
                 if result.get("resultCd") != "000":
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""Local stand-in for the ZRA VSDC, for load and regression testing.
+
+Standard library only, runs next to Odoo on a dev box or in CI:
+
+    python3 tools/vsdc_simulator.py --port 8099 --latency-ms 80 --jitter-ms 40 \\
+        --error-rate 0.01 --import-items 5000 --purchases 2000
+
+then press "Use VSDC Simulator" on the company Endpoints tab (or point the
+endpoint fields at http://localhost:8099/...). Requests are routed on the last
+two path segments, so any prefix such as /sandbox works.
+
+GET /stats returns the number of calls per endpoint, POST /stats/reset clears it.
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_logger = logging.getLogger('vsdc_simulator')
+
+CODE_CLASSES = {
+    '05': 'Country',
+    '10': 'Quantity Unit',
+    '17': 'Packaging Unit',
+}
+ITEM_NAMES = ['Cement', 'Copper Wire', 'Maize Meal', 'Cooking Oil', 'Fertiliser', 'Solar Panel', 'Steel Bar',
+              'Paint', 'Rice', 'Sugar', 'Tyre', 'Battery', 'Cable', 'Pipe', 'Soap']
+
+
+def _now():
+    return datetime.now().strftime('%Y%m%d%H%M%S')
+
+
+class Dataset(object):
+    """Synthetic reference and transaction data, generated once at start-up."""
+
+    def __init__(self, options):
+        rng = random.Random(options.seed)
+        self.generated_at = _now()
+        self.codes = [{
+            'cdCls': cd_cls,
+            'cdClsNm': name,
+            'useYn': 'Y',
+            'dtlList': [{'cd': f'{cd_cls}{index:04d}', 'cdNm': f'{name} {index}', 'srtOrd': index, 'useYn': 'Y'}
+                        for index in range(options.codes_per_class)],
+        } for cd_cls, name in CODE_CLASSES.items()]
+        self.item_classes = [{
+            'itemClsCd': f'{10000000 + index}',
+            'itemClsNm': f'Item Class {index}',
+            'itemClsLvl': 4,
+            'taxTyCd': rng.choice(['A', 'B', 'C1', 'D']),
+            'mjrTgYn': 'N',
+            'useYn': 'Y',
+        } for index in range(options.item_classes)]
+        self.import_items = []
+        for index in range(options.import_items):
+            declaration = index // 10
+            self.import_items.append({
+                'taskCd': f'T{declaration:07d}',
+                'dclDe': '20240501',
+                'itemSeq': index % 10 + 1,
+                'dclNo': f'DCL{declaration:07d}',
+                'hsCd': f'{rng.randint(1000000000, 9999999999)}',
+                'itemNm': f'{rng.choice(ITEM_NAMES)} {index}',
+                'imptItemsttsCd': '2',
+                'orgnNatCd': rng.choice(['ZA', 'CN', 'IN', 'TZ']),
+                'exptNatCd': 'ZM',
+                'pkg': rng.randint(1, 50),
+                'pkgUnitCd': 'BX',
+                'qty': rng.randint(1, 500),
+                'qtyUnitCd': 'U',
+                'totWt': round(rng.uniform(1, 1000), 2),
+                'netWt': round(rng.uniform(1, 1000), 2),
+                'spplrNm': f'Supplier {rng.randint(1, 50)}',
+                'agntNm': f'Agent {rng.randint(1, 20)}',
+                'invcFcurAmt': round(rng.uniform(100, 100000), 2),
+                'invcFcurCd': 'USD',
+                'invcFcurExcrt': 26.5,
+                'remark': None,
+            })
+        self.purchases = []
+        for index in range(options.purchases):
+            items = []
+            for seq in range(1, options.items_per_purchase + 1):
+                qty = rng.randint(1, 100)
+                prc = round(rng.uniform(10, 1000), 2)
+                sply_amt = round(qty * prc, 2)
+                vat_amt = round(sply_amt * 0.16, 2)
+                items.append({
+                    'itemSeq': seq, 'itemCd': f'ZM2BXU{index * 100 + seq:07d}', 'itemClsCd': '10000000',
+                    'itemNm': f'{rng.choice(ITEM_NAMES)} {index}-{seq}', 'bcd': None, 'pkgUnitCd': 'BX', 'pkg': 1,
+                    'qtyUnitCd': 'U', 'qty': qty, 'prc': prc, 'splyAmt': sply_amt, 'dcRt': 0, 'dcAmt': 0,
+                    'vatCatCd': 'A', 'vatTaxblAmt': sply_amt, 'taxblAmt': sply_amt, 'vatAmt': vat_amt,
+                    'totAmt': round(sply_amt + vat_amt, 2),
+                })
+            self.purchases.append({
+                'spplrTpin': f'{1000000000 + index % 500}', 'spplrNm': f'Supplier {index % 500}', 'spplrBhfId': '000',
+                'spplrInvcNo': index + 1, 'rcptTyCd': 'S', 'pmtTyCd': '01',
+                'cfmDt': '2024-05-01 10:00:00', 'salesDt': '20240501', 'stockRlsDt': '2024-05-01 10:00:00',
+                'totItemCnt': len(items),
+                'totTaxblAmt': round(sum(item['taxblAmt'] for item in items), 2),
+                'totTaxAmt': round(sum(item['vatAmt'] for item in items), 2),
+                'totAmt': round(sum(item['totAmt'] for item in items), 2),
+                'remark': None, 'itemList': items,
+            })
+
+
+class Simulator(object):
+
+    def __init__(self, options):
+        self.options = options
+        self.dataset = Dataset(options)
+        self.rng = random.Random(options.seed)
+        self.lock = threading.Lock()
+        self.receipt_no = 0
+        self.stats = {}
+        self.handlers = {
+            'trnsSales/saveSales': self.save_sales,
+            'stock/saveStockItems': self.ok,
+            'stockMaster/saveStockMaster': self.ok,
+            'items/saveItem': self.ok,
+            'items/updateItem': self.ok,
+            'items/saveItemComposition': self.ok,
+            'trnsPurchase/savePurchase': self.ok,
+            'imports/updateImportItems': self.ok,
+            'imports/selectImportItems': self.select_import_items,
+            'trnsPurchase/selectTrnsPurchaseSales': self.select_purchases,
+            'code/selectCodes': self.select_codes,
+            'itemClass/selectItemsClass': self.select_item_classes,
+            'initializer/selectInitInfo': self.select_init_info,
+        }
+
+    def count(self, route, outcome):
+        with self.lock:
+            self.stats.setdefault(route, {}).setdefault(outcome, 0)
+            self.stats[route][outcome] += 1
+
+    @staticmethod
+    def result(data=None, result_cd='000', result_msg='It is succeeded'):
+        return {'resultCd': result_cd, 'resultMsg': result_msg, 'resultDt': _now(), 'data': data}
+
+    def unchanged_since(self, payload):
+        # Reference data never changes after start-up: answer 001 to any lastReqDt past it
+        last_req_dt = str((payload or {}).get('lastReqDt') or '')
+        return last_req_dt and last_req_dt >= self.dataset.generated_at
+
+    def ok(self, payload):
+        return self.result()
+
+    def save_sales(self, payload):
+        with self.lock:
+            self.receipt_no += 1
+            receipt_no = self.receipt_no
+        return self.result({
+            'rcptNo': receipt_no,
+            'intrlData': f'SIM{receipt_no:010d}',
+            'rcptSign': f'SIGN{receipt_no:012d}',
+            'vsdcRcptPbctDate': _now(),
+            'sdcId': 'SDC0000000001',
+            'mrcNo': 'MRC0000000001',
+            'qrCodeUrl': f'http://{self.options.host}:{self.options.port}/qr/{receipt_no}',
+        })
+
+    def select_import_items(self, payload):
+        return self.result({'itemList': self.dataset.import_items})
+
+    def select_purchases(self, payload):
+        return self.result({'saleList': self.dataset.purchases})
+
+    def select_codes(self, payload):
+        if self.unchanged_since(payload):
+            return self.result(None, '001', 'There is no search result')
+        return self.result({'clsList': self.dataset.codes})
+
+    def select_item_classes(self, payload):
+        if self.unchanged_since(payload):
+            return self.result(None, '001', 'There is no search result')
+        return self.result({'itemClsList': self.dataset.item_classes})
+
+    def select_init_info(self, payload):
+        payload = payload or {}
+        return self.result({'info': {
+            'tpin': payload.get('tpin'), 'taxprNm': 'Simulated Taxpayer', 'bsnsActv': None,
+            'bhfId': payload.get('bhfId') or '000', 'bhfNm': 'Headquarter', 'bhfOpenDt': '20240101',
+            'prvncNm': 'LUSAKA', 'dstrtNm': 'LUSAKA', 'sctrNm': 'LUSAKA', 'locDesc': None,
+            'hqYn': 'Y', 'mgrNm': None, 'mgrTelNo': None, 'mgrEmail': None,
+            'sdcId': 'SDC0000000001', 'mrcNo': 'MRC0000000001', 'lastPchsInvcNo': 0,
+            'lastSaleRcptNo': self.receipt_no, 'lastInvcNo': None, 'lastSaleInvcNo': None,
+            'lastTrainInvcNo': None, 'lastProfrmInvcNo': None, 'lastCopyInvcNo': None,
+        }})
+
+    def handle(self, route, payload):
+        """Return (http_status, body) for a request, after the configured latency and faults."""
+        options = self.options
+        delay = max(0.0, self.rng.gauss(options.latency_ms, options.jitter_ms)) / 1000.0
+        if delay:
+            time.sleep(delay)
+        handler = self.handlers.get(route)
+        if handler is None:
+            self.count(route, 'not_found')
+            return 404, {'resultCd': '404', 'resultMsg': f'Unknown endpoint {route}'}
+        roll = self.rng.random()
+        if roll < options.http_error_rate:
+            self.count(route, 'http_503')
+            return 503, {'resultCd': '503', 'resultMsg': 'Simulated service unavailable'}
+        if roll < options.http_error_rate + options.error_rate:
+            self.count(route, options.error_code)
+            return 200, self.result(None, options.error_code, 'Simulated VSDC error')
+        self.count(route, 'ok')
+        return 200, handler(payload)
+
+
+def make_handler(simulator):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/stats':
+                with simulator.lock:
+                    return self._reply(200, simulator.stats)
+            return self._reply(404, {'resultCd': '404', 'resultMsg': 'Not found'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            if self.path.rstrip('/') == '/stats/reset':
+                with simulator.lock:
+                    simulator.stats.clear()
+                return self._reply(200, {})
+            try:
+                payload = json.loads(raw.decode('utf-8')) if raw else {}
+            except ValueError:
+                return self._reply(400, {'resultCd': '400', 'resultMsg': 'Invalid JSON'})
+            route = '/'.join(self.path.split('?')[0].rstrip('/').split('/')[-2:])
+            status, body = simulator.handle(route, payload)
+            self._reply(status, body)
+
+        def log_message(self, format, *args):
+            _logger.debug(format % args)
+
+    return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local ZRA VSDC simulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='mean response latency')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='standard deviation of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls answered with --error-code')
+    parser.add_argument('--error-code', default='999', help='resultCd returned by injected errors')
+    parser.add_argument('--http-error-rate', type=float, default=0.0, help='share of calls answered with HTTP 503')
+    parser.add_argument('--import-items', type=int, default=100)
+    parser.add_argument('--purchases', type=int, default=50)
+    parser.add_argument('--items-per-purchase', type=int, default=3)
+    parser.add_argument('--item-classes', type=int, default=500)
+    parser.add_argument('--codes-per-class', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    simulator = Simulator(options)
+    server = ThreadingHTTPServer((options.host, options.port), make_handler(simulator))
+    _logger.info(f'VSDC simulator listening on http://{options.host}:{options.port} '
+                 f'({len(simulator.dataset.import_items)} import items, '
+                 f'{len(simulator.dataset.purchases)} purchases)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()